@@ -0,0 +1,33 @@
+import typing as t
+
+from importlib import import_module
+
+if t.TYPE_CHECKING:
+    from scraby.core.executor import Executor
+    from scraby.core.parser import dialect, parse, UnsupportedQuery
+    from scraby.utils.plan import explain
+
+
+#  INFO: modules are imported on first use of their attributes, so importing
+#  scraby alone doesn't pay for SQLGlot import
+_LAZY = {
+    "Executor": "scraby.core.executor",
+    "dialect": "scraby.core.parser",
+    "explain": "scraby.utils.plan",
+    "parse": "scraby.core.parser",
+    "UnsupportedQuery": "scraby.core.parser",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name: str) -> t.Any:
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> t.List[str]:
+    return sorted({*globals(), *_LAZY})
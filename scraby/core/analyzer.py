@@ -1 +1,131 @@
-#  TODO: generate a python query tree from syntax tree here
+import typing as t
+
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+from sqlglot import exp
+from scraby.core.extractor import column
+from scraby.core.parser import CompactTag, LoadPage, ScrabyDialect, Tag, TagAttr
+from scraby.utils.html import HTMLTag
+from scraby.utils.plan import Plan, Source
+
+
+class BudgetExceeded(ValueError):
+    """ Query is estimated to cost more than the budget allows """
+
+
+@dataclass(frozen=True)
+class Budget:
+    """ Limits of the query cost, None for no limit
+
+    Parameters:
+        max_pages (int): max number of fetched pages, queries with LOAD of
+            all pages (-1) are unbounded & always exceed it
+        max_hosts (int): max number of distinct hosts fetched concurrently
+        max_selectors (int): max number of distinct tag selectors
+        max_regex (int): max number of regex tag attributes
+        max_fanout (int): max number of page combinations of joined sources
+
+    """
+    max_pages: t.Optional[int] = 1000
+    max_hosts: t.Optional[int] = 16
+    max_selectors: t.Optional[int] = 256
+    max_regex: t.Optional[int] = None
+    max_fanout: t.Optional[int] = None
+
+
+@dataclass
+class Cost:
+    """ Cost of the query estimated before it's run
+
+    Parameters:
+        loads (int): number of LOAD functions
+        pages (int): number of pages fetched by the plan, LOAD functions of
+            the same url share their pages; None if unbounded
+        hosts (list[str]): distinct hosts of the fetched pages
+        selectors (int): number of distinct tag selectors
+        regex (int): number of regex tag attributes
+        fanout (int): number of page combinations of the sources joined in
+            FROM clause; None if any of them is unbounded
+
+    """
+    loads: int = 0
+    pages: t.Optional[int] = 0
+    hosts: t.List[str] = field(default_factory=list)
+    selectors: int = 0
+    regex: int = 0
+    fanout: t.Optional[int] = 1
+
+    def violations(self, budget: Budget) -> t.List[str]:
+        """ Get descriptions of the budget's limits the cost exceeds """
+        checks = (
+            ("pages", self.pages, budget.max_pages),
+            ("hosts", len(self.hosts), budget.max_hosts),
+            ("selectors", self.selectors, budget.max_selectors),
+            ("regex attributes", self.regex, budget.max_regex),
+            ("join fan-out", self.fanout, budget.max_fanout),
+        )
+        return [
+            f"{name}: {'unbounded' if value is None else value} > {limit}"
+            for name, value, limit in checks
+            if limit is not None and (value is None or value > limit)
+        ]
+
+
+def _pages(source: Source) -> t.Optional[int]:
+    if not source.paged:
+        return 1
+    return None if source.pages < 0 else source.pages
+
+
+def analyze(expression: exp.Expression) -> Cost:
+    """ Estimate cost of the query walking its syntax tree """
+    plan = Plan.build(expression)
+    cost = Cost(loads=sum(len(x.consumers) for x in plan.fetches))
+    for fetch in plan.fetches:
+        pages = _pages(fetch.source)
+        cost.pages = None if pages is None or cost.pages is None else cost.pages + pages
+        host = urlsplit(fetch.source.url).netloc
+        if host not in cost.hosts:
+            cost.hosts.append(host)
+
+    select = expression if isinstance(expression, exp.Select) else expression.find(exp.Select)
+    tables = []
+    if select is not None:
+        if select.args.get("from"):
+            tables.append(select.args["from"].this)
+        tables.extend(x.this for x in select.args.get("joins") or ())
+    #  INFO: columns are resolved like the optimizer does, with aliases of
+    #  joined sources, e.g. `b.span` of source aliased "b" is `<span>`
+    sources = [x.alias for x in tables if x.alias] if select is not None and select.args.get("joins") else []
+
+    selectors = set()
+    for node in expression.walk():
+        if isinstance(node, Tag):
+            selectors.add(CompactTag.from_tag(node))
+            cost.regex += sum(1 for x in node.expressions if isinstance(x, TagAttr) and x.args.get("is_regular"))
+        elif isinstance(node, exp.Column):
+            found = column(node, sources)
+            if found:
+                selectors.add(CompactTag.from_tag(found.tag))
+        elif isinstance(node, exp.Dot) and isinstance(node.this, LoadPage) \
+        and node.expression.name in ScrabyDialect.TAG_NAMES:
+            #  INFO: tag selected right from the page, e.g. `LOAD(...).div`
+            selectors.add(CompactTag(CompactTag.CODES[HTMLTag(node.expression.name)]))
+    cost.selectors = len(selectors)
+
+    for table in tables:
+        load = table.find(LoadPage)
+        if load is None:
+            continue
+        pages = _pages(Source.from_expression(load).canonical)
+        cost.fanout = None if pages is None or cost.fanout is None else cost.fanout * pages
+    return cost
+
+
+def enforce(expression: exp.Expression, budget: Budget) -> Cost:
+    """ Get cost of the query, raise BudgetExceeded if it exceeds the budget """
+    cost = analyze(expression)
+    violations = cost.violations(budget)
+    if violations:
+        raise BudgetExceeded(f"Query exceeds budget: {', '.join(violations)}")
+    return cost
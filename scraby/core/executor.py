@@ -0,0 +1,1267 @@
+import asyncio
+import codecs
+import functools
+import pickle
+import re
+import socket
+import time
+import typing as t
+import zlib
+
+from collections import Counter, defaultdict, deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import count
+from multiprocessing.shared_memory import SharedMemory
+from urllib.parse import unquote, urljoin, urlsplit
+from sqlglot import exp
+from scraby.core.analyzer import Budget, enforce
+from scraby.core.extractor import Extraction, Extractor, Row
+from scraby.core.join import HashTable
+from scraby.core.optimizer import Join, optimize, Scan
+from scraby.core.parser import dialect, LoadPage, UnsupportedQuery
+from scraby.core.response import charset, decode, Response
+from scraby.core.scheduler import Scheduler, Throttled
+from scraby.core.store import Checkpoint, Progress, ResponseCache, Snapshot
+from scraby.utils.archive import Archive
+from scraby.utils.batch import Batch
+from scraby.utils.plan import Plan, Source
+from scraby.utils.trace import MemorySink, tracer
+
+
+Values = t.Tuple[t.Optional[str], ...]
+""" Values of the row's projected columns """
+
+
+def extract(scan: Scan, extractor: Extractor, text: str) -> t.List[Values]:
+    """ Extract rows of the page passing the scan's prefilter & predicate """
+    if scan.prefilter:
+        with tracer.span("prefilter") as span:
+            span.attrs["passed"] = passed = scan.prefilter(text)
+        if not passed:
+            return []
+    #  INFO: selectors are evaluated within the same pass over the markup
+    with tracer.span("extract", size=len(text)) as span:
+        rows = extractor.extract(text)
+        span.attrs["rows"] = len(rows)
+    return _filter(scan, rows)
+
+
+def _filter(scan: Scan, rows: t.List[Row]) -> t.List[Values]:
+    if not scan.predicate:
+        return [tuple(row[x] for x in scan.output) for row in rows]
+    with tracer.span("filter", rows=len(rows)) as span:
+        result = [tuple(row[x] for x in scan.output) for row in rows if scan.predicate(row)]
+        span.attrs["passed"] = len(result)
+    return result
+
+
+_WORKER: "OrderedDict[t.Tuple[str, t.Optional[int]], t.Tuple[Scan, Extractor]]" = OrderedDict()
+""" Compiled scans of the queries extracted by the worker process, least recently used first """
+
+
+def _compile(query: str, size: int, side: t.Optional[int]) -> t.Tuple[Scan, Extractor]:
+    """ Get compiled scan of the query registered in shared memory, scan of the join's side if it's passed """
+    key = (query, side)
+    if key in _WORKER:
+        _WORKER.move_to_end(key)
+        return _WORKER[key]
+    memory = SharedMemory(name=query)
+    assert memory.buf is not None
+    data = memory.buf[:size]
+    try:
+        expression = pickle.loads(data)
+    finally:
+        data.release()
+        memory.close()
+    plan = optimize(expression)
+    if isinstance(plan, Join):
+        plan = plan.scans[side or 0]
+    _WORKER[key] = (plan, Extractor(plan.columns))
+    #  INFO: worker outlives queries, so keep only recently extracted ones
+    if len(_WORKER) > 64:
+        _WORKER.popitem(last=False)
+    return _WORKER[key]
+
+
+def _extract_shared(
+    query: t.Tuple[str, int], side: t.Optional[int], name: str, size: int, encoding: str
+) -> t.List[Values]:
+    """ Extract rows of the page body passed via shared memory
+
+    Parameters:
+        query (tuple[str, int]): name & size of shared memory the pickled
+            query is registered in, it's compiled once per worker
+        side (int | None): side of the join which scan is extracted
+        name (str): name of shared memory of the body
+        size (int): size of the body
+        encoding (str): charset the body is decoded with
+
+    """
+    memory = SharedMemory(name=name)
+    assert memory.buf is not None
+    body = memory.buf[:size]
+    try:
+        text = decode(body, encoding)
+    finally:
+        body.release()
+        memory.close()
+    return extract(*_compile(*query, side), text)
+
+
+class BodyConsumer:
+    """ Receiver of the response body chunks as they're downloaded """
+    def start(self, status: int, headers: t.Mapping[str, str]) -> None:
+        """ Start receiving body of the response, called again on retries """
+
+    def feed(self, chunk: t.Union[bytes, memoryview]) -> bool:
+        """ Receive decoded chunk of the body & get whether the rest is needed """
+        raise NotImplementedError
+
+
+class StreamExtraction(BodyConsumer):
+    """ Extraction of the scan's rows from the body chunks as they're downloaded
+
+    Chunks are decoded incrementally & fed to the extraction right away.
+    Only rows within the scan's LIMIT & OFFSET are extracted, so once they're
+    complete the rest of the body is not downloaded: no page can contribute
+    more rows to the query. Prefilter is not applied: markup is parsed before
+    the whole page is known.
+
+    Parameters:
+        scan (Scan): scan of the source
+        extractor (Extractor): compiled extractor of the scan's columns
+
+    """
+    def __init__(self, scan: Scan, extractor: Extractor) -> None:
+        self.scan = scan
+        self.extractor = extractor
+        self.limit = None if scan.limit is None else scan.limit + scan.offset
+        """ Number of leading rows of the page the query may produce """
+        self.extraction = Extraction(extractor, self.limit)
+        self.decoder: codecs.IncrementalDecoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.size = 0
+
+    def start(self, status: int, headers: t.Mapping[str, str]) -> None:
+        try:
+            self.decoder = codecs.getincrementaldecoder(charset(headers))(errors="replace")
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.extraction = Extraction(self.extractor, self.limit)
+        self.size = 0
+
+    def feed(self, chunk: t.Union[bytes, memoryview]) -> bool:
+        self.size += len(chunk)
+        self.extraction.feed(self.decoder.decode(chunk))
+        return not self.extraction.complete
+
+    def rows(self) -> t.List[Values]:
+        """ Get rows of the fed body passing the scan's predicate """
+        with tracer.span("extract", size=self.size, streamed=True) as span:
+            self.extraction.feed(self.decoder.decode(b"", final=True))
+            self.extraction.close()
+            rows = self.extraction.rows()
+            span.attrs["rows"] = len(rows)
+        return _filter(self.scan, rows)
+
+
+@dataclass
+class Page:
+    """ Fetched page of the source
+
+    Parameters:
+        source (Source): source the page belongs to
+        index (int): page index starting from 1
+        response (Response): response of the transport
+        consumer (BodyConsumer): consumer the body was fed to while it was
+            downloaded
+
+    """
+    source: Source
+    index: int
+    response: Response
+    consumer: t.Optional[BodyConsumer] = None
+
+
+class SharedPages:  # pylint: disable=too-few-public-methods
+    """ Pages of one fetch operator read by several sources of the query
+
+    Every page is fetched once and handed to the readers of all sources in
+    order, e.g. to both sides of a self-join. Pages are buffered for the
+    readers lagging behind and dropped once every reader got them.
+
+    Parameters:
+        pages (AsyncGenerator[Page]): pages of the fetch operator's source
+        sources (list[Source]): sources of the readers, every reader gets
+            pages within its source's range only
+
+    """
+    def __init__(self, pages: t.AsyncGenerator[Page, None], sources: t.Sequence[Source]) -> None:
+        self.pages = pages
+        self.sources = sources
+        self._buffers: t.List[t.Optional[t.Deque[Page]]] = [deque() for _ in sources]
+        self._lock = asyncio.Lock()
+        self._done = False
+
+    async def _next(self, buffer: t.Deque[Page]) -> t.Optional[Page]:
+        async with self._lock:
+            if not buffer and not self._done:
+                try:
+                    page = await self.pages.__anext__()
+                except StopAsyncIteration:
+                    self._done = True
+                else:
+                    for x in self._buffers:
+                        if x is not None:
+                            x.append(page)
+        return buffer.popleft() if buffer else None
+
+    async def reader(self, index: int) -> t.AsyncGenerator[Page, None]:
+        """ Iterate over pages of the index-th source """
+        buffer, source = self._buffers[index], self.sources[index]
+        assert buffer is not None
+        try:
+            while (page := await self._next(buffer)) is not None:
+                if 0 <= source.pages < page.index:
+                    return
+                yield page
+        finally:
+            self._buffers[index] = None
+            if not any(x is not None for x in self._buffers):
+                await self.pages.aclose()
+
+
+class Transport:
+    """ Base of transports used by executor to fetch pages
+
+    Subclasses implement `request` & `close` coroutines, e.g. in-memory fake
+    for tests, and may implement `stream` to feed body while downloading.
+
+    """
+    async def request(self, url: str, headers: t.Optional[t.Mapping[str, str]] = None) -> Response:
+        raise NotImplementedError
+
+    async def stream(
+        self,
+        url: str,
+        consumer: BodyConsumer,
+        headers: t.Optional[t.Mapping[str, str]] = None,
+    ) -> Response:
+        """ Request the url feeding the body to consumer, which may abort the download
+
+        Body is fed once it's received completely by default.
+
+        """
+        response = await self.request(url, headers)
+        consumer.start(response.status, response.headers)
+        consumer.feed(response.body)
+        return response
+
+    async def close(self) -> None:
+        pass
+
+
+class HTTPTransport(Transport):
+    """ Minimal HTTP/1.1 transport over asyncio streams
+
+    Keeps idle connections open and reuses them for the next requests to the
+    same host, follows redirects and decodes gzip/deflate bodies. Streamed
+    body is decoded & fed chunk by chunk, connection of aborted download is
+    closed.
+
+    Parameters:
+        timeout (float): timeout of connecting & reading in seconds
+        max_idle (int): max number of idle connections kept per host
+        max_redirects (int): max number of followed redirects
+        headers (dict[str, str]): headers sent with every request
+
+    """
+    Connection = t.Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+    CHUNK_SIZE = 65536
+    """ Max size of the streamed body chunk read at once """
+
+    def __init__(
+        self,
+        timeout: float = 30.0,
+        max_idle: int = 8,
+        max_redirects: int = 5,
+        headers: t.Optional[t.Mapping[str, str]] = None,
+    ) -> None:
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_redirects = max_redirects
+        self.headers = {
+            "User-Agent": "scraby",
+            "Accept-Encoding": "gzip, deflate",
+            **(headers or {}),
+        }
+        self.connections = 0
+        """ Number of connections opened, for observing keep-alive reuse """
+        self._idle: t.DefaultDict[t.Tuple[str, str, int], t.List[HTTPTransport.Connection]] = defaultdict(list)
+
+    REDIRECTS = (301, 302, 303, 307, 308)
+
+    BODILESS = (204, 304)
+    """ Statuses of responses with no body, besides interim 1xx ones """
+
+    async def request(self, url: str, headers: t.Optional[t.Mapping[str, str]] = None) -> Response:
+        return await self._follow(url, headers, None)
+
+    async def stream(
+        self,
+        url: str,
+        consumer: BodyConsumer,
+        headers: t.Optional[t.Mapping[str, str]] = None,
+    ) -> Response:
+        return await self._follow(url, headers, consumer)
+
+    async def _follow(
+        self,
+        url: str,
+        headers: t.Optional[t.Mapping[str, str]],
+        consumer: t.Optional[BodyConsumer],
+    ) -> Response:
+        for _ in range(self.max_redirects + 1):
+            response = await asyncio.wait_for(self._request(url, headers, consumer), self.timeout)
+            if response.status not in self.REDIRECTS or "location" not in response.headers:
+                return response
+            url = urljoin(url, response.headers["location"])
+        return response
+
+    async def close(self) -> None:
+        idle = [x for connections in self._idle.values() for x in connections]
+        self._idle.clear()
+        for _, writer in idle:
+            writer.close()
+
+    async def _request(
+        self,
+        url: str,
+        headers: t.Optional[t.Mapping[str, str]],
+        consumer: t.Optional[BodyConsumer] = None,
+    ) -> Response:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname or "", parts.port or (443 if parts.scheme == "https" else 80))
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        head = "".join(f"{k}: {v}\r\n" for k, v in {
+            "Host": parts.netloc,
+            "Connection": "keep-alive",
+            **self.headers,
+            **(headers or {}),
+        }.items())
+        data = f"GET {target} HTTP/1.1\r\n{head}\r\n".encode("latin-1")
+
+        while self._idle[key]:
+            #  INFO: server may have closed idle connection, so retry on new one
+            reader, writer = self._idle[key].pop()
+            try:
+                return await self._exchange(key, url, reader, writer, data, consumer)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+        with tracer.span("fetch.dns", host=key[1]):
+            addresses = await asyncio.get_running_loop().getaddrinfo(key[1], key[2], type=socket.SOCK_STREAM)
+        with tracer.span("fetch.connect", host=key[1]):
+            for i, (*_, address) in enumerate(addresses):
+                try:
+                    reader, writer = await asyncio.open_connection(
+                        str(address[0]), key[2],
+                        ssl=key[0] == "https",
+                        server_hostname=key[1] if key[0] == "https" else None,
+                    )
+                    break
+                except OSError:
+                    if i == len(addresses) - 1:
+                        raise
+        self.connections += 1
+        return await self._exchange(key, url, reader, writer, data, consumer)
+
+    async def _exchange(
+        self,
+        key: t.Tuple[str, str, int],
+        url: str,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        data: bytes,
+        consumer: t.Optional[BodyConsumer] = None,
+    ) -> Response:
+        started = time.time(), time.perf_counter()
+        writer.write(data)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        received = time.perf_counter()
+        tracer.record("fetch.ttfb", started[0], received - started[1], url=url)
+        while True:
+            if not status_line:
+                raise ConnectionResetError("Connection closed by server")
+            _, status, *_ = status_line.decode("latin-1").split(" ", 2)
+            headers: t.Dict[str, str] = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, value = line.decode("latin-1").split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            #  INFO: interim responses, e.g. 100 Continue, precede the final one
+            if not 100 <= int(status) < 200:
+                break
+            status_line = await reader.readline()
+
+        keep_alive = headers.get("connection", "").lower() != "close"
+        encoding = headers.get("content-encoding", "").lower()
+        decompressor = zlib.decompressobj(
+            16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS
+        ) if encoding in ("gzip", "deflate") else None
+        if int(status) in self.REDIRECTS and "location" in headers:
+            consumer = None
+        if consumer is not None:
+            consumer.start(int(status), headers)
+        chunks: t.List[bytes] = []
+        truncated = False
+
+        def _receive(chunk: bytes) -> bool:
+            """ Keep decoded chunk & get whether the rest of the body is needed """
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            chunks.append(chunk)
+            return consumer is None or not chunk or consumer.feed(chunk)
+
+        if int(status) in self.BODILESS or data.startswith(b"HEAD "):
+            #  INFO: these responses never have body whatever their headers say, RFC 9112 6.3
+            pass
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            while size := int((await reader.readline()).split(b";", 1)[0], 16):
+                chunk = await reader.readexactly(size)
+                await reader.readline()
+                if not _receive(chunk):
+                    truncated = True
+                    break
+            else:
+                while await reader.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+        elif "content-length" in headers:
+            left = int(headers["content-length"])
+            while left and not truncated:
+                chunk = await reader.readexactly(min(left, self.CHUNK_SIZE) if consumer else left)
+                left -= len(chunk)
+                truncated = not _receive(chunk) and left > 0
+        else:
+            while chunk := await reader.read(self.CHUNK_SIZE):
+                if not _receive(chunk):
+                    truncated = True
+                    break
+            keep_alive = False
+        if decompressor is not None and not truncated:
+            chunks.append(decompressor.flush())
+            if consumer is not None and chunks[-1]:
+                consumer.feed(chunks[-1])
+
+        tracer.record(
+            "fetch.body", started[0] + received - started[1], time.perf_counter() - received,
+            url=url, truncated=truncated,
+        )
+
+        #  INFO: rest of the truncated body is left unread, so connection is not reusable
+        if keep_alive and not truncated and len(self._idle[key]) < self.max_idle:
+            self._idle[key].append((reader, writer))
+        else:
+            writer.close()
+        return Response(url=url, status=int(status), headers=headers, body=b"".join(chunks), truncated=truncated)
+
+
+class CachedTransport(Transport):
+    """ Transport serving pages from response cache
+
+    Fresh cached responses are served with no network requests. Expired ones
+    are revalidated with conditional requests: response is refreshed if the
+    page was modified and reused otherwise.
+
+    Parameters:
+        transport (Transport): transport fetching pages missing in cache
+        cache (ResponseCache): cache of responses
+        ttl (float): seconds cached response is fresh for, None to never
+            expire; may be changed by `SET cache_ttl = ...` statement
+
+    """
+    def __init__(self, transport: Transport, cache: ResponseCache, ttl: t.Optional[float] = 3600) -> None:
+        self.transport = transport
+        self.cache = cache
+        self.ttl = ttl
+
+    async def request(self, url: str, headers: t.Optional[t.Mapping[str, str]] = None) -> Response:
+        cached = self.cache.get(url)
+        if cached is None:
+            self.cache.misses += 1
+            response = await self.transport.request(url, headers)
+            if response.status == 200:
+                self.cache.put(url, response)
+            return response
+
+        response, stored = cached
+        if self.ttl is None or time.time() - stored < self.ttl:
+            self.cache.hits += 1
+            return response
+
+        conditions = {}
+        if "etag" in response.headers:
+            conditions["If-None-Match"] = response.headers["etag"]
+        if "last-modified" in response.headers:
+            conditions["If-Modified-Since"] = response.headers["last-modified"]
+        fresh = await self.transport.request(url, {**(headers or {}), **conditions})
+        if fresh.status == 304:
+            self.cache.revalidations += 1
+            self.cache.touch(url)
+            return response
+        self.cache.misses += 1
+        if fresh.status == 200:
+            self.cache.put(url, fresh)
+        return fresh
+
+    async def close(self) -> None:
+        await self.transport.close()
+
+
+class SharedTransport(Transport):
+    """ Transport fetching every page once for all queries reading it
+
+    Concurrent requests of the same url share one request. Response is kept
+    until every source expected to read the page got it, so queries run
+    later reuse pages fetched for the earlier ones. Responses of pages some
+    consumers never requested, e.g. stopped by LIMIT, are kept till close.
+
+    Parameters:
+        transport (Transport): transport fetching the pages
+        sources (list[Source]): canonical sources of all queries
+
+    """
+    def __init__(self, transport: Transport, sources: t.Iterable[Source]) -> None:
+        self.transport = transport
+        self.requests = self.shared = 0
+        self._sources: t.DefaultDict[str, t.List[Source]] = defaultdict(list)
+        for source in sources:
+            self._sources[source.url].append(source)
+        self._patterns = [
+            (re.compile(re.escape(sources[0].template).replace(re.escape("{page}"), r"(\d+)") + "$"), sources)
+            for sources in self._sources.values() if sources[0].paged
+        ]
+        self._entries: t.Dict[str, t.Tuple[asyncio.Future, t.List[int]]] = {}
+
+    def consumers(self, url: str) -> int:
+        """ Get number of sources expected to read the page """
+        if url in self._sources:
+            return len(self._sources[url])
+        for pattern, sources in self._patterns:
+            match = pattern.match(url)
+            if match:
+                index = int(match.group(1))
+                return sum(1 for x in sources if x.pages < 0 or index <= x.pages)
+        return 1
+
+    async def request(self, url: str, headers: t.Optional[t.Mapping[str, str]] = None) -> Response:
+        if headers:
+            return await self.transport.request(url, headers)
+        if url in self._entries:
+            self.shared += 1
+            future, remaining = self._entries[url]
+        else:
+            self.requests += 1
+            future = asyncio.ensure_future(self.transport.request(url))
+            remaining = [self.consumers(url)]
+            self._entries[url] = (future, remaining)
+            future.add_done_callback(lambda x: self._failed(url, x))
+        remaining[0] -= 1
+        if remaining[0] <= 0:
+            self._entries.pop(url, None)
+        return await asyncio.shield(future)
+
+    def _failed(self, url: str, future: asyncio.Future) -> None:
+        """ Drop failed request, so the next consumer retries it """
+        if (future.cancelled() or future.exception()) and self._entries.get(url, (None,))[0] is future:
+            del self._entries[url]
+
+    async def close(self) -> None:
+        self._entries.clear()
+        await self.transport.close()
+
+
+class ArchiveTransport(Transport):
+    """ Transport reading pages of `file:` urls from local archives
+
+    Path of the url is glob pattern of the archive files and fragment is
+    index of the page among pages of all matching files, e.g.
+    `file:///data/*.warc#3`, see `scraby.utils.archive`. Archives are
+    memory-mapped, bodies of the responses are memoryviews of their pages.
+    Missing pages get 404 responses. Other urls are requested with the
+    wrapped transport.
+
+    Parameters:
+        transport (Transport): transport requesting other urls
+
+    """
+    def __init__(self, transport: Transport) -> None:
+        self.transport = transport
+        self.archives: t.Dict[str, Archive] = {}
+
+    def read(self, url: str) -> Response:
+        #  INFO: `?` of the glob pattern is not a query, so it's escaped to stay in path
+        parts = urlsplit(url.replace("?", "%3F"))
+        pattern = unquote(parts.path)
+        if pattern not in self.archives:
+            self.archives[pattern] = Archive(pattern)
+        record = self.archives[pattern].page(int(parts.fragment or 1))
+        if record is None:
+            return Response(url=url, status=404)
+        return Response(url=record.url or url, status=record.status, headers=record.headers, body=record.body)
+
+    async def request(self, url: str, headers: t.Optional[t.Mapping[str, str]] = None) -> Response:
+        if url.startswith("file:"):
+            return self.read(url)
+        return await self.transport.request(url, headers)
+
+    async def stream(
+        self,
+        url: str,
+        consumer: BodyConsumer,
+        headers: t.Optional[t.Mapping[str, str]] = None,
+    ) -> Response:
+        if url.startswith("file:"):
+            return await super().stream(url, consumer, headers)
+        return await self.transport.stream(url, consumer, headers)
+
+    async def close(self) -> None:
+        for archive in self.archives.values():
+            archive.close()
+        self.archives.clear()
+        await self.transport.close()
+
+
+class Executor:
+    """ Executor of parsed queries
+
+    Collects all LOAD sources of the query and fetches their pages
+    concurrently, limiting number of simultaneous requests both globally and
+    per host. Rows are produced page by page: only a bounded window of pages
+    is fetched ahead of the consumer.
+
+    Parameters:
+        transport (Transport): transport used to fetch pages, HTTPTransport
+            wrapped with ArchiveTransport reading `file:` urls is used by
+            default
+        max_connections (int): max number of simultaneous requests
+        max_host_connections (int): max number of simultaneous requests to
+            the same host
+        window (int): max number of pages fetched ahead of the rows consumer
+        cache (ResponseCache): cache of responses the transport is wrapped with
+        cache_ttl (float): seconds cached response is fresh for
+        workers (int): number of processes pages are parsed in, 0 to parse
+            them in the executor's process; processes are started on first
+            use & shared by all queries till `close`
+        checkpoint (Checkpoint): store of queries' progress, restarted query
+            skips pages completed by the previous run
+        scheduler (Scheduler): scheduler keeping adaptive rate limit per
+            host, requests are not rate limited by default
+        snapshot (Snapshot): store of pages' rows, pages not changed since
+            the previous run are not parsed
+        budget (Budget): limits of the query cost, queries exceeding them are
+            rejected with BudgetExceeded before any page is fetched
+        join_memory (int): max estimated size in bytes of the join's hash
+            table kept in memory, larger ones are partially spilled to disk
+
+    """
+    def __init__(
+        self,
+        transport: t.Optional[Transport] = None,
+        max_connections: int = 32,
+        max_host_connections: int = 8,
+        window: int = 16,
+        cache: t.Optional[ResponseCache] = None,
+        cache_ttl: t.Optional[float] = 3600,
+        workers: int = 0,
+        checkpoint: t.Optional[Checkpoint] = None,
+        scheduler: t.Optional[Scheduler] = None,
+        snapshot: t.Optional[Snapshot] = None,
+        budget: t.Optional[Budget] = None,
+        join_memory: int = 64 * 2**20,
+    ) -> None:
+        self.transport = transport or HTTPTransport(max_idle=max_host_connections)
+        if cache is not None:
+            self.transport = CachedTransport(self.transport, cache, cache_ttl)
+        if transport is None:
+            self.transport = ArchiveTransport(self.transport)
+        self.max_connections = max_connections
+        self.max_host_connections = max_host_connections
+        self.window = window
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.scheduler = scheduler
+        self.snapshot = snapshot
+        self.budget = budget
+        self.join_memory = join_memory
+        self._loop: t.Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self._host_semaphores: t.Dict[str, asyncio.Semaphore] = {}
+        self._pool: t.Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        """ Process pool pages are parsed in, started on first use """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+        return self._pool
+
+    @property
+    def cached_transport(self) -> t.Optional[CachedTransport]:
+        """ Transport caching responses, None if the cache is not enabled """
+        #  INFO: cached transport may be wrapped, e.g. by shared one
+        transport = self.transport
+        while not isinstance(transport, CachedTransport) \
+        and isinstance(transport, (SharedTransport, ArchiveTransport)):
+            transport = transport.transport
+        return transport if isinstance(transport, CachedTransport) else None
+
+    @staticmethod
+    def collect(expression: exp.Expression) -> t.List[Source]:
+        """ Collect sources of all LOAD functions used in query """
+        return [Source.from_expression(x) for x in expression.find_all(LoadPage)]
+
+    def _limits(self, host: str) -> t.Tuple[asyncio.Semaphore, asyncio.Semaphore]:
+        #  INFO: semaphores are bound to the event loop, so renew them with loop
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+            self._host_semaphores.clear()
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.max_host_connections)
+        return self._host_semaphores[host], self._semaphore
+
+    async def fetch_page(self, source: Source, index: int, consumer: t.Optional[BodyConsumer] = None) -> Page:
+        """ Fetch single page of the source respecting connection & rate limits
+
+        With scheduler request waits for the host's token in the source's
+        queue and throttled requests are retried, `Throttled` is raised once
+        retries are exhausted. Body is streamed to the consumer if it's passed.
+
+        """
+        url = source.page_url(index)
+        host = urlsplit(url).netloc
+        host_semaphore, semaphore = self._limits(host)
+        retries = self.scheduler.retries if self.scheduler else 0
+        for _ in range(retries + 1):
+            if self.scheduler:
+                await self.scheduler.acquire(host, source)
+            async with host_semaphore, semaphore:
+                start = time.monotonic()
+                with tracer.span("fetch", source=source.url, url=url) as span:
+                    if consumer is None:
+                        response = await self.transport.request(url)
+                    else:
+                        response = await self.transport.stream(url, consumer)
+                    span.attrs.update(status=response.status, size=len(response.body))
+            if not self.scheduler:
+                break
+            retry = self.scheduler.feedback(host, response.status, time.monotonic() - start, response.headers)
+            if not retry:
+                break
+        else:
+            raise Throttled(f"{url}: still throttled with {response.status} after {retries} retries")
+        return Page(source=source, index=index, response=response, consumer=consumer)
+
+    async def iter_pages(
+        self,
+        source: Source,
+        window: int,
+        skip: t.Optional[t.Callable[[int], bool]] = None,
+        consumer: t.Optional[t.Callable[[], BodyConsumer]] = None,
+    ) -> t.AsyncGenerator[Page, None]:
+        """ Iterate over pages of the source in order
+
+        No more than `window` pages are fetched ahead of the consumer. Source
+        with unknown number of pages ends on first page with unsuccessful
+        response. Pages which indices pass `skip` check are not fetched.
+        Bodies are streamed to consumers created for every page if factory
+        of consumers is passed.
+
+        """
+        indices = iter(
+            range(1, 2) if not source.paged else
+            range(1, source.pages + 1) if source.pages >= 0 else
+            count(1)
+        )
+        if skip:
+            indices = (x for x in indices if not skip(x))
+        pending: t.Deque[asyncio.Task] = deque()
+        try:
+            for index in indices:
+                pending.append(asyncio.create_task(self.fetch_page(source, index, consumer and consumer())))
+                if len(pending) >= window:
+                    break
+            while pending:
+                page = await pending.popleft()
+                if source.paged and source.pages < 0 and not page.response.ok:
+                    return
+                for index in indices:
+                    pending.append(asyncio.create_task(self.fetch_page(source, index, consumer and consumer())))
+                    break
+                yield page
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def fetch_source(self, source: Source) -> t.List[Page]:
+        """ Fetch all pages of the source """
+        window = source.pages if source.paged and source.pages > 0 else self.max_host_connections
+        return [x async for x in self.iter_pages(source, window)]
+
+    async def fetch(self, expression: exp.Expression) -> t.List[Page]:
+        """ Fetch pages of all query sources concurrently
+
+        Sources are fetched once per plan's fetch operator, so LOAD functions
+        of the same url share their pages.
+
+        """
+        if self.budget:
+            enforce(expression, self.budget)
+        plan = Plan.build(expression)
+        results = await asyncio.gather(*(self.fetch_source(x.source) for x in plan.fetches))
+        return [page for pages in results for page in pages]
+
+    async def extract(
+        self,
+        expression: exp.Select,
+        scan: Scan,
+        skip: t.Optional[t.Callable[[int], bool]] = None,
+        side: t.Optional[int] = None,
+        pages: t.Optional[t.AsyncIterator[Page]] = None,
+    ) -> t.AsyncIterator[t.Tuple[Page, t.List[Values], t.Optional[t.List[Values]]]]:
+        """ Iterate over pages in order with their rows & rows of the previous run
+
+        Pages are parsed in the process pool when executor has workers: every
+        worker compiles the query once on its first page, page bodies are
+        passed via shared memory and only extracted rows are sent back.
+
+        With snapshot pages which content didn't change since the previous run
+        are not parsed, their stored rows are reused. Previous rows are None
+        for pages the snapshot has no rows of.
+
+        Error pages, e.g. 404 or 500 ones, are not parsed: they have no rows,
+        no previous rows & don't change the snapshot.
+
+        Scan of the join's source is passed with index of its side and pages
+        shared with the other side if both read the same fetch operator.
+
+        Pages of the scan with LIMIT and no predicate are parsed while they're
+        downloaded: no more of the body is downloaded once its rows within
+        LIMIT & OFFSET are extracted, as the following ones can't be produced.
+        Rows filtered by predicate may need the whole page, while parsing in
+        workers, snapshots and shared pages need whole bodies, so pages are
+        not streamed with them.
+
+        """
+        extractor = Extractor(scan.columns)
+        streamed = scan.limit is not None and scan.predicate is None and not self.workers and not self.snapshot
+        if pages is None:
+            pages = self.iter_pages(
+                scan.source, self.window, skip, (lambda: StreamExtraction(scan, extractor)) if streamed else None
+            )
+        query = dialect.generate(expression) if self.snapshot else ""
+        if self.snapshot and side is not None:
+            query += f"#{side}"
+
+        def _previous(page: Page) -> t.Tuple[bytes, t.Optional[t.Tuple[bytes, t.List[Values]]]]:
+            if not self.snapshot:
+                return b"", None
+            digest = Snapshot.digest(page.response)
+            previous = self.snapshot.get(query, scan.source.page_url(page.index))
+            if previous and previous[0] == digest:
+                self.snapshot.hits += 1
+            else:
+                self.snapshot.misses += 1
+            return digest, previous
+
+        def _store(page: Page, digest: bytes, rows: t.List[Values]) -> None:
+            if self.snapshot:
+                self.snapshot.put(query, scan.source.page_url(page.index), digest, rows)
+
+        if not self.workers:
+            async for page in pages:
+                if not page.response.ok:
+                    yield page, [], None
+                    continue
+                digest, previous = _previous(page)
+                if previous and previous[0] == digest:
+                    yield page, previous[1], previous[1]
+                    continue
+                if isinstance(page.consumer, StreamExtraction):
+                    rows = page.consumer.rows()
+                else:
+                    rows = extract(scan, extractor, page.response.text)
+                _store(page, digest, rows)
+                yield page, rows, previous and previous[1]
+            return
+
+        loop = asyncio.get_running_loop()
+        #  INFO: page, its digest & previous rows, shared memory of its body if it's parsed & rows' future
+        pending: t.Deque[t.Tuple[t.Any, ...]] = deque()
+
+        async def _collect(
+            page: Page,
+            digest: bytes,
+            previous: t.Optional[t.Tuple[bytes, t.List[Values]]],
+            memory: t.Optional[SharedMemory],
+            future: asyncio.Future,
+        ) -> t.Tuple[Page, t.List[Values], t.Optional[t.List[Values]]]:
+            try:
+                rows = await future
+            finally:
+                if memory is not None:
+                    memory.close()
+                    memory.unlink()
+            if memory is not None:
+                _store(page, digest, rows)
+            return page, rows, previous and previous[1]
+
+        #  INFO: query is registered once in shared memory rather than pickled
+        #  with every page, workers compile it on their first page of it
+        pool, tree = self.pool, pickle.dumps(expression, pickle.HIGHEST_PROTOCOL)
+        registry = SharedMemory(create=True, size=len(tree))
+        assert registry.buf is not None
+        registry.buf[:len(tree)] = tree
+        registered = (registry.name, len(tree))
+        try:
+            async for page in pages:
+                digest, previous = _previous(page) if page.response.ok else (b"", None)
+                if not page.response.ok:
+                    future = loop.create_future()
+                    future.set_result([])
+                    pending.append((page, digest, previous, None, future))
+                elif previous and previous[0] == digest:
+                    future = loop.create_future()
+                    future.set_result(previous[1])
+                    pending.append((page, digest, previous, None, future))
+                else:
+                    body = page.response.body
+                    memory = SharedMemory(create=True, size=max(len(body), 1))
+                    assert memory.buf is not None
+                    memory.buf[:len(body)] = body
+                    pending.append((page, digest, previous, memory, loop.run_in_executor(
+                        pool, _extract_shared, registered, side, memory.name, len(body), page.response.charset
+                    )))
+                if len(pending) >= 2 * self.workers:
+                    yield await _collect(*pending.popleft())
+            while pending:
+                yield await _collect(*pending.popleft())
+        finally:
+            for *_, memory, future in pending:
+                future.cancel()
+                if memory is not None:
+                    memory.close()
+                    memory.unlink()
+            registry.close()
+            registry.unlink()
+
+    async def join(self, expression: exp.Select, plan: Join) -> t.AsyncGenerator[Values, None]:
+        """ Iterate over values of the joined rows with hash join
+
+        Rows of the side with fewer pages are inserted into the hash table
+        while pages of the other side are fetched & parsed into a queue of up
+        to `window` pages. Once the table is built, rows of the queued and the
+        following pages are streamed through it as soon as they're extracted.
+        Probe rows of partitions spilled to disk are joined at the end.
+
+        Sources read by the same fetch operator of the query's plan, e.g. of
+        a self-join, share their pages: every page is fetched once and parsed
+        for both sides, so rows of the probe side are queued without bound
+        while the table is built.
+
+        """
+        build, probe = plan.build, 1 - plan.build
+        query = Plan.build(expression)
+        fetches = [query.fetch_for(x.source) for x in plan.scans]
+        pages: t.List[t.Optional[t.AsyncIterator[Page]]] = [None, None]
+        if fetches[0] is fetches[1]:
+            shared = SharedPages(self.iter_pages(fetches[0].source, self.window), [x.source for x in plan.scans])
+            pages = [shared.reader(0), shared.reader(1)]
+        names = [*plan.scans[0].output, *plan.scans[1].output]
+        output = [names.index(x) for x in plan.output]
+        nulls = [(None,) * len(x.output) for x in plan.scans]
+        key = plan.scans[probe].output.index(plan.keys[probe])
+        table = HashTable(
+            plan.scans[build].output.index(plan.keys[build]),
+            memory=self.join_memory,
+            track=plan.outer and build == 0,
+        )
+        queue: "asyncio.Queue[t.Union[t.List[Values], Exception, None]]" = asyncio.Queue(
+            0 if pages[probe] else self.window
+        )
+
+        async def _produce() -> None:
+            try:
+                async for _, rows, _ in self.extract(expression, plan.scans[probe], side=probe, pages=pages[probe]):
+                    await queue.put(rows)
+            except Exception as e:  # pylint: disable=broad-except
+                await queue.put(e)
+            else:
+                await queue.put(None)
+
+        def _filter(row: Values) -> t.Iterator[Values]:
+            if plan.predicate is None or plan.predicate(dict(zip(names, row))):
+                yield tuple(row[x] for x in output)
+
+        def _match(row: Values, entries: t.List[t.List[t.Any]]) -> t.Iterator[Values]:
+            matched = False
+            for entry in entries:
+                joined = row + entry[0] if probe == 0 else entry[0] + row
+                if plan.condition is not None and not plan.condition(dict(zip(names, joined))):
+                    continue
+                entry[1] = matched = True
+                yield from _filter(joined)
+            #  INFO: unmatched rows of the preserved build side are produced at the end
+            if not matched and plan.outer and probe == 0:
+                yield from _filter(row + nulls[1])
+
+        producer = asyncio.create_task(_produce())
+        try:
+            with tracer.span("join.build", source=plan.scans[build].source.url) as span:
+                async for _, rows, _ in self.extract(expression, plan.scans[build], side=build, pages=pages[build]):
+                    for row in rows:
+                        table.insert(row)
+                span.attrs.update(rows=table.rows, spilled=table.spilled)
+            while True:
+                item = await queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                if item is None:
+                    break
+                for row in item:
+                    entries = table.probe(row, row[key])
+                    if entries is not None:
+                        for values in _match(row, entries):
+                            yield values
+            for row, entries in table.deferred():
+                for values in _match(row, entries):
+                    yield values
+            if table.track:
+                for row in table.unmatched():
+                    for values in _filter(row + nulls[1]):
+                        yield values
+        finally:
+            producer.cancel()
+            table.close()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+
+    async def records(self, expression: exp.Select) -> t.AsyncGenerator[Values, None]:
+        """ Iterate over values of the query rows as soon as their pages are fetched
+
+        Pages failing the cheap prefilter are not parsed and no more pages are
+        fetched once LIMIT is satisfied. With checkpoint page is marked as
+        completed once all its rows were consumed, so the query restarted
+        after interrupted run continues with the first incomplete page.
+        Error pages are never marked, so the restarted query fetches them
+        again. Checkpoint of the query is cleared once all its rows were
+        produced from successfully fetched pages.
+
+        """
+        with tracer.span("plan"):
+            if self.budget:
+                enforce(expression, self.budget)
+            scan = optimize(expression)
+        if isinstance(scan, Join):
+            if self.checkpoint:
+                raise UnsupportedQuery("Checkpoints of joins are not supported")
+            if scan.limit == 0:
+                return
+            skipped = produced = 0
+            joined = self.join(expression, scan)
+            try:
+                async for row in joined:
+                    if skipped < scan.offset:
+                        skipped += 1
+                        continue
+                    yield row
+                    produced += 1
+                    if produced == scan.limit:
+                        return
+            finally:
+                await joined.aclose()
+            return
+        query = dialect.generate(expression)
+        progress = self.checkpoint.load(query) if self.checkpoint else Progress()
+        skipped, produced = progress.skipped, progress.produced
+        completed = failed = False
+        try:
+            if scan.limit != progress.produced:
+                async for page, rows, _ in self.extract(expression, scan, progress.done if self.checkpoint else None):
+                    for row in rows:
+                        if skipped < scan.offset:
+                            skipped += 1
+                            continue
+                        yield row
+                        produced += 1
+                        if produced == scan.limit:
+                            break
+                    #  INFO: progress is updated on page boundaries only
+                    if page.response.ok:
+                        progress.mark(page.index)
+                    else:
+                        failed = True
+                    progress.skipped, progress.produced = skipped, produced
+                    if self.checkpoint:
+                        self.checkpoint.save(query, progress)
+                    if produced == scan.limit:
+                        break
+            completed = not failed
+        finally:
+            #  INFO: only interrupted runs are resumed, the next run of completed query starts over
+            if self.checkpoint and completed:
+                self.checkpoint.clear(query)
+            elif self.checkpoint:
+                self.checkpoint.save(query, progress, force=True)
+
+    async def stream(self, expression: exp.Select) -> t.AsyncGenerator[Row, None]:
+        """ Iterate over rows of the query as soon as their pages are fetched """
+        output = optimize(expression).output
+        async for values in self.records(expression):
+            yield dict(zip(output, values))
+
+    async def stream_batches(self, expression: exp.Select, size: int = 65536) -> t.AsyncGenerator[Batch, None]:
+        """ Iterate over column-oriented batches of the query rows
+
+        Every batch has up to `size` rows & one dictionary-encoded column per
+        projected column, values are appended to columns without building
+        row dicts.
+
+        """
+        output = optimize(expression).output
+        batch = Batch(output)
+        async for values in self.records(expression):
+            batch.append(values)
+            if len(batch) >= size:
+                yield batch
+                batch = Batch(output)
+        if len(batch):
+            yield batch
+
+    async def stream_changes(self, expression: exp.Select) -> t.AsyncGenerator[t.Tuple[str, Values], None]:
+        """ Iterate over rows inserted ("+") & removed ("-") since the previous run
+
+        Only pages which content changed are compared with their stored rows,
+        rows of pages not found anymore are removed at the end.
+
+        """
+        if self.budget:
+            enforce(expression, self.budget)
+        scan = optimize(expression)
+        if self.snapshot is None:
+            raise ValueError("Snapshot is not enabled")
+        if isinstance(scan, Join):
+            raise UnsupportedQuery("Changes of joins are not supported")
+        if scan.limit is not None or scan.offset:
+            raise UnsupportedQuery("Changes of queries with LIMIT or OFFSET are not supported")
+        query = dialect.generate(expression)
+        seen = set()
+        async for page, rows, previous in self.extract(expression, scan):
+            seen.add(scan.source.page_url(page.index))
+            if previous is rows:
+                continue
+            removed = Counter(previous or ())
+            for row in rows:
+                if removed[row]:
+                    removed[row] -= 1
+                else:
+                    yield "+", row
+            for row in (previous or ()):
+                if removed[row]:
+                    removed[row] -= 1
+                    yield "-", row
+        for url in self.snapshot.urls(query):
+            if url not in seen:
+                stale = self.snapshot.get(query, url)
+                for row in stale[1] if stale else ():
+                    yield "-", row
+                self.snapshot.remove(query, url)
+
+    def _iterate(self, iterator: t.AsyncGenerator[t.Any, None]) -> t.Iterator[t.Any]:
+        """ Iterate over async iterator in a new event loop """
+        loop = asyncio.new_event_loop()
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(iterator.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(iterator.aclose())
+            #  INFO: connections are bound to the loop, while process pool is
+            #  kept for the following queries till the executor is closed
+            loop.run_until_complete(self.transport.close())
+            loop.close()
+
+    def rows(self, expression: exp.Select) -> t.Iterator[Row]:
+        """ Iterate over rows of the query in a new event loop """
+        return self._iterate(self.stream(expression))
+
+    def changes(self, expression: exp.Select) -> t.Iterator[t.Tuple[str, Row]]:
+        """ Iterate over rows inserted & removed since the previous run in a new event loop """
+        output = optimize(expression).output
+        return ((x, dict(zip(output, y))) for x, y in self._iterate(self.stream_changes(expression)))
+
+    def batches(self, expression: exp.Select, size: int = 65536) -> t.Iterator[Batch]:
+        """ Iterate over column-oriented batches of the query in a new event loop
+
+        Batches may be written straight to files, e.g.
+        `write_parquet(executor.batches(expression), "rows.parquet")`.
+
+        """
+        return self._iterate(self.stream_batches(expression, size))
+
+    def analyze(self, expression: t.Union[str, exp.Select]) -> str:
+        """ Run the query & get its plan annotated with time & rows of every operator
+
+        This is EXPLAIN ANALYZE: query string is parsed within the run, so the
+        parsing stages are reported too. Extraction stages of pages parsed by
+        worker processes are not reported.
+
+        """
+        sink = MemorySink()
+        with tracer.tracing(sink):
+            start = time.perf_counter()
+            query = t.cast(exp.Select, dialect.parse(expression)[0]) if isinstance(expression, str) else expression
+            rows = sum(1 for _ in self.rows(query))
+            spent = time.perf_counter() - start
+        return f"{Plan.build(query).explain(sink.spans)}\nRows: {rows}, total time: {spent * 1e3:.3f} ms"
+
+    async def close(self) -> None:
+        """ Shut the worker processes down & close the transport's connections """
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            #  INFO: waiting for the workers to exit blocks, so it's done off the event loop
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(pool.shutdown, wait=True, cancel_futures=True)
+            )
+        await self.transport.close()
+
+    def set(self, expression: exp.Set) -> None:
+        """ Apply settings of SET statement, e.g. `SET cache_ttl = 60`
+
+        Settings:
+            cache_ttl: seconds cached response is fresh for, NULL to never
+                expire, 0 to revalidate every time
+
+        """
+        for item in expression.expressions:
+            name, value = item.this.this.name, item.this.expression
+            if name.lower() != "cache_ttl":
+                raise ValueError(f"Unknown setting: {name}")
+            cached = self.cached_transport
+            if cached is None:
+                raise ValueError("Response cache is not enabled")
+            cached.ttl = None if isinstance(value, exp.Null) else float(value.to_py())
+
+    def execute(self, expression: t.Union[exp.Select, exp.Set]) -> t.List[Row]:
+        """ Get all rows of the query, SET statements return no rows """
+        if isinstance(expression, exp.Set):
+            self.set(expression)
+            return []
+        return list(self.rows(expression))
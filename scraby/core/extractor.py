@@ -0,0 +1,294 @@
+import re
+import typing as t
+import weakref
+
+from dataclasses import dataclass
+from itertools import zip_longest
+from sqlglot import exp
+from scraby.core.parser import CompactTag, dialect, ScrabyDialect, Tag, UnsupportedQuery
+from scraby.utils.html import BalancedParser, HTMLTag
+
+
+Row = t.Dict[str, t.Optional[str]]
+
+
+@dataclass(frozen=True)
+class Column:
+    """ Projected column extracted from pages
+
+    Parameters:
+        name (str): column name, alias or generated SQL of the expression
+        tag (Tag): tag selecting column elements
+        path (tuple[str, ...]): names of the child parts, e.g. ("a", "href")
+            for `<div>.a.href`: tag names select descendants of the elements,
+            any other name selects attribute of the elements and ends path;
+            the last part named as tag selects attribute of the elements
+            having it and descendants of the others, e.g. `<a>.title` selects
+            `title` attribute of `<a title="T">`
+        source (str): alias of the source column is qualified with, e.g. "d"
+            for `d.<div>.a`
+
+    """
+    name: str
+    tag: Tag
+    path: t.Tuple[str, ...] = ()
+    source: t.Optional[str] = None
+
+
+def column(expression: exp.Expression, sources: t.Collection[str] = ()) -> t.Optional[Column]:
+    """ Get column extracted for the expression, None if it's not a tag
+
+    Parameters:
+        expression (exp.Expression): projected expression
+        sources (Collection[str]): aliases of the sources, leading parts
+            named so are never tags, e.g. "b" in `b.span` with source "b"
+
+    """
+    name = expression.alias or dialect.generate(expression)
+    node = expression.unalias()
+    path: t.List[str] = []
+    while isinstance(node, exp.Dot):
+        path.insert(0, node.expression.name)
+        node = node.this
+    source = None
+    if isinstance(node, exp.Column):
+        #  INFO: tags without attributes are parsed as plain columns, e.g.
+        #  `div.a` stands for `<div>.a`, `d.a` for `<a>` of source aliased "d";
+        #  tags qualified with source are parsed as column parts, e.g. `d.<div>`
+        parts = list(node.parts)
+        tags = [i for i, x in enumerate(parts) if isinstance(x, Tag)]
+        qualifiers = [x.name for x in parts[:tags[0]]] if tags else []
+        del parts[:len(qualifiers)]
+        while not tags and len(parts) > 1 \
+        and (parts[0].name in sources or parts[0].name not in ScrabyDialect.TAG_NAMES):
+            qualifiers.append(parts.pop(0).name)
+        source = qualifiers[-1] if qualifiers else None
+        if isinstance(parts[0], Tag):
+            node, path = parts[0], [*(x.name for x in parts[1:]), *path]
+        elif parts[0].name in ScrabyDialect.TAG_NAMES:
+            node, path = Tag(this=HTMLTag(parts[0].name)), [*(x.name for x in parts[1:]), *path]
+    if not isinstance(node, Tag):
+        return None
+    return Column(name=name, tag=node, path=tuple(path), source=source)
+
+
+def columns(expression: exp.Select, sources: t.Collection[str] = ()) -> t.List[Column]:
+    """ Get columns projected by the SELECT statement """
+    result = []
+    for projection in expression.expressions:
+        projected = column(projection, sources)
+        if projected is None:
+            raise UnsupportedQuery(f"Unsupported column: {dialect.generate(projection)}")
+        result.append(projected)
+    return result
+
+
+class Matcher:
+    """ Compiled predicate of the tag expression
+
+    Predicate is called with element attributes: exact ones are compared with
+    plain dict lookups, regular ones are matched with precompiled patterns.
+    Tag name is not checked, elements are expected to be prefiltered by name,
+    see Selector. Matchers of compact tags are cached, see `Matcher.of`.
+
+    Parameters:
+        tag (Tag | CompactTag): tag expression to compile
+        patterns (dict[str, re.Pattern]): compiled patterns shared between
+            matchers of the same query, so every regexp is compiled once
+
+    """
+    __slots__ = ("name", "attrs", "patterns", "__weakref__")
+
+    _cache: "weakref.WeakKeyDictionary[CompactTag, Matcher]" = weakref.WeakKeyDictionary()
+
+    def __init__(
+        self,
+        tag: t.Union[Tag, CompactTag],
+        patterns: t.Optional[t.Dict[str, t.Pattern]] = None,
+    ) -> None:
+        patterns = {} if patterns is None else patterns
+        compact = tag if isinstance(tag, CompactTag) else CompactTag.from_tag(tag)
+        self.name: str = compact.name
+        self.attrs: t.Dict[str, str] = {}
+        self.patterns: t.List[t.Tuple[str, t.Pattern]] = []
+        for name, value, is_regular in compact.attrs:
+            if is_regular:
+                if value not in patterns:
+                    patterns[value] = re.compile(value)
+                self.patterns.append((name, patterns[value]))
+            else:
+                self.attrs[name] = value
+
+    @classmethod
+    def of(cls, tag: CompactTag) -> "Matcher":
+        """ Get matcher shared by all equal tags """
+        matcher = cls._cache.get(tag)
+        if matcher is None:
+            matcher = cls._cache[tag] = cls(tag)
+        return matcher
+
+    def __call__(self, attrs: t.Dict[str, str]) -> bool:
+        for name, value in self.attrs.items():
+            if attrs.get(name) != value:
+                return False
+        for name, pattern in self.patterns:
+            found = attrs.get(name)
+            if found is None or not pattern.fullmatch(found):
+                return False
+        return True
+
+
+class Selector:  # pylint: disable=too-few-public-methods
+    """ Compiled tag expressions indexed by tag name
+
+    Every element of the document is checked only by matchers of tags with
+    the same name, see `Extraction.start`. Equal tags share one matcher.
+
+    Parameters:
+        tags (list[Tag | CompactTag]): tag expressions to select elements with
+
+    """
+    def __init__(self, tags: t.Sequence[t.Union[Tag, CompactTag]]) -> None:
+        keys: t.Dict[CompactTag, int] = {}
+        self.tags: t.List[CompactTag] = []
+        """ Distinct compact tags of the matchers """
+        self.slots: t.List[int] = []
+        """ Index of the matcher for every tag """
+        self.matchers: t.List[Matcher] = []
+        self.index: t.Dict[str, t.List[t.Tuple[int, Matcher]]] = {}
+        for tag in tags:
+            key = tag if isinstance(tag, CompactTag) else CompactTag.from_tag(tag)
+            if key not in keys:
+                keys[key] = len(self.matchers)
+                matcher = Matcher.of(key)
+                self.index.setdefault(matcher.name, []).append((keys[key], matcher))
+                self.matchers.append(matcher)
+                self.tags.append(key)
+            self.slots.append(keys[key])
+
+
+class Extractor:  # pylint: disable=too-few-public-methods
+    """ Extractor of query columns' rows from HTML documents
+
+    All columns are extracted in a single pass over the document markup, no
+    document tree is built. Column paths are compiled into a dispatch table
+    keyed by tag name: element matching column's tag starts waiting for the
+    first child tag of the path among its descendants, matched child waits
+    for the next one and so on. Element completing the path emits either its
+    attribute or its text, which is collected till the element's end. Element
+    waiting for the last child tag of the path emits attribute of the same
+    name instead if it has one, see Column.
+
+    Parameters:
+        columns (list[Column]): columns to extract
+
+    """
+    def __init__(self, columns: t.Sequence[Column]) -> None:
+        self.columns = columns
+        self.names = [x.name for x in columns]
+        self.selector = Selector([x.tag for x in columns])
+        self.roots: t.Dict[int, t.List[int]] = {}
+        """ Columns started by every matcher of selector """
+        self.steps: t.List[t.Tuple[str, ...]] = []
+        """ Child tag names of every column's path """
+        self.attrs: t.List[t.Optional[str]] = []
+        """ Attribute name emitted by every column, None for element text """
+        for i, (projection, slot) in enumerate(zip(columns, self.selector.slots)):
+            self.roots.setdefault(slot, []).append(i)
+            steps = []
+            attr = None
+            for part in projection.path:
+                if part not in ScrabyDialect.TAG_NAMES:
+                    attr = part
+                    break
+                steps.append(part)
+            self.steps.append(tuple(steps))
+            self.attrs.append(attr)
+
+    def extract(self, data: str) -> t.List[Row]:
+        """ Extract rows from HTML document
+
+        Every column selects a list of values, so N-th row consists of N-th
+        values of all columns; shorter columns are padded with None.
+
+        """
+        extraction = Extraction(self)
+        extraction.feed(data)
+        extraction.close()
+        return extraction.rows()
+
+
+class Extraction(BalancedParser):
+    """ Single pass of the extractor over HTML document
+
+    Parameters:
+        extractor (Extractor): compiled extractor of the query
+        limit (int): number of leading rows needed, None for all rows
+
+    """
+    def __init__(self, extractor: Extractor, limit: t.Optional[int] = None) -> None:
+        super().__init__()
+        self.extractor = extractor
+        self.limit = limit
+        self.values: t.List[t.List[t.Optional[str]]] = [[] for _ in extractor.columns]
+        self.waiting: t.Dict[str, t.Dict[t.Tuple[int, int], int]] = {}
+        """ Counters of (column, step) states waiting for the tag name """
+        self.captures: t.List[t.List[str]] = []
+        """ Text parts of all open elements emitting text """
+        self._frames: t.List[t.Tuple[t.List[t.Tuple[str, t.Tuple[int, int]]], t.List[t.Tuple[int, int]]]] = []
+
+    @property
+    def complete(self) -> bool:
+        """ Whether the rest of the document can't change the rows
+
+        Values are only appended in document order, so extraction with limit
+        is complete once every column got values of all needed rows & no text
+        is captured. The document may be fed partially then, e.g. while it's
+        being downloaded.
+
+        """
+        return self.limit is not None and not self.captures and all(len(x) >= self.limit for x in self.values)
+
+    def rows(self) -> t.List[Row]:
+        """ Get rows of the values extracted so far, only the needed ones with limit """
+        rows = [dict(zip(self.extractor.names, row)) for row in zip_longest(*self.values)]
+        return rows if self.limit is None else rows[:self.limit]
+
+    def start(self, tag: str, attrs: t.Dict[str, str]) -> None:
+        extractor = self.extractor
+        states: t.Set[t.Tuple[int, int]] = set()
+        for i, matcher in extractor.selector.index.get(tag, ()):
+            if matcher(attrs):
+                states.update((x, 0) for x in extractor.roots[i])
+        for (index, step), n in self.waiting.get(tag, {}).items():
+            if n:
+                states.add((index, step + 1))
+
+        waits, emits = [], []
+        for index, step in states:
+            steps, attr = extractor.steps[index], extractor.attrs[index]
+            if step == len(steps) - 1 and attr is None and steps[step] in attrs:
+                #  INFO: last part of the path is attribute named as tag, e.g. `<a>.title`
+                self.values[index].append(attrs[steps[step]])
+            elif step < len(steps):
+                counter = self.waiting.setdefault(steps[step], {})
+                counter[(index, step)] = counter.get((index, step), 0) + 1
+                waits.append((steps[step], (index, step)))
+            elif attr is not None:
+                self.values[index].append(attrs.get(attr))
+            else:
+                emits.append((index, len(self.values[index])))
+                self.values[index].append(None)
+                self.captures.append([])
+        self._frames.append((waits, emits))
+
+    def end(self, tag: str) -> None:
+        waits, emits = self._frames.pop()
+        for name, state in waits:
+            self.waiting[name][state] -= 1
+        for index, slot in reversed(emits):
+            self.values[index][slot] = " ".join("".join(self.captures.pop()).split())
+
+    def data(self, data: str) -> None:
+        for parts in self.captures:
+            parts.append(data)
@@ -0,0 +1,169 @@
+import os
+import pickle
+import shutil
+import tempfile
+import typing as t
+
+from scraby.utils.trace import tracer
+
+
+_Row = t.Tuple[t.Optional[str], ...]
+
+Entry = t.List[t.Any]
+""" Build row & whether it matched any probe row """
+
+
+class HashTable:
+    """ Hash table of the build side rows by their key value
+
+    Rows are hash partitioned by key. Once the estimated size of rows kept
+    in memory exceeds the budget, the largest partition is spilled to a
+    temporary file and all later rows of the partition are appended to it.
+    Probe rows of spilled partitions are deferred to files as well and joined
+    partition by partition after all probe rows were seen (grace hash join),
+    so only one spilled partition is loaded at a time.
+
+    Rows with NULL key never match, like in SQL.
+
+    Parameters:
+        key (int): index of the key value in build rows
+        memory (int): max estimated size in bytes of rows kept in memory
+        partitions (int): number of partitions rows are spilled by
+        track (bool): whether build rows not matching any probe row are
+            kept for `unmatched`, e.g. for the preserved side of outer join
+
+    """
+    ROW_SIZE = 64
+    """ Estimated overhead of the row in bytes besides its values """
+
+    def __init__(self, key: int, memory: int = 64 * 2**20, partitions: int = 16, track: bool = False) -> None:
+        self.key = key
+        self.memory = memory
+        self.track = track
+        self.size = 0
+        self.rows = 0
+        self._tables: t.List[t.Dict[str, t.List[Entry]]] = [{} for _ in range(partitions)]
+        self._sizes = [0] * partitions
+        self._nulls: t.List[Entry] = []
+        self._spilled: t.Dict[int, t.BinaryIO] = {}
+        self._deferred: t.Dict[int, t.BinaryIO] = {}
+        self._unmatched: t.Optional[t.BinaryIO] = None
+        self.directory: t.Optional[str] = None
+        """ Temporary directory of the spill files, created on first spill & removed on close """
+
+    @property
+    def spilled(self) -> int:
+        """ Number of partitions spilled to disk """
+        return len(self._spilled)
+
+    def _partition(self, key: str) -> int:
+        return hash(key) % len(self._tables)
+
+    def _file(self, name: str) -> t.BinaryIO:
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="scraby-join-")
+        return open(os.path.join(self.directory, name), "w+b")
+
+    def insert(self, row: _Row) -> None:
+        key = row[self.key]
+        self.rows += 1
+        if key is None:
+            if self.track:
+                self._nulls.append([row, False])
+            return
+        partition = self._partition(key)
+        if partition in self._spilled:
+            pickle.dump(row, self._spilled[partition], pickle.HIGHEST_PROTOCOL)
+            return
+        self._tables[partition].setdefault(key, []).append([row, False])
+        size = self.ROW_SIZE + sum(len(x) for x in row if x is not None)
+        self._sizes[partition] += size
+        self.size += size
+        while self.size > self.memory and len(self._spilled) < len(self._tables):
+            self._spill()
+
+    def _spill(self) -> None:
+        """ Move the largest partition kept in memory to disk """
+        partition = max(
+            (x for x in range(len(self._tables)) if x not in self._spilled), key=self._sizes.__getitem__
+        )
+        file = self._spilled[partition] = self._file(f"build-{partition}")
+        for entries in self._tables[partition].values():
+            for row, _ in entries:
+                pickle.dump(row, file, pickle.HIGHEST_PROTOCOL)
+        self._tables[partition] = {}
+        self.size -= self._sizes[partition]
+        self._sizes[partition] = 0
+        tracer.count("join.spills")
+
+    def probe(self, row: _Row, key: t.Optional[str]) -> t.Optional[t.List[Entry]]:
+        """ Get entries of the build rows with the key, None if the probe row is deferred
+
+        Probe row of the spilled partition is written to disk and returned
+        later by `deferred`.
+
+        """
+        if key is None:
+            return []
+        partition = self._partition(key)
+        if partition in self._spilled:
+            if partition not in self._deferred:
+                self._deferred[partition] = self._file(f"probe-{partition}")
+            pickle.dump((row, key), self._deferred[partition], pickle.HIGHEST_PROTOCOL)
+            return None
+        return self._tables[partition].get(key, [])
+
+    @staticmethod
+    def _load(file: t.BinaryIO) -> t.Iterator[t.Any]:
+        file.flush()
+        file.seek(0)
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
+
+    def deferred(self) -> t.Iterator[t.Tuple[_Row, t.List[Entry]]]:
+        """ Iterate over deferred probe rows with entries of their build rows
+
+        Spilled partitions are loaded one by one. Unmatched rows of the
+        partition are moved to disk once its probe rows are joined.
+
+        """
+        for partition, file in self._spilled.items():
+            table: t.Dict[str, t.List[Entry]] = {}
+            for row in self._load(file):
+                table.setdefault(row[self.key], []).append([row, False])
+            if partition in self._deferred:
+                for row, key in self._load(self._deferred[partition]):
+                    yield row, table.get(key, [])
+            if self.track:
+                if self._unmatched is None:
+                    self._unmatched = self._file("unmatched")
+                for entries in table.values():
+                    for row, matched in entries:
+                        if not matched:
+                            pickle.dump(row, self._unmatched, pickle.HIGHEST_PROTOCOL)
+
+    def unmatched(self) -> t.Iterator[_Row]:
+        """ Iterate over build rows not matching any probe row, `deferred` must be consumed first """
+        for entry in self._nulls:
+            yield entry[0]
+        for table in self._tables:
+            for entries in table.values():
+                for row, matched in entries:
+                    if not matched:
+                        yield row
+        if self._unmatched is not None:
+            yield from self._load(self._unmatched)
+
+    def close(self) -> None:
+        """ Remove spill files """
+        for file in [*self._spilled.values(), *self._deferred.values(), *filter(None, [self._unmatched])]:
+            file.close()
+        self._spilled.clear()
+        self._deferred.clear()
+        self._unmatched = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
@@ -1 +1,409 @@
-#  TODO: make query optimization & caching here
+import operator
+import re
+import typing as t
+
+from dataclasses import dataclass
+from decimal import Decimal
+from itertools import takewhile
+from sqlglot import exp
+from scraby.core.extractor import column, columns, Column, Row
+from scraby.core.parser import dialect, LoadPage, ScrabyDialect, Tag, UnsupportedQuery
+from scraby.utils.plan import Source
+
+
+Value = t.Union[str, int, float, bool, None]
+
+
+class Predicate:
+    """ WHERE condition compiled into a closure over extracted rows
+
+    Values are compared with SQL semantics: NULL (None) in comparison makes
+    the result NULL, which doesn't pass the filter. Extracted strings compared
+    to numbers are converted to numbers, unconvertible ones become NULL.
+
+    Parameters:
+        expression (exp.Expression): condition to compile
+        resolve (Callable): gets column extracted for expression, None if
+            expression is not a column
+
+    """
+    COMPARISONS: t.Dict[t.Type[exp.Expression], t.Callable[[t.Any, t.Any], bool]] = {
+        exp.EQ: operator.eq,
+        exp.NEQ: operator.ne,
+        exp.GT: operator.gt,
+        exp.GTE: operator.ge,
+        exp.LT: operator.lt,
+        exp.LTE: operator.le,
+    }
+
+    def __init__(
+        self,
+        expression: exp.Expression,
+        resolve: t.Callable[[exp.Expression], t.Optional[Column]],
+    ) -> None:
+        self.expression = expression
+        self.resolve = resolve
+        self.columns: t.Dict[str, Column] = {}
+        """ Columns referenced by the condition """
+        self._evaluate = self._compile(expression)
+
+    def __call__(self, row: Row) -> bool:
+        return self._evaluate(row) is True
+
+    @staticmethod
+    def compare(op: t.Callable[[t.Any, t.Any], bool], left: Value, right: Value) -> t.Optional[bool]:
+        if left is None or right is None:
+            return None
+        try:
+            if isinstance(left, str) and isinstance(right, (int, float)):
+                left = float(left)
+            elif isinstance(right, str) and isinstance(left, (int, float)):
+                right = float(right)
+        except ValueError:
+            return None
+        return op(left, right)
+
+    def _compile(self, expression: exp.Expression) -> t.Callable[[Row], Value]:
+        if isinstance(expression, exp.Paren):
+            return self._compile(expression.this)
+
+        if isinstance(expression, (exp.And, exp.Or)):
+            left, right = self._compile(expression.this), self._compile(expression.expression)
+            if isinstance(expression, exp.And):
+                def _and(row: Row) -> Value:
+                    a, b = left(row), right(row)
+                    return False if a is False or b is False else None if a is None or b is None else True
+                return _and
+
+            def _or(row: Row) -> Value:
+                a, b = left(row), right(row)
+                return True if a is True or b is True else None if a is None or b is None else False
+            return _or
+
+        if isinstance(expression, exp.Not):
+            this = self._compile(expression.this)
+            return lambda row: None if (x := this(row)) is None else not x
+
+        if isinstance(expression, exp.Is):
+            this, value = self._compile(expression.this), expression.expression
+            if isinstance(value, exp.Null):
+                return lambda row: this(row) is None
+            return lambda row: this(row) is value.this
+
+        if type(expression) in self.COMPARISONS:
+            op = self.COMPARISONS[type(expression)]
+            left, right = self._compile(expression.this), self._compile(expression.expression)
+            return lambda row: self.compare(op, left(row), right(row))
+
+        if isinstance(expression, exp.Like):
+            this = self._compile(expression.this)
+            pattern = re.compile("".join(
+                ".*" if x == "%" else "." if x == "_" else re.escape(x)
+                for x in expression.expression.name
+            ), re.DOTALL)
+            return lambda row: None if (x := this(row)) is None else bool(pattern.fullmatch(str(x)))
+
+        if isinstance(expression, exp.In):
+            this = self._compile(expression.this)
+            values = [self._compile(x) for x in expression.expressions]
+
+            def _in(row: Row) -> Value:
+                results = [self.compare(operator.eq, this(row), x(row)) for x in values]
+                return True if True in results else None if None in results else False
+            return _in
+
+        if isinstance(expression, exp.Null):
+            return lambda row: None
+        if isinstance(expression, exp.Boolean):
+            return lambda row: expression.this
+        if isinstance(expression, (exp.Literal, exp.Neg)) and expression.is_number:
+            value = expression.to_py()
+            number: Value = float(value) if isinstance(value, Decimal) else value
+            return lambda row: number
+        if isinstance(expression, exp.Literal):
+            string = expression.name
+            return lambda row: string
+
+        extracted = self.resolve(expression)
+        if extracted is None:
+            raise UnsupportedQuery(f"Unsupported expression: {dialect.generate(expression)}")
+        self.columns[extracted.name] = extracted
+        name = extracted.name
+        return lambda row: row.get(name)
+
+    def required(self) -> t.List[Column]:
+        """ Get columns that must have values for the condition to be true
+
+        These are columns compared in top-level conjuncts of the condition:
+        comparison with NULL is never true, so no rows of page without such
+        column's elements pass the condition.
+
+        """
+        conjuncts = list(self.expression.flatten()) if isinstance(self.expression, exp.And) else [self.expression]
+        result = []
+        for conjunct in conjuncts:
+            conjunct = conjunct.unnest()
+            if type(conjunct) in self.COMPARISONS or isinstance(conjunct, (exp.Like, exp.In)):
+                for node in (conjunct.this, conjunct.args.get("expression")):
+                    extracted = node and self.resolve(node)
+                    if extracted:
+                        result.append(extracted)
+        return result
+
+
+class Prefilter:
+    """ Cheap check of the raw page before it's parsed
+
+    Page is dropped if it doesn't contain any of the required columns' tag &
+    child tag names or exact attribute values. Values having characters that
+    might be written as character references are not checked.
+
+    Parameters:
+        columns (list[Column]): columns required to have values
+
+    """
+    def __init__(self, columns: t.Sequence[Column]) -> None:
+        patterns = {}
+        for required in columns:
+            #  INFO: last part of the path may be attribute named as tag, e.g. `<a>.title`
+            names = [required.tag.this.value, *takewhile(ScrabyDialect.TAG_NAMES.__contains__, required.path[:-1])]
+            for name in names:
+                patterns[f"<{name}"] = re.compile(rf"<{re.escape(name)}[\s/>]", re.IGNORECASE)
+            for attr in required.tag.expressions:
+                value = attr.expression
+                if attr.args.get("is_regular") or not value or not value.isascii() \
+                or any(x in value for x in "&<>\"'"):
+                    continue
+                patterns[value] = re.compile(re.escape(value))
+        self.patterns = list(patterns.values())
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def __call__(self, text: str) -> bool:
+        return all(x.search(text) for x in self.patterns)
+
+
+@dataclass
+class Scan:
+    """ Physical plan of the query reading single source
+
+    Parameters:
+        source (Source): source of pages
+        columns (list[Column]): columns extracted from pages, projected ones
+            and the ones referenced by predicate
+        output (list[str]): names of projected columns
+        predicate (Predicate): condition rows are filtered with
+        prefilter (Prefilter): cheap check dropping pages before extraction
+        limit (int): max number of rows, no more pages are fetched once it's
+            satisfied
+        offset (int): number of skipped rows
+
+    """
+    source: Source
+    columns: t.List[Column]
+    output: t.List[str]
+    predicate: t.Optional[Predicate] = None
+    prefilter: t.Optional[Prefilter] = None
+    limit: t.Optional[int] = None
+    offset: int = 0
+
+
+@dataclass
+class Join:
+    """ Physical plan of the query joining two sources with hash join
+
+    Every side is read by its own scan with the side's conditions pushed
+    down. Hash table is built on rows of the side with fewer pages, rows of
+    the other side are streamed through it.
+
+    Parameters:
+        scans (list[Scan]): scans of the left & the right sources, their
+            outputs are all extracted columns
+        keys (list[str]): names of the key columns of every scan, rows are
+            joined when their keys are equal
+        output (list[str]): names of projected columns
+        outer (bool): whether left rows without matching right ones are kept
+            with NULL right columns (LEFT JOIN)
+        condition (Predicate): condition of ON clause the joined rows must
+            satisfy besides equal keys
+        predicate (Predicate): condition of WHERE clause joined rows are
+            filtered with
+        limit (int): max number of rows
+        offset (int): number of skipped rows
+
+    """
+    scans: t.List[Scan]
+    keys: t.List[str]
+    output: t.List[str]
+    outer: bool = False
+    condition: t.Optional[Predicate] = None
+    predicate: t.Optional[Predicate] = None
+    limit: t.Optional[int] = None
+    offset: int = 0
+
+    @property
+    def build(self) -> int:
+        """ Index of the scan with fewer pages, unbounded sources are the largest """
+        pages = [x.source.pages if x.source.pages >= 0 else float("inf") for x in self.scans]
+        return 0 if pages[0] < pages[1] else 1
+
+
+def _limits(scan: t.Union[Scan, Join], expression: exp.Select) -> None:
+    limit, offset = expression.args.get("limit"), expression.args.get("offset")
+    if limit:
+        scan.limit = int(limit.expression.to_py())
+    if offset:
+        scan.offset = int(offset.expression.to_py())
+
+
+def _conjuncts(condition: t.Optional[exp.Expression]) -> t.List[exp.Expression]:
+    if condition is None:
+        return []
+    condition = condition.unnest()
+    return [x.unnest() for x in condition.flatten()] if isinstance(condition, exp.And) else [condition]
+
+
+def optimize(expression: exp.Select) -> t.Union[Scan, Join]:
+    """ Plan the query pushing projection, predicate & limit down to page scans """
+    if expression.args.get("order"):
+        raise UnsupportedQuery("ORDER BY is not supported yet")
+    if expression.args.get("joins"):
+        return _optimize_join(expression)
+    load = expression.args.get("from") and expression.args["from"].find(LoadPage)
+    if not load:
+        raise ValueError("Query has no LOAD source")
+
+    projected = columns(expression)
+    aliases = {x.alias: y for x, y in zip(expression.expressions, projected) if x.alias}
+    extracted = {x.name: x for x in projected}
+
+    def resolve(node: exp.Expression) -> t.Optional[Column]:
+        if isinstance(node, exp.Column) and not node.table and node.name in aliases:
+            return aliases[node.name]
+        found = column(node)
+        return found and extracted.setdefault(found.name, found)
+
+    scan = Scan(
+        source=Source.from_expression(load).canonical,
+        columns=projected,
+        output=[x.name for x in projected],
+    )
+    where = expression.args.get("where")
+    if where:
+        scan.predicate = Predicate(where.this, resolve)
+        scan.prefilter = Prefilter(scan.predicate.required())
+        scan.columns = list(extracted.values())
+    _limits(scan, expression)
+    return scan
+
+
+def _optimize_join(expression: exp.Select) -> Join:
+    """ Plan the query joining two sources by equal columns
+
+    Conditions referencing a single side are pushed down to its scan unless
+    they would drop rows kept by LEFT JOIN. Equality of columns of both sides
+    becomes the join key, other conditions are evaluated on joined rows.
+
+    """
+    joins = expression.args["joins"]
+    tables = [expression.args["from"].this, *(x.this for x in joins)]
+    if len(tables) != 2:
+        raise UnsupportedQuery("Joins of more than two sources are not supported yet")
+    join = joins[0]
+    if join.side not in ("", "LEFT", "RIGHT") or join.kind not in ("", "INNER", "OUTER"):
+        raise UnsupportedQuery(f"{join.side} {join.kind} JOIN is not supported yet".replace("  ", " "))
+    if join.side == "RIGHT":
+        tables.reverse()
+    outer = bool(join.side)
+
+    aliases: t.List[str] = []
+    for table in tables:
+        if not isinstance(table, exp.Table) or not isinstance(table.this, LoadPage) or not table.alias:
+            raise UnsupportedQuery("Joined sources must be LOAD functions with aliases")
+        aliases.append(table.alias)
+    if aliases[0] == aliases[1]:
+        raise ValueError(f"Joined sources have the same alias: {aliases[0]}")
+
+    projected = columns(expression, aliases)
+    named = {x.alias: y for x, y in zip(expression.expressions, projected) if x.alias}
+    extracted: t.List[t.Dict[str, Column]] = [{}, {}]
+
+    def side(found: Column) -> int:
+        if found.source not in aliases:
+            raise UnsupportedQuery(
+                f"Column {found.name} must be qualified with alias of the joined source, e.g. {aliases[0]}.<div>"
+            )
+        return aliases.index(found.source)
+
+    def extract(found: Column) -> Column:
+        return extracted[side(found)].setdefault(found.name, found)
+
+    def resolve(node: exp.Expression) -> t.Optional[Column]:
+        if isinstance(node, exp.Column) and not node.table and node.name in named:
+            return extract(named[node.name])
+        found = column(node, aliases)
+        return found and extract(found)
+
+    def sides(condition: exp.Expression) -> t.Set[int]:
+        result = set()
+        for node in condition.walk():
+            if isinstance(node, exp.Column) and not node.table and node.name in named:
+                result.add(side(named[node.name]))
+            elif isinstance(node, exp.Column) or (isinstance(node, Tag) and not isinstance(node.parent, exp.Column)):
+                found = column(node, aliases)
+                if found:
+                    result.add(side(found))
+        return result
+
+    for projection in projected:
+        extract(projection)
+
+    keys: t.Optional[t.List[str]] = None
+    pushed: t.List[t.List[exp.Expression]] = [[], []]
+    conditions: t.List[exp.Expression] = []
+    residuals: t.List[exp.Expression] = []
+    where = expression.args.get("where")
+    for clause, conjuncts in (("on", _conjuncts(join.args.get("on"))), ("where", _conjuncts(where and where.this))):
+        for conjunct in conjuncts:
+            referenced = sides(conjunct)
+            if keys is None and isinstance(conjunct, exp.EQ) and referenced == {0, 1} \
+            and (clause == "on" or not outer):
+                left, right = resolve(conjunct.this), resolve(conjunct.expression)
+                if left and right and side(left) != side(right):
+                    keys = [x.name for x in ((left, right) if side(left) == 0 else (right, left))]
+                    continue
+            if len(referenced) == 1:
+                index, = referenced
+                #  INFO: LEFT JOIN keeps left rows failing ON conditions with
+                #  NULL right columns, so only ON conditions of the right side
+                #  and WHERE conditions of the left side filter scanned rows
+                if not outer or (clause == "on") == (index == 1):
+                    pushed[index].append(conjunct)
+                    continue
+            (conditions if clause == "on" else residuals).append(conjunct)
+    if keys is None:
+        raise UnsupportedQuery("Join needs equality of columns of both sources")
+
+    predicates = [Predicate(exp.and_(*x), resolve) if x else None for x in pushed]
+    result = Join(
+        scans=[],
+        keys=keys,
+        output=[x.name for x in projected],
+        outer=outer,
+        condition=Predicate(exp.and_(*conditions), resolve) if conditions else None,
+        predicate=Predicate(exp.and_(*residuals), resolve) if residuals else None,
+    )
+    for table, predicate, found in zip(tables, predicates, extracted):
+        result.scans.append(Scan(
+            source=Source.from_expression(table.this).canonical,
+            columns=list(found.values()),
+            output=list(found),
+            predicate=predicate,
+            prefilter=Prefilter(predicate.required()) if predicate else None,
+        ))
+    ambiguous = set(extracted[0]) & set(extracted[1])
+    if ambiguous:
+        raise UnsupportedQuery(f"Columns of both sources have the same names: {', '.join(sorted(ambiguous))}")
+    _limits(result, expression)
+    return result
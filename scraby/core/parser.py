@@ -1,12 +1,20 @@
 import re
+import sys
+import threading
 import typing as t
+import weakref
 
-from copy import deepcopy
-from sqlglot import exp, Generator
+from collections import OrderedDict
+from sqlglot import __version__ as sqlglot_version, exp, Generator
 from sqlglot.dialects import Dialect
 from sqlglot.parser import Parser, ParseError
 from sqlglot.tokens import Token, TokenType, Tokenizer, TokenError
 from scraby.utils.html import HTMLTag
+from scraby.utils.trace import tracer
+
+
+class UnsupportedQuery(ValueError):
+    """ Query is valid SQL, but uses features that can't be executed yet, e.g. ORDER BY """
 
 
 class TagAttr(exp.Expression):
@@ -26,9 +34,77 @@ class Tag(exp.Expression):
 
     Parameters:
         this (HTMLTag): enum element specifying this string tag, e.g. HTMLTag.DIV
-        expression (TagAttr): expression specifying tag attributes
+        expressions (list[TagAttr]): expressions specifying tag attributes
+
+    """
+    arg_types = {"this": True, "expressions": False}
+
+
+class CompactTag:
+    """ Compact hashable representation of the tag expression
+
+    Tag name is kept as a small int code of HTMLTag, attribute names & values
+    are interned strings sorted by name, so attributes' order doesn't matter.
+    Instances are interned too: equal tags are the same object, which makes
+    comparing & hashing them cheap and lets them share compiled matchers.
+
+    Parameters:
+        code (int): index of the tag in HTMLTag
+        attrs (tuple[tuple[str, str, bool], ...]): attribute names, values &
+            whether value is a regular expression
 
     """
+    __slots__ = ("code", "attrs", "_hash", "__weakref__")
+
+    TAGS: t.Tuple[HTMLTag, ...] = tuple(HTMLTag)
+    CODES: t.Dict[HTMLTag, int] = {x: i for i, x in enumerate(TAGS)}
+    _interned: "weakref.WeakValueDictionary[t.Tuple[int, t.Tuple[t.Tuple[str, str, bool], ...]], CompactTag]" = \
+        weakref.WeakValueDictionary()
+
+    code: int
+    attrs: t.Tuple[t.Tuple[str, str, bool], ...]
+    _hash: int
+
+    def __new__(cls, code: int, attrs: t.Iterable[t.Tuple[str, str, bool]] = ()) -> "CompactTag":
+        attrs = tuple(sorted((sys.intern(x), sys.intern(y), bool(z)) for x, y, z in attrs))
+        key = (code, attrs)
+        interned = cls._interned.get(key)
+        if interned is not None:
+            return interned
+        instance = super().__new__(cls)
+        instance.code, instance.attrs, instance._hash = code, attrs, hash(key)
+        cls._interned[key] = instance
+        return instance
+
+    @classmethod
+    def from_tag(cls, tag: Tag) -> "CompactTag":
+        return cls(cls.CODES[tag.this], (
+            (x.this, x.expression or "", bool(x.args.get("is_regular"))) for x in tag.expressions
+        ))
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other: object) -> bool:
+        #  INFO: interned tags are compared by identity, fields are compared
+        #  only for tags created concurrently by different threads
+        return self is other or (
+            isinstance(other, CompactTag) and self.code == other.code and self.attrs == other.attrs
+        )
+
+    def __reduce__(self) -> t.Tuple[t.Any, ...]:
+        return CompactTag, (self.code, self.attrs)
+
+    @property
+    def name(self) -> str:
+        return self.TAGS[self.code].value
+
+    def sql(self) -> str:
+        attrs = "".join(f" {x}={'r' if z else ''}\"{y}\"" for x, y, z in self.attrs)
+        return f"<{self.name}{attrs}>"
+
+    def __repr__(self) -> str:
+        return f"CompactTag({self.sql()})"
 
 
 class LoadPage(exp.Expression):
@@ -51,6 +127,11 @@ class ScrabyDialect(Dialect):
         TokenType.SELECT,
         TokenType.FROM,
         TokenType.JOIN,
+        TokenType.INNER,
+        TokenType.LEFT,
+        TokenType.RIGHT,
+        TokenType.OUTER,
+        TokenType.ON,
         TokenType.WHERE,
         TokenType.ORDER_BY,
         TokenType.LIMIT,
@@ -76,6 +157,17 @@ class ScrabyDialect(Dialect):
         TokenType.IDENTIFIER,
         TokenType.VAR,
         TokenType.DIV,
+        # predicate kws
+        TokenType.AND,
+        TokenType.OR,
+        TokenType.NOT,
+        TokenType.IS,
+        TokenType.NULL,
+        TokenType.TRUE,
+        TokenType.FALSE,
+        TokenType.LIKE,
+        TokenType.IN,
+        TokenType.OFFSET,
         #  TODO: add all other posible tokens
     }
     """ All allowed keywords including single-symbol tokens """
@@ -85,6 +177,9 @@ class ScrabyDialect(Dialect):
     }
     """ All posible HTML tags taken from HTMLTag enum """
 
+    TAG_NAMES: t.FrozenSet[str] = frozenset(HTMLTag.values())
+    """ Index of HTML tags' string values used while folding tags """
+
     class ScrabyGenerator(Generator):
         """ Custom SQLGlot generator
 
@@ -101,7 +196,7 @@ class ScrabyDialect(Dialect):
             #  WARNING: Tag.this should always be HTMLTag enum object
             this = expression.this.value
             attributes = ' '.join(map(
-                lambda x: f"{x.this}=\"{x.expression}\"",
+                lambda x: f"{x.this}={'r' if x.args.get('is_regular') else ''}\"{x.expression}\"",
                 expression.args.get('expressions', [])
             ))
             attributes = f" {attributes}" if attributes else ""
@@ -190,6 +285,78 @@ class ScrabyDialect(Dialect):
         self.parser_class = self.ScrabyParser
         self.generator_class = self.ScrabyGenerator
 
+    def fold_tags(self, sql: str, tokens: t.List[Token]) -> t.List[Token]:
+        """ Fold HTML tags' tokens into single VAR tokens
+
+        Scans the token stream once: each "<" glued to a known tag name starts
+        a tag construct, which ends on ">" and is replaced with one VAR token
+        marked with "Tag" comment. Construct is dropped when an alpha keyword
+        occurs before ">", so its tokens are kept as is; construct reaching
+        the end of the stream is folded with all the rest tokens.
+
+        """
+        folded: t.List[Token] = []
+        #  INFO: index of the first token after the last broken tag construct;
+        #  any tag started before it would break on the same token, so skip it
+        broken_till = 0
+        i, size = 0, len(tokens)
+
+        while i < size:
+            x = tokens[i]
+            #  INFO: raise TokenError when not allowed token used
+            if not x.token_type in self.KEYWORDS:
+                raise TokenError(f"Invalid expression / Unexpected token: {x}")
+            #  if starts with "<", close to next and contained in TAG_NAMES
+            if x.token_type == TokenType.LT \
+            and i >= broken_till \
+            and i + 1 < size \
+            and tokens[i+1].start == x.end + 1 \
+            and tokens[i+1].text in self.TAG_NAMES:
+                j = i + 1
+                # look for ">" and reset all if has SQL statements in body
+                while j < size and tokens[j].token_type != TokenType.GT \
+                and tokens[j].token_type not in self.ALPHA_KEYWORDS:
+                    j += 1
+                #  INFO: construct left unterminated at the end of the stream is
+                #  folded with all the rest tokens, so it fails as a single tag
+                if j == size or tokens[j].token_type == TokenType.GT:
+                    last = tokens[min(j, size - 1)]
+                    # replace range of found tag' tokens with one VAR token
+                    folded.append(Token(
+                        token_type=TokenType.VAR,
+                        text=sql[x.start:last.end+1],
+                        line=x.line,
+                        start=x.start,
+                        end=last.end+1,
+                        comments=[Tag.__name__]
+                    ))
+                    i = j + 1
+                    continue
+                broken_till = j
+            folded.append(x)
+            i += 1
+
+        return folded
+
+    def fold(self, sql: str) -> t.List[Token]:
+        """ Tokenize SQL string & fold its HTML tags' tokens """
+        with tracer.span("tokenize") as span:
+            tokens = self.tokenize(sql)
+            span.attrs["tokens"] = len(tokens)
+
+        #  FIX: sqlglot & SQL dont handle tags, so it should be parsed manually
+        #  WARNING: end counts as included: ... text: <, start: 13, end: 13, ...
+        with tracer.span("fold") as span:
+            tokens = self.fold_tags(sql, tokens)
+            span.attrs["tokens"] = len(tokens)
+        return tokens
+
+    def parse_tokens(self, sql: str, tokens: t.List[Token], **opts) -> t.List[t.Optional[exp.Expression]]:
+        """ Parse folded tokens of SQL string into syntax tree """
+        with tracer.span("parse"):
+            result = self.parser(**opts).parse(tokens, sql)
+        return result
+
     #  INFO: overriden in terms of custom tokenization
     def parse(self, sql: str, **opts) -> t.List[t.Optional[exp.Expression]]:
         """ Parse SQL string into syntax tree
@@ -200,50 +367,133 @@ class ScrabyDialect(Dialect):
         - define all allowed keywords and raise an exception if other was passed
         
         """
-        tokens = self.tokenize(sql)
+        return self.parse_tokens(sql, self.fold(sql), **opts)
 
-        #  FIX: sqlglot & SQL dont handle tags, so it should be parsed manually
-        #  WARNING: end counts as included: ... text: <, start: 13, end: 13, ...
-        for i, x in enumerate(tokens):
-            #  INFO: raise TokenError when not allowed token used
-            if not x.token_type in self.KEYWORDS:
-                raise TokenError(f"Invalid expression / Unexpected token: {x}")
-            #  if starts with "<", close to next and contained in TAGS
-            if x.token_type == TokenType.LT \
-            and tokens[i+1].start == x.end + 1 \
-            and tokens[i+1].text in HTMLTag.values():
-                tag_tokens: list[Token] = []
-                _tokens = deepcopy(tokens[i:])
-                while _tokens:
-                    # reset all if has SQL statements in body
-                    if _tokens[0].token_type in self.ALPHA_KEYWORDS:
-                        _tokens = tag_tokens = []
-                    # end tag construct if found ">"
-                    elif _tokens[0].token_type == TokenType.GT:
-                        tag_tokens.append(_tokens[0])
-                        _tokens = []
-                    # else just append tokens to list
-                    else:
-                        tag_tokens.append(_tokens.pop(0))
-
-                if tag_tokens:
-                    # replace range of found tag' tokens with one VAR token
-                    tokens[i:i+len(tag_tokens)] = [Token(
-                        token_type=TokenType.VAR,
-                        # text=''.join(tag_str),
-                        text=sql[tag_tokens[0].start:tag_tokens[-1].end+1],
-                        line=tag_tokens[0].line,
-                        start=tag_tokens[0].start,
-                        end=tag_tokens[-1].end+1,
-                        comments=['Tag']
-                    )]
-
-        result = self.parser(**opts).parse(tokens, sql)
-        return result
+
+class CacheInfo(t.NamedTuple):
+    """ Statistics of the parse cache """
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class ParseCache:
+    """ Bounded LRU cache of parsed syntax trees
+
+    Trees are keyed by folded tokens of the SQL string and parsing options:
+    whitespaces between tokens are dropped and keywords are uppercased, while
+    strings, identifiers, tags & comments are kept as is. So queries equal
+    for the parser share an entry, and every query is tokenized the same way
+    whether it's cached or not. Cached trees are never handed out directly:
+    every hit returns copies, so callers can modify them freely without
+    corrupting cached entries.
+
+    Parameters:
+        maxsize (int): max number of cached queries, least recently used one
+            is evicted when exceeded
+
+    """
+    KEYWORDS = frozenset(ScrabyDialect.ALPHA_KEYWORDS - {TokenType.LOAD})
+    """ Types of case insensitive keywords, LOAD is excluded as it's parsed as function """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict[t.Hashable, t.List[t.Optional[exp.Expression]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = 0
+
+    @classmethod
+    def key(cls, tokens: t.Sequence[Token], **opts) -> t.Hashable:
+        """ Get key of the folded tokens parsed with the options, see `ScrabyDialect.fold` """
+        return (
+            tuple(
+                (x.token_type, x.text.upper() if x.token_type in cls.KEYWORDS else x.text, tuple(x.comments))
+                for x in tokens
+            ),
+            tuple(sorted((k, repr(v)) for k, v in opts.items())),
+        )
+
+    def get(self, key: t.Hashable) -> t.Optional[t.List[t.Optional[exp.Expression]]]:
+        with self._lock:
+            trees = self._entries.get(key)
+            if trees is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(key)
+        return [x and x.copy() for x in trees]
+
+    def put(self, key: t.Hashable, trees: t.List[t.Optional[exp.Expression]]) -> None:
+        trees = [x and x.copy() for x in trees]
+        with self._lock:
+            self._entries[key] = trees
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._evictions, self.maxsize, len(self._entries))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._misses = self._evictions = 0
+
+    def save(self, path: str) -> None:
+        """ Persist cached trees to pickle file, so they survive restarts """
+        with self._lock:
+            entries = list(self._entries.items())
+        import pickle  # pylint: disable=import-outside-toplevel
+        with open(path, "wb") as file:
+            pickle.dump((sqlglot_version, entries), file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, path: str) -> None:
+        """ Warm cache up with trees saved by another process
+
+        File is ignored if it was saved with different SQLGlot version, as
+        its trees may not match trees parsed by current one.
+
+        """
+        import pickle  # pylint: disable=import-outside-toplevel
+        with open(path, "rb") as file:
+            version, entries = pickle.load(file)
+        if version != sqlglot_version:
+            return
+        for key, trees in entries:
+            self.put(key, trees)
+
+
+#  INFO: dialect & parse cache are built on first use rather than on import,
+#  so modules & tools importing the parser only for its expressions or
+#  constants don't pay for them
+if t.TYPE_CHECKING:
+    dialect: ScrabyDialect
+    cache: ParseCache
+
+_SHARED: t.Dict[str, t.Callable[[], t.Any]] = {"dialect": ScrabyDialect, "cache": ParseCache}
+_shared_lock = threading.Lock()
 
 
-dialect = ScrabyDialect()
+def __getattr__(name: str) -> t.Any:
+    if name not in _SHARED:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _shared_lock:
+        if name not in globals():
+            globals()[name] = _SHARED[name]()
+    return globals()[name]
 
 
 def parse(sql: str, **kwargs) -> list[t.Optional[exp.Expression]]:
-    return dialect.parse(sql, **kwargs)
+    dialect, cache = __getattr__("dialect"), __getattr__("cache")
+    tokens = dialect.fold(sql)
+    key = cache.key(tokens, **kwargs)
+    result = cache.get(key)
+    tracer.count("parse.cache.hits" if result is not None else "parse.cache.misses")
+    if result is None:
+        result = dialect.parse_tokens(sql, tokens, **kwargs)
+        cache.put(key, result)
+    return result
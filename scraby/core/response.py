@@ -0,0 +1,53 @@
+import re
+import typing as t
+
+from dataclasses import dataclass, field
+
+
+def decode(body: t.Union[bytes, memoryview], encoding: str) -> str:
+    try:
+        return str(body, encoding, errors="replace")
+    except LookupError:
+        return str(body, "utf-8", errors="replace")
+
+
+def charset(headers: t.Mapping[str, str]) -> str:
+    """ Get charset from Content-Type header, UTF-8 by default """
+    found = re.search(r"charset=[\"']?([\w-]+)", headers.get("content-type", ""))
+    return found.group(1) if found else "utf-8"
+
+
+@dataclass
+class Response:
+    """ Response of the transport
+
+    Parameters:
+        url (str): final url of the response
+        status (int): HTTP status code
+        headers (dict[str, str]): response headers with lowercased names
+        body (bytes | memoryview): decoded response body; bodies of archive
+            pages are read-only memoryviews of the mapped files, which are
+            passed on without copying & keep the map open while referenced,
+            so consumers use buffer operations only & copy them with `bytes`
+            to get bytes methods
+
+    """
+    url: str
+    status: int
+    headers: t.Dict[str, str] = field(default_factory=dict)
+    body: t.Union[bytes, memoryview] = b""
+    truncated: bool = False
+    """ Whether the download was aborted by the body consumer """
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    @property
+    def charset(self) -> str:
+        """ Charset from Content-Type, UTF-8 by default """
+        return charset(self.headers)
+
+    @property
+    def text(self) -> str:
+        return decode(self.body, self.charset)
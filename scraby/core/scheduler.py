@@ -0,0 +1,197 @@
+import asyncio
+import time
+import typing as t
+
+from collections import deque, OrderedDict
+from email.utils import parsedate_to_datetime
+
+
+class Throttled(ConnectionError):
+    """ Host kept throttling the request after all its retries """
+
+
+class HostMetrics(t.NamedTuple):
+    """ Snapshot of the host's limiter state """
+    rate: float
+    """ Current rate in requests per second """
+    tokens: float
+    """ Tokens available for requests right now """
+    queued: int
+    """ Number of requests waiting for tokens """
+    requests: int
+    """ Number of requests the tokens were granted to """
+    throttled: int
+    """ Number of responses the host throttled requests with """
+    latency: t.Optional[float]
+    """ Moving average of response latency in seconds """
+
+
+def retry_after(value: t.Optional[str]) -> t.Optional[float]:
+    """ Get seconds to wait from Retry-After header value, either seconds or HTTP date """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    """ Adaptive token bucket of a single host
+
+    Rate is increased additively on fast successful responses & decreased
+    multiplicatively on throttling responses or latency growing over the
+    observed baseline. Retry-After pauses the host until the given time.
+    Requests waiting for tokens are queued per source & served round-robin.
+
+    Parameters:
+        rate (float): initial rate in requests per second
+        burst (float): max number of tokens accumulated by idle host
+        min_rate (float): rate is never decreased below
+        max_rate (float): rate is never increased above
+
+    """
+    THROTTLING = (429, 503)
+    """ Statuses of responses throttling requests """
+
+    def __init__(self, rate: float, burst: float, min_rate: float, max_rate: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = burst
+        self.requests = self.throttled = 0
+        self.latency: t.Optional[float] = None
+        self.baseline: t.Optional[float] = None
+        """ Lowest observed latency """
+        self.paused_until = 0.0
+        self.queues: t.OrderedDict[t.Hashable, t.Deque[asyncio.Future]] = OrderedDict()
+        self._updated = time.monotonic()
+        self._loop: t.Optional[asyncio.AbstractEventLoop] = None
+        self._timer: t.Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for queue in self.queues.values() for x in queue if not x.done())
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """ Drop requests & timer of the previous event loop """
+        if loop is not self._loop:
+            self._loop = loop
+            self.queues.clear()
+            self._timer = None
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def dispatch(self) -> None:
+        """ Grant available tokens to waiting requests & schedule next dispatch """
+        now = time.monotonic()
+        self.refill(now)
+        while self.queues and self.tokens >= 1 and now >= self.paused_until:
+            source, queue = self.queues.popitem(last=False)
+            while queue and queue[0].done():
+                queue.popleft()
+            if not queue:
+                continue
+            queue.popleft().set_result(None)
+            self.tokens -= 1
+            self.requests += 1
+            if queue:
+                self.queues[source] = queue
+        if self.queues and self._timer is None:
+            delay = max(self.paused_until - now, (1 - self.tokens) / self.rate, 0.001)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._tick)
+
+    def _tick(self) -> None:
+        self._timer = None
+        self.dispatch()
+
+    def feedback(self, status: int, latency: float, pause: t.Optional[float] = None) -> None:
+        if status in self.THROTTLING:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            if pause:
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            return
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.baseline = latency if self.baseline is None else min(self.baseline, latency)
+        #  INFO: latency growing over the baseline means host is getting overloaded
+        if self.latency > 2 * self.baseline + 0.05:
+            self.rate = max(self.min_rate, self.rate * 0.9)
+        else:
+            self.rate = min(self.max_rate, self.rate + 0.5)
+
+    def metrics(self) -> HostMetrics:
+        self.refill(time.monotonic())
+        return HostMetrics(
+            rate=self.rate,
+            tokens=self.tokens,
+            queued=self.queued,
+            requests=self.requests,
+            throttled=self.throttled,
+            latency=self.latency,
+        )
+
+
+class Scheduler:
+    """ Scheduler of page requests keeping adaptive rate limit per host
+
+    Every request waits for its host's token first. Requests of different
+    sources to the same host are interleaved fairly, so a long crawl doesn't
+    starve a small query.
+
+    Parameters:
+        rate (float): initial rate of every host in requests per second
+        burst (float): max number of requests sent to idle host at once
+        min_rate (float): min rate of the host
+        max_rate (float): max rate of the host
+        retries (int): max number of retries of throttled request, request
+            still throttled after them fails with `Throttled`
+
+    """
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: float = 4.0,
+        min_rate: float = 0.1,
+        max_rate: float = 100.0,
+        retries: int = 3,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.retries = retries
+        self.hosts: t.Dict[str, HostLimiter] = {}
+
+    def limiter(self, host: str) -> HostLimiter:
+        if host not in self.hosts:
+            self.hosts[host] = HostLimiter(self.rate, self.burst, self.min_rate, self.max_rate)
+        return self.hosts[host]
+
+    async def acquire(self, host: str, source: t.Hashable) -> None:
+        """ Wait for the host's token in the queue of the source """
+        limiter = self.limiter(host)
+        loop = asyncio.get_running_loop()
+        limiter.bind(loop)
+        future = loop.create_future()
+        limiter.queues.setdefault(source, deque()).append(future)
+        limiter.dispatch()
+        await future
+
+    def feedback(self, host: str, status: int, latency: float, headers: t.Mapping[str, str]) -> bool:
+        """ Adapt the host's rate to response & get whether request should be retried """
+        limiter = self.limiter(host)
+        limiter.feedback(status, latency, retry_after(headers.get("retry-after")))
+        return status in limiter.THROTTLING
+
+    def metrics(self) -> t.Dict[str, HostMetrics]:
+        """ Get snapshot of every host's rate & queue depth """
+        return {host: x.metrics() for host, x in self.hosts.items()}
@@ -0,0 +1,303 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing as t
+import zlib
+
+from dataclasses import dataclass, field
+from scraby.core.response import Response
+
+if t.TYPE_CHECKING:
+    from scraby.core.executor import Values
+
+
+class Store:  # pylint: disable=too-few-public-methods
+    """ SQLite database of the state kept between query runs
+
+    Database is shared by threads of the executor, every access holds the
+    lock. Tables are created on open by the statements of `SCHEMA`.
+
+    Parameters:
+        path (str): path of the database file, parent directories are created
+
+    """
+    SCHEMA: t.Sequence[str] = ()
+    """ Statements creating tables & indices of the store """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        #  INFO: WAL journal with NORMAL sync doesn't fsync on every commit
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache(Store):
+    """ On-disk cache of successful responses
+
+    Responses are stored in SQLite database with compressed bodies, their
+    ETag & Last-Modified validators. Least recently used entries are evicted
+    once total size of stored bodies exceeds the limit. Cache hits don't
+    write: access times are kept in memory and written in batches, before
+    eviction and on close.
+
+    Parameters:
+        path (str): path of the database file
+        max_size (int): max total size of compressed bodies in bytes
+        interval (int): max number of access times kept unwritten
+
+    """
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            status INTEGER,
+            headers TEXT,
+            body BLOB,
+            size INTEGER,
+            stored REAL,
+            accessed REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)",
+    )
+
+    def __init__(self, path: str, max_size: int = 512 * 2**20, interval: int = 256) -> None:
+        self.max_size = max_size
+        self.interval = interval
+        self.hits = self.misses = self.revalidations = self.evictions = 0
+        self._accessed: t.Dict[str, float] = {}
+        super().__init__(path)
+        self.size: int = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        """ Total size of stored bodies, kept up to date instead of summing them on every write """
+
+    def _flush(self) -> None:
+        """ Write pending access times, the lock must be held """
+        if self._accessed:
+            self._db.executemany(
+                "UPDATE responses SET accessed = ? WHERE url = ?", [(y, x) for x, y in self._accessed.items()]
+            )
+            self._accessed.clear()
+
+    def get(self, url: str) -> t.Optional[t.Tuple[Response, float]]:
+        """ Get cached response & time it was stored or revalidated at """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, headers, body, stored FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._accessed[url] = time.time()
+            if len(self._accessed) >= self.interval:
+                self._flush()
+                self._db.commit()
+        status, headers, body, stored = row
+        return Response(url=url, status=status, headers=json.loads(headers), body=zlib.decompress(body)), stored
+
+    def put(self, url: str, response: Response) -> None:
+        body = zlib.compress(response.body)
+        now = time.time()
+        with self._lock:
+            replaced = self._db.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, response.status, json.dumps(response.headers), body, len(body), now, now),
+            )
+            self._accessed.pop(url, None)
+            self.size += len(body) - (replaced[0] if replaced else 0)
+            if self.size > self.max_size:
+                self._flush()
+            while self.size > self.max_size:
+                oldest, oldest_size = self._db.execute(
+                    "SELECT url, size FROM responses ORDER BY accessed LIMIT 1"
+                ).fetchone()
+                self._db.execute("DELETE FROM responses WHERE url = ?", (oldest,))
+                self.evictions += 1
+                self.size -= oldest_size
+            self._db.commit()
+
+    def touch(self, url: str) -> None:
+        """ Mark cached response as revalidated now """
+        now = time.time()
+        with self._lock:
+            self._accessed.pop(url, None)
+            self._db.execute("UPDATE responses SET stored = ?, accessed = ? WHERE url = ?", (now, now, url))
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self._db.commit()
+        super().close()
+
+
+@dataclass
+class Progress:
+    """ Progress of the query run
+
+    Parameters:
+        pages (bytearray): bitmap of completed page indices, bit `i - 1` is
+            set once all rows of page `i` were consumed
+        skipped (int): number of rows skipped by OFFSET so far
+        produced (int): number of rows produced so far, output appended by
+            the previous run past this row belongs to incomplete pages
+
+    """
+    pages: bytearray = field(default_factory=bytearray)
+    skipped: int = 0
+    produced: int = 0
+
+    def done(self, index: int) -> bool:
+        byte, bit = divmod(index - 1, 8)
+        return byte < len(self.pages) and bool(self.pages[byte] >> bit & 1)
+
+    def mark(self, index: int) -> None:
+        byte, bit = divmod(index - 1, 8)
+        if byte >= len(self.pages):
+            self.pages.extend(bytes(byte - len(self.pages) + 1))
+        self.pages[byte] |= 1 << bit
+
+    @property
+    def cursor(self) -> int:
+        """ First page index that is not completed """
+        index = 1
+        while self.done(index):
+            index += 1
+        return index
+
+
+class Checkpoint(Store):
+    """ On-disk progress of queries making their runs resumable
+
+    Progress is stored in SQLite database per query text till the query
+    completes, so only interrupted runs are resumed. Writes are batched:
+    progress is committed once `interval` pages were completed or `delay`
+    seconds passed since the last commit, and when the run stops. Crashed run
+    therefore repeats up to `interval` pages on restart.
+
+    Parameters:
+        path (str): path of the database file
+        interval (int): max number of completed pages between commits
+        delay (float): max seconds between commits
+
+    """
+    SCHEMA = ("""
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            query TEXT PRIMARY KEY,
+            pages BLOB,
+            cursor INTEGER,
+            skipped INTEGER,
+            produced INTEGER,
+            updated REAL
+        )
+    """,)
+
+    def __init__(self, path: str, interval: int = 64, delay: float = 5.0) -> None:
+        self.interval = interval
+        self.delay = delay
+        self.commits = 0
+        self._pending: t.Dict[str, int] = {}
+        self._committed: t.Dict[str, float] = {}
+        super().__init__(path)
+
+    def load(self, query: str) -> Progress:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT pages, skipped, produced FROM checkpoints WHERE query = ?", (query,)
+            ).fetchone()
+        self._committed[query] = time.monotonic()
+        if row is None:
+            return Progress()
+        pages, skipped, produced = row
+        return Progress(pages=bytearray(pages), skipped=skipped, produced=produced)
+
+    def save(self, query: str, progress: Progress, force: bool = False) -> bool:
+        """ Save progress of the query if it's due & get whether it was committed """
+        self._pending[query] = self._pending.get(query, 0) + 1
+        if not force and self._pending[query] < self.interval \
+        and time.monotonic() - self._committed.get(query, 0) < self.delay:
+            return False
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?)",
+                (query, bytes(progress.pages), progress.cursor, progress.skipped, progress.produced, time.time()),
+            )
+            self._db.commit()
+        self.commits += 1
+        self._pending[query] = 0
+        self._committed[query] = time.monotonic()
+        return True
+
+    def clear(self, query: str) -> None:
+        """ Forget progress of the query, so it's run from the start """
+        with self._lock:
+            self._db.execute("DELETE FROM checkpoints WHERE query = ?", (query,))
+            self._db.commit()
+
+
+class Snapshot(Store):
+    """ On-disk rows extracted from pages by the previous query runs
+
+    Rows of every query's page are stored along with the digest of the page
+    response, so unchanged pages may reuse their rows without parsing.
+
+    Parameters:
+        path (str): path of the database file
+
+    """
+    SCHEMA = ("""
+        CREATE TABLE IF NOT EXISTS pages (
+            query TEXT,
+            url TEXT,
+            digest BLOB,
+            rows TEXT,
+            PRIMARY KEY (query, url)
+        )
+    """,)
+
+    def __init__(self, path: str) -> None:
+        self.hits = self.misses = 0
+        super().__init__(path)
+
+    @staticmethod
+    def digest(response: Response) -> bytes:
+        digest = hashlib.blake2b(str(response.status).encode(), digest_size=16)
+        digest.update(response.body)
+        return digest.digest()
+
+    def get(self, query: str, url: str) -> t.Optional[t.Tuple[bytes, t.List["Values"]]]:
+        """ Get digest of the page & its rows stored by the previous run """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest, rows FROM pages WHERE query = ? AND url = ?", (query, url)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], [tuple(x) for x in json.loads(row[1])]
+
+    def put(self, query: str, url: str, digest: bytes, rows: t.List["Values"]) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", (query, url, digest, json.dumps(rows)))
+            self._db.commit()
+
+    def urls(self, query: str) -> t.List[str]:
+        with self._lock:
+            return [x for x, in self._db.execute("SELECT url FROM pages WHERE query = ?", (query,))]
+
+    def remove(self, query: str, url: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM pages WHERE query = ? AND url = ?", (query, url))
+            self._db.commit()
@@ -0,0 +1,186 @@
+""" Memory-mapped archives of pages for offline scraping
+
+Supported files:
+    *.warc: WARC file, every response or resource record is a page
+    file with *.idx file next to it: concatenated pages, every line of the
+        index is offset & length of the page in bytes, optionally followed
+        by the page url
+    any other file: single page
+
+Bodies of the pages are memoryviews of the memory-mapped files, so they're
+passed to the extractor without copying; only chunked or compressed HTTP
+payloads of WARC records are decoded into new bytes.
+
+"""
+import bisect
+import glob
+import mmap
+import os
+import typing as t
+import zlib
+
+
+Buffer = t.Union[bytes, memoryview]
+
+Mapped = t.Union[mmap.mmap, bytes]
+
+
+class Record(t.NamedTuple):
+    """ Page read from the archive """
+    url: t.Optional[str]
+    """ Original url of the page if the archive keeps it """
+    status: int
+    headers: t.Dict[str, str]
+    """ HTTP headers with lowercased names """
+    body: Buffer
+
+
+class Entry(t.NamedTuple):
+    """ Location of the page in the archive file """
+    offset: int
+    length: int
+    url: t.Optional[str] = None
+    http: bool = False
+    """ Whether the page starts with HTTP status line & headers """
+
+
+def _headers(lines: t.Iterable[bytes]) -> t.Dict[str, str]:
+    headers = {}
+    for line in lines:
+        name, _, value = line.decode("latin-1").partition(":")
+        if name:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def warc_index(buffer: Mapped) -> t.List[Entry]:
+    """ Index response & resource records of the WARC file walking their headers only """
+    entries, offset = [], 0
+    while offset < len(buffer):
+        end = buffer.find(b"\r\n\r\n", offset)
+        if end < 0:
+            break
+        lines = buffer[offset:end].split(b"\r\n")
+        if not lines[0].startswith(b"WARC/"):
+            raise ValueError(f"Invalid WARC record at offset {offset}")
+        headers = _headers(lines[1:])
+        start, length = end + 4, int(headers.get("content-length", 0))
+        kind = headers.get("warc-type")
+        if kind in ("response", "resource"):
+            entries.append(Entry(start, length, headers.get("warc-target-uri"), kind == "response"))
+        #  INFO: every record's block is followed by two CRLFs
+        offset = start + length + 4
+    return entries
+
+
+def offset_index(path: str) -> t.List[Entry]:
+    """ Read index of the concatenated pages, lines of offset, length & optional url """
+    entries = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            parts = line.split(None, 2)
+            if parts:
+                entries.append(Entry(int(parts[0]), int(parts[1]), parts[2].strip() if len(parts) > 2 else None))
+    return entries
+
+
+def _dechunk(data: Buffer) -> bytes:
+    view, chunks, offset = memoryview(data), [], 0
+    while True:
+        end = bytes(view[offset:offset + 64]).find(b"\r\n")
+        if end < 0:
+            break
+        size = int(bytes(view[offset:offset + end]).split(b";", 1)[0], 16)
+        if not size:
+            break
+        offset += end + 2
+        chunks.append(view[offset:offset + size])
+        offset += size + 2
+    return b"".join(chunks)
+
+
+class ArchiveFile:
+    """ Memory-mapped archive file & index of its pages
+
+    Parameters:
+        path (str): path of the file
+
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as file:
+            #  INFO: empty files can't be mapped
+            self.buffer: Mapped = mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ
+            ) if os.fstat(file.fileno()).st_size else b""
+        if path.endswith(".warc"):
+            self.entries = warc_index(self.buffer)
+        elif os.path.exists(f"{path}.idx"):
+            self.entries = offset_index(f"{path}.idx")
+        else:
+            self.entries = [Entry(0, len(self.buffer))]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, index: int) -> Record:
+        entry = self.entries[index]
+        stop = entry.offset + entry.length
+        body = memoryview(self.buffer)[entry.offset:stop]
+        if not entry.http:
+            return Record(entry.url, 200, {}, body)
+        end = self.buffer.find(b"\r\n\r\n", entry.offset, stop)
+        end = stop if end < 0 else end
+        lines = self.buffer[entry.offset:end].split(b"\r\n")
+        status = int(lines[0].split(b" ", 2)[1])
+        headers = _headers(lines[1:])
+        payload: Buffer = body[end + 4 - entry.offset:]
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            payload = _dechunk(payload)
+        encoding = headers.get("content-encoding", "").lower()
+        if encoding in ("gzip", "deflate"):
+            payload = zlib.decompress(payload, 16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS)
+        return Record(entry.url, status, headers, payload)
+
+    def close(self) -> None:
+        if isinstance(self.buffer, mmap.mmap):
+            try:
+                self.buffer.close()
+            except BufferError:
+                #  INFO: bodies are still referenced, the map is closed once they're released
+                pass
+
+
+class Archive:
+    """ Pages of all files matching the glob pattern, numbered across files in sorted order
+
+    Files are mapped & indexed lazily, when their pages are requested.
+
+    Parameters:
+        pattern (str): glob pattern of the archive files, e.g. "/data/*.warc"
+
+    """
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        self.paths = sorted(x for x in glob.glob(pattern) if os.path.isfile(x) and not x.endswith(".idx"))
+        self.files: t.List[ArchiveFile] = []
+        self._offsets = [0]
+        """ Number of pages in all files before every opened file """
+
+    def page(self, index: int) -> t.Optional[Record]:
+        """ Get page by its index starting from 1, None if there are fewer pages """
+        index -= 1
+        while index >= self._offsets[-1] and len(self.files) < len(self.paths):
+            self.files.append(ArchiveFile(self.paths[len(self.files)]))
+            self._offsets.append(self._offsets[-1] + len(self.files[-1]))
+        if not 0 <= index < self._offsets[-1]:
+            return None
+        #  INFO: the last offset with pages before the index is the page's file
+        i = bisect.bisect_right(self._offsets, index) - 1
+        return self.files[i][index - self._offsets[i]]
+
+    def close(self) -> None:
+        for file in self.files:
+            file.close()
+        self.files.clear()
+        self._offsets = [0]
@@ -0,0 +1,158 @@
+import typing as t
+
+from array import array
+
+if t.TYPE_CHECKING:
+    import pyarrow  # type: ignore[import-untyped]
+
+
+def _pyarrow() -> t.Any:
+    """ Import optional pyarrow dependency """
+    try:
+        import pyarrow  # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Arrow & Parquet output: pip install scraby[arrow]") from e
+    return pyarrow
+
+
+class DictionaryColumn:
+    """ Dictionary encoded column of strings
+
+    Values are stored as contiguous array of int32 indices into the list of
+    distinct values along with Arrow-compatible validity bitmap, so the
+    column is converted to Arrow array without touching its values.
+
+    Parameters:
+        name (str): column name
+
+    """
+    __slots__ = ("name", "indices", "dictionary", "validity", "null_count", "_codes")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.indices = array("i")
+        self.dictionary: t.List[str] = []
+        self.validity = bytearray()
+        self.null_count = 0
+        self._codes: t.Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def append(self, value: t.Optional[str]) -> None:
+        i = len(self.indices)
+        if i % 8 == 0:
+            self.validity.append(0)
+        if value is None:
+            self.indices.append(0)
+            self.null_count += 1
+            return
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        self.indices.append(code)
+        self.validity[-1] |= 1 << (i % 8)
+
+    def to_pylist(self) -> t.List[t.Optional[str]]:
+        return [
+            self.dictionary[x] if self.validity[i // 8] >> (i % 8) & 1 else None
+            for i, x in enumerate(self.indices)
+        ]
+
+    def to_arrow(self) -> "pyarrow.DictionaryArray":
+        pa = _pyarrow()
+        indices = pa.Array.from_buffers(
+            pa.int32(),
+            len(self),
+            [pa.py_buffer(self.validity) if self.null_count else None, pa.py_buffer(self.indices)],
+            self.null_count,
+        )
+        return pa.DictionaryArray.from_arrays(indices, pa.array(self.dictionary, pa.string()))
+
+
+class Batch:
+    """ Column-oriented batch of query rows
+
+    Parameters:
+        names (list[str]): names of projected columns
+
+    """
+    def __init__(self, names: t.Sequence[str]) -> None:
+        self.names = list(names)
+        self.columns = [DictionaryColumn(x) for x in names]
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def append(self, values: t.Sequence[t.Optional[str]]) -> None:
+        for column, value in zip(self.columns, values):
+            column.append(value)
+
+    def to_pydict(self) -> t.Dict[str, t.List[t.Optional[str]]]:
+        return {x.name: x.to_pylist() for x in self.columns}
+
+    def to_arrow(self) -> "pyarrow.RecordBatch":
+        pa = _pyarrow()
+        return pa.RecordBatch.from_arrays([x.to_arrow() for x in self.columns], names=self.names)
+
+
+class ParquetFile:
+    """ Parquet file batches are appended to one by one
+
+    Parameters:
+        path (str | IO): path of the file or binary stream, schema is
+            defined by the first batch
+
+    """
+    def __init__(self, path: t.Union[str, t.IO]) -> None:
+        self.path = path
+        self.rows = 0
+        self._writer: t.Any = None
+
+    def write(self, batch: Batch) -> None:
+        pa = _pyarrow()
+        import pyarrow.parquet as pq  # type: ignore[import-untyped]  # pylint: disable=import-outside-toplevel
+
+        record_batch = batch.to_arrow()
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, record_batch.schema)
+        self._writer.write_table(pa.Table.from_batches([record_batch]))
+        self.rows += len(batch)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+def write_parquet(batches: t.Iterable[Batch], path: str) -> int:
+    """ Write batches to Parquet file & get number of written rows """
+    file = ParquetFile(path)
+    try:
+        for batch in batches:
+            file.write(batch)
+    finally:
+        file.close()
+    return file.rows
+
+
+def write_ipc(batches: t.Iterable[Batch], path: str) -> int:
+    """ Write batches to Arrow IPC stream file & get number of written rows
+
+    Stream format is used as every batch has its own dictionaries.
+
+    """
+    pa = _pyarrow()
+    writer, rows = None, 0
+    with pa.OSFile(path, "wb") as sink:
+        try:
+            for batch in batches:
+                record_batch = batch.to_arrow()
+                if writer is None:
+                    writer = pa.ipc.new_stream(sink, record_batch.schema)
+                writer.write_batch(record_batch)
+                rows += len(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+    return rows
@@ -1 +1,287 @@
-#  TODO: make cli happen here
+""" Command-line runner of scraby queries
+
+Queries are read from arguments, a file or stdin & parsed all up front.
+They are run concurrently by one executor: pages of urls shared by several
+queries are fetched once and all requests share the connection budget.
+
+Usage:
+    scraby "SELECT <a>.href FROM LOAD('https://example.org')"
+    scraby -f queries.sql --format csv --output "rows/{query}.csv"
+    cat queries.sql | scraby --format ndjson > rows.ndjson
+    scraby "SELECT <title> FROM LOAD('file:///archive/*.warc')" --format parquet -o titles.parquet
+
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import typing as t
+
+from sqlglot import exp
+from scraby.core.analyzer import analyze, Budget
+from scraby.core.executor import (
+    ArchiveTransport, CachedTransport, Executor, HTTPTransport, ResponseCache, SharedTransport, Snapshot, Transport,
+    Values,
+)
+from scraby.core.optimizer import Join, optimize
+from scraby.core.parser import dialect, UnsupportedQuery
+from scraby.utils.batch import Batch, ParquetFile
+from scraby.utils.plan import explain
+
+
+FORMATS = ("ndjson", "csv", "parquet")
+
+
+class Output:
+    """ Writer of the query rows
+
+    Parameters:
+        file (str | IO): path of the file or stream to write to
+        names (list[str]): names of the query columns
+        extra (dict): values added to every row, e.g. index of the query
+
+    """
+    MODE = "w"
+    """ Mode the file is opened with, binary outputs require path of the file """
+
+    def __init__(self, file: t.Union[str, t.IO], names: t.Sequence[str], extra: t.Dict[str, t.Any]) -> None:
+        self.names = list(names)
+        self.extra = extra
+        self._owned = isinstance(file, str)
+        #  INFO: output owns the file it opened till it's closed
+        self.file: t.IO = open(  # pylint: disable=consider-using-with
+            file, self.MODE, newline=None if "b" in self.MODE else "", encoding=None if "b" in self.MODE else "utf-8"
+        ) if isinstance(file, str) else file
+
+    def write(self, values: Values) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        if self._owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class NDJSONOutput(Output):
+    """ Writer of the query rows as JSON objects, one per line """
+    def write(self, values: Values) -> None:
+        self.file.write(json.dumps({**self.extra, **dict(zip(self.names, values))}, ensure_ascii=False) + "\n")
+
+
+class CSVOutput(Output):
+    """ Writer of the query rows as CSV lines after the header of column names """
+    def __init__(self, *args: t.Any) -> None:
+        super().__init__(*args)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([*self.extra, *self.names])
+
+    def write(self, values: Values) -> None:
+        self.writer.writerow([*self.extra.values(), *values])
+
+
+class ParquetOutput(Output):
+    """ Writer of the query rows into Parquet file by batches of dictionary-encoded columns """
+    SIZE = 65536
+    MODE = "wb"
+
+    def __init__(self, file: str, names: t.Sequence[str], extra: t.Dict[str, t.Any]) -> None:
+        super().__init__(file, names, extra)
+        self.columns = [*extra, *names]
+        """ Names of the extra & query columns of the file """
+        self.constants = tuple(extra.values())
+        """ Extra values of every row """
+        self.parquet = ParquetFile(self.file)
+        self.batch = Batch(self.columns)
+
+    def write(self, values: Values) -> None:
+        self.batch.append((*self.constants, *values))
+        if len(self.batch) >= self.SIZE:
+            self.parquet.write(self.batch)
+            self.batch = Batch(self.columns)
+
+    def close(self) -> None:
+        if len(self.batch) or not self.parquet.rows:
+            self.parquet.write(self.batch)
+        self.parquet.close()
+        super().close()
+
+
+OUTPUTS: t.Dict[str, t.Type[Output]] = {
+    "ndjson": NDJSONOutput,
+    "csv": CSVOutput,
+    "parquet": ParquetOutput,
+}
+
+
+def read(queries: t.Sequence[str], file: t.Optional[str]) -> str:
+    """ Get text of all queries, stdin is read when no queries were passed """
+    texts = list(queries)
+    if file == "-" or (not file and not texts):
+        texts.append(sys.stdin.read())
+    elif file:
+        with open(file, "r", encoding="utf-8") as stream:
+            texts.append(stream.read())
+    return ";\n".join(texts)
+
+
+def parse(text: str) -> t.List[exp.Expression]:
+    """ Parse all statements of the text with one dialect instance """
+    return [x for x in dialect.parse(text) if x is not None]
+
+
+def open_output(
+    options: argparse.Namespace,
+    index: int,
+    names: t.Sequence[str],
+    many: bool,
+    shared: t.Optional[t.IO] = None,
+) -> Output:
+    """ Open output of the query rows, `shared` stream is written by all queries if it's passed """
+    extra = {"_query": index} if many and "{query}" not in (options.output or "") else {}
+    if shared is not None:
+        return OUTPUTS[options.format](shared, names, extra)
+    if not options.output or options.output == "-":
+        if options.format == "parquet":
+            raise ValueError("Parquet output needs --output file")
+        return OUTPUTS[options.format](sys.stdout, names, extra)
+    path = options.output.replace("{query}", str(index))
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return OUTPUTS[options.format](path, names, extra)
+
+
+async def run(executor: Executor, queries: t.Sequence[exp.Select], options: argparse.Namespace) -> int:
+    """ Run queries concurrently & get number of failed ones """
+    semaphore = asyncio.Semaphore(options.concurrency)
+    many = len(queries) > 1
+    shared: t.Optional[t.IO] = None
+    #  INFO: rows of several queries written to the same file are tagged with
+    #  their index, so the file is opened once rather than by every query
+    if many and options.output and options.output != "-" and "{query}" not in options.output:
+        try:
+            if os.path.dirname(options.output):
+                os.makedirs(os.path.dirname(options.output), exist_ok=True)
+            shared = open(options.output, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+        except OSError as e:
+            print(f"scraby: {e}", file=sys.stderr)
+            await executor.close()
+            return len(queries)
+
+    async def _run(index: int, expression: exp.Select) -> bool:
+        async with semaphore:
+            try:
+                names = optimize(expression).output
+                output = open_output(options, index, ["_change", *names] if options.delta else names, many, shared)
+            except (ValueError, OSError) as e:
+                print(f"scraby: query {index}: {e}", file=sys.stderr)
+                return False
+            try:
+                if options.delta:
+                    async for change, values in executor.stream_changes(expression):
+                        output.write((change, *values))
+                else:
+                    async for values in executor.records(expression):
+                        output.write(values)
+            except UnsupportedQuery as e:
+                print(f"scraby: query {index}: {e}", file=sys.stderr)
+                return False
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"scraby: query {index}: {type(e).__name__}: {e}", file=sys.stderr)
+                return False
+            finally:
+                output.close()
+            return True
+
+    try:
+        results = await asyncio.gather(*(_run(i, x) for i, x in enumerate(queries, 1)))
+    finally:
+        await executor.close()
+        if shared is not None:
+            shared.close()
+    return results.count(False)
+
+
+def main(argv: t.Optional[t.Sequence[str]] = None, transport: t.Optional[Transport] = None) -> int:
+    """ Run the command & get its exit code
+
+    Parameters:
+        argv (list[str]): command-line arguments, `sys.argv` by default
+        transport (Transport): transport fetching pages, HTTPTransport by
+            default
+
+    """
+    args = argparse.ArgumentParser(prog="scraby", description=__doc__.split("\n\n", 1)[0])
+    args.add_argument("queries", nargs="*", help="queries to run, stdin is read if none passed")
+    args.add_argument("-f", "--file", help="file of queries separated by semicolons, - for stdin")
+    args.add_argument("--format", choices=FORMATS, default="ndjson", help="output format")
+    args.add_argument(
+        "-o", "--output",
+        help="output file, stdout by default; {query} is replaced with 1-based query index, "
+        "without it ndjson rows of all queries go to the file tagged with _query",
+    )
+    args.add_argument("--concurrency", type=int, default=16, help="max number of queries run at once")
+    args.add_argument("--max-connections", type=int, default=32, help="max number of simultaneous requests")
+    args.add_argument("--max-host-connections", type=int, default=8, help="max simultaneous requests per host")
+    args.add_argument("--cache", help="path of the response cache database")
+    args.add_argument("--workers", type=int, default=0, help="number of page parsing processes")
+    args.add_argument("--snapshot", help="path of the database of pages' rows, unchanged pages aren't parsed")
+    args.add_argument(
+        "--delta", action="store_true",
+        help="output rows inserted (+) & removed (-) since the previous run with --snapshot",
+    )
+    args.add_argument("--max-pages", type=int, help="reject queries fetching more pages")
+    args.add_argument("--max-hosts", type=int, help="reject queries fetching more distinct hosts")
+    args.add_argument("--max-selectors", type=int, help="reject queries with more distinct tag selectors")
+    args.add_argument("--explain", action="store_true", help="print plans & costs of the queries & exit")
+    options = args.parse_args(argv)
+
+    try:
+        statements = parse(read(options.queries, options.file))
+    except Exception as e:  # pylint: disable=broad-except
+        print(f"scraby: {type(e).__name__}: {e}", file=sys.stderr)
+        return 2
+    queries = [x for x in statements if isinstance(x, exp.Select)]
+    if options.explain:
+        for i, query in enumerate(queries, 1):
+            print(f"-- query {i}\n{explain(query)}\n{analyze(query)}")
+        return 0
+    if options.delta and not options.snapshot:
+        print("scraby: --delta needs --snapshot", file=sys.stderr)
+        return 2
+    if len(queries) > 1 and options.format != "ndjson" and "{query}" not in (options.output or ""):
+        print(f"scraby: {options.format} output of several queries needs {{query}} in --output", file=sys.stderr)
+        return 2
+
+    sources = []
+    for query in queries:
+        try:
+            plan = optimize(query)
+            sources.extend([x.source for x in plan.scans] if isinstance(plan, Join) else [plan.source])
+        except ValueError:
+            pass
+    transport = transport or HTTPTransport(max_idle=options.max_host_connections)
+    if options.cache:
+        transport = CachedTransport(transport, ResponseCache(options.cache))
+    executor = Executor(
+        transport=SharedTransport(ArchiveTransport(transport), sources),
+        max_connections=options.max_connections,
+        max_host_connections=options.max_host_connections,
+        workers=options.workers,
+        snapshot=Snapshot(options.snapshot) if options.snapshot else None,
+        budget=Budget(options.max_pages, options.max_hosts, options.max_selectors),
+    )
+    try:
+        for statement in statements:
+            if isinstance(statement, exp.Set):
+                executor.set(statement)
+    except ValueError as e:
+        print(f"scraby: {e}", file=sys.stderr)
+        return 2
+    return 1 if asyncio.run(run(executor, queries, options)) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,6 @@
 import typing as t
-from enum import Enum, EnumType
+from enum import Enum
+from html.parser import HTMLParser
 
 
 class HTMLTag(Enum):
@@ -130,3 +131,74 @@ class HTMLTag(Enum):
     @classmethod
     def values(cls) -> list[str]:
         return [x.value for x in cls]
+
+
+VOID_TAGS = frozenset({
+    "area", "base", "basefont", "bgsound", "br", "col", "embed", "frame", "hr", "img",
+    "input", "isindex", "keygen", "link", "meta", "param", "source", "spacer", "track", "wbr",
+})
+""" Tags having no closing tag & children """
+
+IMPLIED_END_TAGS = {
+    "li": frozenset({"li"}),
+    "p": frozenset({"p"}),
+    "dt": frozenset({"dt", "dd"}),
+    "dd": frozenset({"dt", "dd"}),
+    "tr": frozenset({"tr", "td", "th"}),
+    "td": frozenset({"td", "th"}),
+    "th": frozenset({"td", "th"}),
+    "option": frozenset({"option"}),
+}
+""" Open tags implicitly closed by the start of the tag, e.g. "<li>" by "<li>" """
+
+
+class BalancedParser(HTMLParser):
+    """ HTML parser emitting balanced start & end events
+
+    Tolerates broken markup: void & implicitly closed tags get their end
+    events, unknown closing tags are ignored and unclosed tags are closed
+    together with their parent. Subclasses handle events in `start`, `end`
+    and `data` methods.
+
+    """
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.open: t.List[str] = []
+
+    def start(self, tag: str, attrs: t.Dict[str, str]) -> None:
+        pass
+
+    def end(self, tag: str) -> None:
+        pass
+
+    def data(self, data: str) -> None:
+        pass
+
+    def handle_starttag(self, tag: str, attrs: t.List[t.Tuple[str, t.Optional[str]]]) -> None:
+        implied = IMPLIED_END_TAGS.get(tag, ())
+        while self.open and self.open[-1] in implied:
+            self.end(self.open.pop())
+        self.start(tag, {k: v or "" for k, v in attrs})
+        if tag in VOID_TAGS:
+            self.end(tag)
+        else:
+            self.open.append(tag)
+
+    def handle_startendtag(self, tag: str, attrs: t.List[t.Tuple[str, t.Optional[str]]]) -> None:
+        self.start(tag, {k: v or "" for k, v in attrs})
+        self.end(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        for i in range(len(self.open) - 1, -1, -1):
+            if self.open[i] == tag:
+                while len(self.open) > i:
+                    self.end(self.open.pop())
+                break
+
+    def handle_data(self, data: str) -> None:
+        self.data(data)
+
+    def close(self) -> None:
+        super().close()
+        while self.open:
+            self.end(self.open.pop())
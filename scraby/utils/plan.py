@@ -1 +1,191 @@
-#  TODO: define Python query things here
+import typing as t
+
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit, urlunsplit
+from sqlglot import exp
+from scraby.core.parser import dialect, LoadPage
+from scraby.utils.trace import Span
+
+
+@dataclass(frozen=True)
+class Source:
+    """ Page source defined by LOAD function
+
+    Parameters:
+        url (str): url of pages, "{page}" placeholder is replaced with page
+            index starting from 1; url without placeholder has a single page
+            unless it's a glob pattern of local archive files, e.g.
+            `file:///data/*.warc`, which pages are all archived ones
+        pages (int): number of pages from first to scrap, -1 for all pages;
+            more than 1 page of url with a single page raises ValueError
+
+    """
+    url: str
+    pages: int = -1
+
+    def __post_init__(self) -> None:
+        if self.pages > 1 and not self.paged:
+            raise ValueError(
+                f"{self.sql()} has no {{page}} placeholder in url, so it has a single page, not {self.pages}"
+            )
+
+    @classmethod
+    def from_expression(cls, expression: LoadPage) -> "Source":
+        pages = expression.expression
+        return cls(url=expression.this.name, pages=int(pages.to_py()) if pages else -1)
+
+    @property
+    def local(self) -> bool:
+        """ Whether pages are read from local archive files """
+        return self.url[:5].lower() == "file:"
+
+    @property
+    def template(self) -> str:
+        """ Url of pages with "{page}" placeholder, pages of archive files are addressed by fragment """
+        return f"{self.url}#{{page}}" if self.local and "{page}" not in self.url else self.url
+
+    @property
+    def paged(self) -> bool:
+        return "{page}" in self.template
+
+    @property
+    def canonical(self) -> "Source":
+        """ Source with normalized url & pages, equal for the same fetches
+
+        Scheme & host are lowercased, default port & fragment are dropped;
+        pages of url without placeholder are always 1.
+
+        """
+        parts = urlsplit(self.url)
+        netloc = parts.netloc.lower()
+        if (parts.scheme.lower(), parts.port) in (("http", 80), ("https", 443)):
+            netloc = netloc.rsplit(":", 1)[0]
+        url = urlunsplit((parts.scheme.lower(), netloc, parts.path or "/", parts.query, ""))
+        return Source(url=url, pages=self.pages if self.paged else 1)
+
+    def covers(self, other: "Source") -> bool:
+        """ Check whether pages of the other source are all fetched by this one """
+        return self.pages < 0 or 0 <= other.pages <= self.pages
+
+    def merge(self, other: "Source") -> "Source":
+        """ Get source covering pages of both sources of the same url """
+        return self if self.covers(other) else other
+
+    def page_url(self, index: int) -> str:
+        return self.template.replace("{page}", str(index))
+
+    def sql(self) -> str:
+        return f"LOAD('{self.url}'{f', {self.pages}' if self.pages > 0 else ''})"
+
+
+@dataclass
+class Fetch:
+    """ Fetch & parse operator shared by all LOAD functions of the same url
+
+    Parameters:
+        source (Source): canonical source covering pages of all consumers
+        consumers (list[LoadPage]): LOAD expressions reading fetched pages
+
+    """
+    source: Source
+    consumers: t.List[LoadPage] = field(default_factory=list)
+
+
+@dataclass
+class Plan:
+    """ Logical plan of the query
+
+    LOAD functions are canonicalized by url & pages: all functions of the
+    same url are collapsed into one Fetch operator with merged page range.
+
+    Parameters:
+        expression (exp.Expression): planned query
+        fetches (list[Fetch]): fetch operators in order of the first use
+
+    """
+    expression: exp.Expression
+    fetches: t.List[Fetch] = field(default_factory=list)
+    _index: t.Dict[int, Fetch] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def build(cls, expression: exp.Expression) -> "Plan":
+        plan = cls(expression)
+        fetches: t.Dict[str, Fetch] = {}
+        for load in expression.find_all(LoadPage):
+            source = Source.from_expression(load).canonical
+            if source.url not in fetches:
+                fetches[source.url] = Fetch(source)
+                plan.fetches.append(fetches[source.url])
+            fetch = fetches[source.url]
+            fetch.source = fetch.source.merge(source)
+            fetch.consumers.append(load)
+            plan._index[id(load)] = fetch
+        return plan
+
+    def fetch_of(self, expression: LoadPage) -> Fetch:
+        """ Get fetch operator reading pages for the LOAD expression """
+        return self._index[id(expression)]
+
+    def fetch_for(self, source: Source) -> Fetch:
+        """ Get fetch operator reading pages of the canonical source """
+        return next(x for x in self.fetches if x.source.url == source.url)
+
+    def explain(self, spans: t.Optional[t.Sequence[Span]] = None) -> str:
+        """ Print the plan showing which LOAD functions were collapsed
+
+        With spans of the query run (EXPLAIN ANALYZE) operators are annotated
+        with their time summed over all calls & totals of their counters, so
+        time of concurrent fetches may exceed the query's time.
+
+        """
+        lines = [f"Plan: {len(self.fetches)} fetch(es) for {len(self._index)} LOAD function(s)"]
+        stats = _stats(spans or ())
+        for stage in ("tokenize", "fold", "parse", "plan"):
+            if stage in stats:
+                lines.append(f"  {stage.capitalize()} {_actual(stats[stage])}")
+        for fetch in self.fetches:
+            collapsed = f", {len(fetch.consumers) - 1} collapsed" if len(fetch.consumers) > 1 else ""
+            pages = "all" if fetch.source.pages < 0 else fetch.source.pages
+            stat = stats.get(f"fetch {fetch.source.url}")
+            actual = f" {_actual(stat)}" if stat else ""
+            lines.append(f"  Fetch {fetch.source.url} pages={pages}{collapsed}{actual}")
+            for load in fetch.consumers:
+                lines.append(f"    <- {dialect.generate(load)} {_placement(load)}")
+        for stage in ("prefilter", "extract", "filter"):
+            if stage in stats:
+                lines.append(f"  {stage.capitalize()} {_actual(stats[stage])}")
+        return "\n".join(lines)
+
+
+def _stats(spans: t.Iterable[Span]) -> t.Dict[str, t.Dict[str, float]]:
+    """ Sum durations & numeric attributes of spans by stage, fetches by source """
+    stats: t.Dict[str, t.Dict[str, float]] = {}
+    for span in spans:
+        name = f"{span.name} {span.attrs['source']}" if span.name == "fetch" else span.name
+        stat = stats.setdefault(name, {"time": 0.0, "calls": 0})
+        stat["time"] += span.duration
+        stat["calls"] += 1
+        for key, value in span.attrs.items():
+            if isinstance(value, (int, float)) and key != "status":
+                stat[key] = stat.get(key, 0) + value
+    return stats
+
+
+def _actual(stat: t.Dict[str, float]) -> str:
+    values = ", ".join(f"{k}={int(v)}" for k, v in stat.items() if k != "time")
+    return f"(actual time={stat['time'] * 1e3:.3f} ms, {values})"
+
+
+def _placement(expression: exp.Expression) -> str:
+    """ Describe where expression is used in the query, e.g. "in FROM AS d" """
+    table = expression.parent if isinstance(expression.parent, exp.Table) else None
+    alias = f" AS {table.alias}" if table and table.alias else ""
+    node: t.Optional[exp.Expression] = expression
+    while node and not isinstance(node, (exp.From, exp.Join, exp.Where, exp.Select)):
+        node = node.parent
+    clause = type(node).__name__.upper() if node else "QUERY"
+    return f"in {clause}{alias}"
+
+
+def explain(expression: exp.Expression) -> str:
+    return Plan.build(expression).explain()
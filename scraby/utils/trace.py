@@ -0,0 +1,180 @@
+import json
+import time
+import typing as t
+
+from contextlib import contextmanager
+
+
+class Span(t.NamedTuple):
+    """ Timing of the query run stage """
+    name: str
+    start: float
+    """ Epoch time the stage started at in seconds """
+    duration: float
+    """ Duration of the stage in seconds """
+    attrs: t.Dict[str, t.Any]
+
+
+class Sink:
+    """ Receiver of the recorded spans """
+    def span(self, span: Span) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemorySink(Sink):
+    """ Sink keeping spans in a list """
+    def __init__(self) -> None:
+        self.spans: t.List[Span] = []
+
+    def span(self, span: Span) -> None:
+        self.spans.append(span)
+
+
+class JSONLinesSink(Sink):
+    """ Sink writing every span as JSON line
+
+    Parameters:
+        file (str | IO): path or text file to write to
+
+    """
+    def __init__(self, file: t.Union[str, t.TextIO]) -> None:
+        self._owned = isinstance(file, str)
+        #  INFO: sink owns the file it opened till it's closed by the tracer
+        self.file: t.TextIO = open(file, "a", encoding="utf-8") \
+            if isinstance(file, str) else file  # pylint: disable=consider-using-with
+
+    def span(self, span: Span) -> None:
+        self.file.write(json.dumps(span._asdict(), default=str) + "\n")
+
+    def close(self) -> None:
+        if self._owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class OpenTelemetrySink(Sink):
+    """ Sink reporting spans to OpenTelemetry tracer
+
+    Parameters:
+        tracer (opentelemetry.trace.Tracer): tracer to report to, the global
+            provider's one by default
+
+    """
+    def __init__(self, tracer: t.Any = None) -> None:
+        if tracer is None:
+            try:
+                from opentelemetry import trace  # type: ignore[import-not-found]  # pylint: disable=import-outside-toplevel
+            except ImportError as e:
+                raise ImportError("opentelemetry-api is required for OpenTelemetry sink") from e
+            tracer = trace.get_tracer("scraby")
+        self.tracer = tracer
+
+    def span(self, span: Span) -> None:
+        attrs = {k: v if isinstance(v, (str, bool, int, float)) else str(v) for k, v in span.attrs.items()}
+        start = int(span.start * 1e9)
+        self.tracer.start_span(span.name, start_time=start, attributes=attrs).end(
+            end_time=start + int(span.duration * 1e9)
+        )
+
+
+class _Timer:
+    __slots__ = ("tracer", "name", "attrs", "start", "started")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: t.Dict[str, t.Any]) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.start = self.started = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: t.Any) -> None:
+        self.tracer.record(self.name, self.start, time.perf_counter() - self.started, **self.attrs)
+
+
+class _NullAttrs(t.Dict[str, t.Any]):
+    """ Attributes of the disabled span, writes are dropped, so it stays empty """
+    def __setitem__(self, key: str, value: t.Any) -> None:
+        pass
+
+    def update(self, *args: t.Any, **kwargs: t.Any) -> None:
+        pass
+
+
+class _NullTimer:
+    __slots__ = ("attrs",)
+
+    def __init__(self) -> None:
+        self.attrs: t.Dict[str, t.Any] = _NullAttrs()
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc: t.Any) -> None:
+        pass
+
+
+_NULL = _NullTimer()
+
+
+class Tracer:
+    """ Recorder of query run stages' spans & counters
+
+    Disabled tracer records nothing: `span` returns shared no-op context
+    manager and `count` returns right away, so instrumented code pays a
+    single attribute check. Spans may get attributes known only at the end
+    of the stage via `timer.attrs`.
+
+    """
+    def __init__(self) -> None:
+        self.enabled = False
+        self.sinks: t.List[Sink] = []
+        self.counters: t.Dict[str, float] = {}
+
+    def span(self, name: str, **attrs: t.Any) -> t.Union[_Timer, _NullTimer]:
+        if not self.enabled:
+            return _NULL
+        return _Timer(self, name, attrs)
+
+    def record(self, name: str, start: float, duration: float, **attrs: t.Any) -> None:
+        """ Record span of the stage timed by the caller """
+        if not self.enabled:
+            return
+        span = Span(name, start, duration, attrs)
+        for sink in self.sinks:
+            sink.span(span)
+
+    def count(self, name: str, value: float = 1) -> None:
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def enable(self, *sinks: Sink) -> None:
+        self.sinks.extend(sinks)
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+        for sink in self.sinks:
+            sink.close()
+        self.sinks.clear()
+
+    @contextmanager
+    def tracing(self, *sinks: Sink) -> t.Iterator["Tracer"]:
+        """ Record spans to the sinks within the context, counters are reset """
+        enabled, previous, counters = self.enabled, self.sinks, self.counters
+        self.sinks, self.counters, self.enabled = list(sinks), {}, True
+        try:
+            yield self
+        finally:
+            self.enabled, self.sinks, self.counters = enabled, previous, counters
+
+
+tracer = Tracer()
+""" Tracer all stages of query runs are recorded with """
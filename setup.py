@@ -17,16 +17,19 @@ setup(
     url="https://github.com/dsp-shp/scraby",
     packages=find_packages(exclude=["docs", "docs.*", "tests", "tests.*"]),
     package_data={"": ["examples/**"]},
-    # entry_points={
-    #     "console_scripts": [
-    #         "scraby = scraby.utils:cli",
-    #     ],
-    # },
+    entry_points={
+        "console_scripts": [
+            "scraby = scraby.utils.cli:main",
+        ],
+    },
     python_requires=">=3.7",
     install_requires=[
         "sqlglot==25.29.0",
     ],
     extras_require={
+        "arrow": [
+            "pyarrow",
+        ],
         "dev": [
             "mypy",
             "pylint",
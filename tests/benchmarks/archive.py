@@ -0,0 +1,61 @@
+""" Archive replay benchmark
+
+Runs the same query over a generated WARC archive of pages through the
+memory-mapped local source and prints pages & megabytes per second. Pages
+are generated deterministically, so results are comparable between runs
+with no network involved. Archive is generated into the directory on first
+run.
+
+Usage:
+    python -m tests.benchmarks.archive [--archive /tmp/scraby-archive] [--pages 1000]
+
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from scraby.core.executor import Executor
+from scraby.core.parser import dialect
+from tests.benchmarks.extractor import make_page, make_query
+
+
+def save_archive(path: str, pages: int) -> None:
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        for i in range(1, pages + 1):
+            body = make_page(50 + i % 100).encode()
+            block = b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n\r\n" + body
+            file.write(
+                f"WARC/1.0\r\nWARC-Type: response\r\nWARC-Target-URI: https://example.org/{i}\r\n"
+                f"Content-Length: {len(block)}\r\n\r\n".encode() + block + b"\r\n\r\n"
+            )
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    args.add_argument("--archive", default="/tmp/scraby-archive", help="directory of the archive")
+    args.add_argument("--pages", type=int, default=1000, help="number of pages")
+    args.add_argument("--workers", type=int, nargs="+", default=[0, 2], help="numbers of workers")
+    options = args.parse_args()
+
+    path = os.path.join(options.archive, f"pages-{options.pages}.warc")
+    save_archive(path, options.pages)
+    size = os.path.getsize(path) / 2**20
+    expression = dialect.parse(make_query().replace("LOAD('https://example.org')", f"LOAD('file://{path}')"))[0]
+    for workers in options.workers:
+        executor = Executor(workers=workers, window=4 * max(workers, 1))
+        start = time.perf_counter()
+        rows = sum(1 for _ in executor.rows(expression))
+        spent = time.perf_counter() - start
+        asyncio.run(executor.close())
+        print(
+            f"workers: {workers}, rows: {rows}, "
+            f"{options.pages / spent:.1f} pages/s, {size / spent:.1f} MB/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+""" Extractor benchmark
+
+Compares single pass extraction of all query columns with one pass per
+column on a generated ~1 MB page.
+
+Usage:
+    python tests/benchmarks/extractor.py
+
+"""
+import timeit
+
+from scraby.core.extractor import columns, Extractor
+from scraby.core.parser import dialect
+
+
+COLUMNS = 30
+""" Number of projected columns """
+
+
+def make_page(items: int = 8000) -> str:
+    rows = "".join(
+        f"<div class=\"item_{i % COLUMNS}\"><span class=\"name\">item {i}</span>"
+        f"<a href=\"/items/{i}\">link</a><p>description of the item {i}</p></div>"
+        for i in range(items)
+    )
+    return f"<html><body>{rows}</body></html>"
+
+
+def make_query() -> str:
+    projections = ", ".join(
+        f"<div class=r\"item_{i}\">.a.href as c{i}" if i % 2 else f"<div class=\"item_{i}\">.span as c{i}"
+        for i in range(COLUMNS)
+    )
+    return f"SELECT {projections} FROM LOAD('https://example.org')"
+
+
+def per_column(page: str, extractors: list) -> list:
+    """ Baseline: parse the document once per column """
+    return [x.extract(page) for x in extractors]
+
+
+def main() -> None:
+    page = make_page()
+    extractor = Extractor(columns(dialect.parse(make_query())[0]))
+    single = min(timeit.repeat(lambda: extractor.extract(page), number=1, repeat=3))
+    extractors = [Extractor([x]) for x in extractor.columns]
+    scans = min(timeit.repeat(lambda: per_column(page, extractors), number=1, repeat=3))
+    print(f"page: {len(page) / 2**20:.2f} MB, columns: {COLUMNS}")
+    print(f"single pass:     {single * 1e3:>8.1f} ms")
+    print(f"per-column pass: {scans * 1e3:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
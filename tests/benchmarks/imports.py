@@ -0,0 +1,46 @@
+""" Import time benchmark
+
+Measures cold start of `python -c "import scraby.core.parser"` in fresh
+processes against importing its base dependency (SQLGlot) alone & fails if
+scraby's own share exceeds the budget. The parser is the module every query
+path and the CLI go through, so its import is what users wait for.
+
+Usage:
+    python tests/benchmarks/imports.py [--budget 20] [--module scraby.utils.cli] [--base sqlglot]
+
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+
+def startup(code: str, repeat: int) -> float:
+    """ Get best wall time of a fresh interpreter running the code in seconds """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    args.add_argument("--module", default="scraby.core.parser", help="module to import")
+    args.add_argument("--base", default="sqlglot", help="dependency whose import isn't counted")
+    args.add_argument("--budget", type=float, default=20.0, help="max import time in ms")
+    args.add_argument("--repeat", type=int, default=10, help="number of runs")
+    options = args.parse_args()
+
+    start = startup("pass", options.repeat)
+    base = startup(f"import {options.base}", options.repeat)
+    total = startup(f"import {options.module}", options.repeat)
+    spent = (total - base) * 1e3
+    print(f"import {options.base}: {(base - start) * 1e3:.1f} ms")
+    print(f"import {options.module}: {spent:.1f} ms on top (budget {options.budget:.1f} ms)")
+    sys.exit(0 if spent <= options.budget else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+""" Parser benchmark
+
+Measures parsing stages separately against number of columns in the query:
+tokenization (`ScrabyDialect.tokenize`), tag folding (`ScrabyDialect.fold_tags`)
+and SQLGlot parsing (`ScrabyParser.parse`). Time per column should stay flat
+as the query grows, which shows that parsing time grows linearly with query
+size.
+
+Results may be saved to JSON & compared to the saved ones, e.g. to catch
+regressions across SQLGlot versions.
+
+Usage:
+    python tests/benchmarks/parser.py [--output results.json] [--compare baseline.json]
+
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import typing as t
+
+from datetime import datetime, timezone
+from statistics import mean
+from sqlglot import __version__ as sqlglot_version
+from scraby.core.parser import dialect
+
+
+SIZES = (1, 10, 100, 1000)
+""" Numbers of columns in generated queries """
+
+SHAPES: t.Dict[str, t.Callable[[int], str]] = {
+    "tags": lambda i: f"<div id=\"id_{i}\" class=\"class_{i}\">",
+    "regex": lambda i: f"<span class=r\"item_{i}\\_[a-z]+\">.a.href as c{i}",
+    "load": lambda i: f"LOAD('https://example.org/{{page}}', {i + 1}).tag_{i} as c{i}",
+}
+""" Generators of the query columns by column index """
+
+STAGES = ("tokenize", "fold", "parse")
+
+
+def make_query(shape: str, size: int) -> str:
+    columns = ", ".join(SHAPES[shape](i) for i in range(size))
+    return f"SELECT {columns} FROM LOAD('https://example.org/{{page}}', 10) as d WHERE <span> > 1"
+
+
+def measure(sql: str, repeat: int) -> t.Dict[str, t.List[float]]:
+    """ Get times of every stage' runs in seconds
+
+    Tokens are folded & parsed from scratch for every run, as parser consumes
+    tags' marks of the folded tokens.
+
+    """
+    timings: t.Dict[str, t.List[float]] = {x: [] for x in STAGES}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = dialect.tokenize(sql)
+        tokenized = time.perf_counter()
+        tokens = dialect.fold_tags(sql, tokens)
+        folded = time.perf_counter()
+        dialect.parser().parse(tokens, sql)
+        parsed = time.perf_counter()
+        timings["tokenize"].append(tokenized - start)
+        timings["fold"].append(folded - tokenized)
+        timings["parse"].append(parsed - folded)
+    return timings
+
+
+def run(repeat: int) -> t.Dict[str, t.Any]:
+    results = []
+    for shape in SHAPES:
+        for size in SIZES:
+            timings = measure(make_query(shape, size), repeat if size < 1000 else max(1, repeat // 2))
+            for stage in STAGES:
+                results.append({
+                    "shape": shape,
+                    "size": size,
+                    "stage": stage,
+                    "best": min(timings[stage]),
+                    "mean": mean(timings[stage]),
+                })
+    return {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sqlglot": sqlglot_version,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def report(results: t.Dict[str, t.Any], baseline: t.Optional[t.Dict[str, t.Any]], tolerance: float) -> int:
+    """ Print results table & get number of regressions against baseline """
+    previous = {(x["shape"], x["size"], x["stage"]): x["best"] for x in (baseline or {}).get("results", [])}
+    regressions = 0
+    print(f"{'shape':>6} {'size':>5} {'stage':>9} {'best, ms':>10} {'per col, us':>12} {'vs base':>8}")
+    for x in results["results"]:
+        key = (x["shape"], x["size"], x["stage"])
+        ratio = x["best"] / previous[key] if previous.get(key) else None
+        regressed = ratio is not None and ratio > 1 + tolerance
+        regressions += regressed
+        print(
+            f"{x['shape']:>6} {x['size']:>5} {x['stage']:>9} {x['best'] * 1e3:>10.3f}"
+            f" {x['best'] / x['size'] * 1e6:>12.2f} {f'{ratio:.2f}x' if ratio else '':>8}"
+            f"{' REGRESSION' if regressed else ''}"
+        )
+    if baseline:
+        print(f"baseline: sqlglot {baseline['meta']['sqlglot']}, current: sqlglot {results['meta']['sqlglot']}")
+    return regressions
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    args.add_argument("--repeat", type=int, default=10, help="number of runs per query")
+    args.add_argument("--output", help="path of JSON file to save results to")
+    args.add_argument("--compare", help="path of JSON file with baseline results")
+    args.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against baseline")
+    options = args.parse_args()
+
+    results = run(options.repeat)
+    baseline = None
+    if options.compare:
+        with open(options.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+    regressions = report(results, baseline, options.tolerance)
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
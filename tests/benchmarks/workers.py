@@ -0,0 +1,62 @@
+""" Extraction workers benchmark
+
+Runs the same query over saved HTML fixtures with different numbers of
+extraction worker processes and prints pages per second. Fixtures are
+generated into the directory on first run.
+
+Usage:
+    python -m tests.benchmarks.workers [--fixtures /tmp/scraby-fixtures] [--pages 64]
+
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from scraby.core.executor import Executor, Response, Transport
+from scraby.core.parser import dialect
+from tests.benchmarks.extractor import make_page, make_query
+
+
+class FixtureTransport(Transport):
+    """ Transport serving saved HTML fixtures by page index """
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    async def request(self, url, headers=None):
+        index = url.rsplit("/", 1)[1]
+        with open(os.path.join(self.directory, f"{index}.html"), "rb") as file:
+            return Response(url=url, status=200, body=file.read())
+
+
+def save_fixtures(directory: str, pages: int) -> None:
+    os.makedirs(directory, exist_ok=True)
+    for i in range(1, pages + 1):
+        path = os.path.join(directory, f"{i}.html")
+        if not os.path.exists(path):
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(make_page(2000 + i))
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    args.add_argument("--fixtures", default="/tmp/scraby-fixtures", help="directory of HTML fixtures")
+    args.add_argument("--pages", type=int, default=64, help="number of pages")
+    args.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4], help="numbers of workers")
+    options = args.parse_args()
+
+    save_fixtures(options.fixtures, options.pages)
+    expression = dialect.parse(
+        make_query().replace("LOAD('https://example.org')", f"LOAD('fixture://pages/{{page}}', {options.pages})")
+    )[0]
+    for workers in options.workers:
+        executor = Executor(FixtureTransport(options.fixtures), workers=workers, window=4 * max(workers, 1))
+        start = time.perf_counter()
+        rows = sum(1 for _ in executor.rows(expression))
+        spent = time.perf_counter() - start
+        asyncio.run(executor.close())
+        print(f"workers: {workers}, rows: {rows}, {options.pages / spent:.1f} pages/s")
+
+
+if __name__ == "__main__":
+    main()
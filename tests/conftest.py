@@ -0,0 +1,72 @@
+import asyncio
+import typing as t
+import pytest
+from scraby.core.executor import Response, Transport
+
+
+class PagesTransport(Transport):
+    """ In-memory transport serving predefined pages
+
+    Records requested & responded urls and tracks number of simultaneous
+    requests overall & per host.
+
+    Parameters:
+        pages (dict[str, bytes]): bodies of the pages by url, others are 404
+        delay (float): seconds every request takes
+        delays (dict[str, float]): seconds requests take by host, `delay` for
+            the other hosts
+        statuses (dict[str, int]): statuses of the pages by url, others are 200
+        chunk (int): size of the body chunks fed to consumers of streamed
+            requests, whole bodies are fed if it's not passed
+
+    """
+    def __init__(
+        self,
+        pages: t.Dict[str, bytes],
+        delay: float = 0.0,
+        delays: t.Optional[t.Dict[str, float]] = None,
+        statuses: t.Optional[t.Dict[str, int]] = None,
+        chunk: t.Optional[int] = None,
+    ) -> None:
+        self.pages = pages
+        self.delay = delay
+        self.delays = delays or {}
+        self.statuses = statuses or {}
+        self.chunk = chunk
+        self.fed: t.Dict[str, int] = {}
+        """ Number of body bytes fed to consumers by url """
+        self.requested: t.List[str] = []
+        self.responded: t.List[str] = []
+        self.active: t.Dict[str, int] = {}
+        self.peak = self.host_peak = 0
+
+    async def request(self, url, headers=None):
+        host = url.split("/")[2]
+        self.requested.append(url)
+        self.active[host] = self.active.get(host, 0) + 1
+        self.peak = max(self.peak, sum(self.active.values()))
+        self.host_peak = max(self.host_peak, self.active[host])
+        await asyncio.sleep(self.delays.get(host, self.delay))
+        self.active[host] -= 1
+        self.responded.append(url)
+        if url not in self.pages:
+            return Response(url=url, status=404)
+        return Response(url=url, status=self.statuses.get(url, 200), body=self.pages[url])
+
+    async def stream(self, url, consumer, headers=None):
+        if self.chunk is None:
+            return await super().stream(url, consumer, headers)
+        response = await self.request(url, headers)
+        consumer.start(response.status, response.headers)
+        self.fed[url] = 0
+        for start in range(0, len(response.body), self.chunk):
+            self.fed[url] += len(response.body[start:start + self.chunk])
+            if not consumer.feed(response.body[start:start + self.chunk]):
+                break
+        return response
+
+
+@pytest.fixture
+def pages_transport() -> t.Type[PagesTransport]:
+    """ Factory of in-memory transports serving predefined pages """
+    return PagesTransport
@@ -0,0 +1,52 @@
+import pytest
+from scraby.core.analyzer import analyze, Budget, BudgetExceeded, enforce
+from scraby.core.executor import Executor, Transport
+from scraby.core.parser import dialect
+
+
+def test_analyze():
+    cost = analyze(dialect.parse(
+        "SELECT <div class=r\"item_\\d+\" id=r\"x.*\">.a.href, div.span, <div class=r\"item_\\d+\" id=r\"x.*\">,"
+        " LOAD('https://b.org', 1).p"
+        " FROM LOAD('https://a.org/{page}', 3) as a JOIN LOAD('https://A.org:443/{page}', 5) as b"
+        " JOIN LOAD('https://c.org/{page}', 2) as c"
+    )[0])
+    assert cost.loads == 4
+    assert cost.pages == 5 + 2 + 1
+    assert cost.hosts == ["b.org", "a.org", "c.org"]
+    assert cost.selectors == 3
+    assert cost.regex == 4
+    assert cost.fanout == 3 * 5 * 2
+
+
+def test_analyze_aliases():
+    """ Test columns qualified with aliases of joined sources aren't counted as tags named so """
+    expression = dialect.parse(
+        "SELECT b.span, a.<span> FROM LOAD('https://a.org/{page}', 2) as a"
+        " JOIN LOAD('https://b.org/{page}', 2) as b ON a.<a> = b.<a>"
+    )[0]
+    assert analyze(expression).selectors == 2
+    assert enforce(expression, Budget(max_selectors=2)).selectors == 2
+    with pytest.raises(BudgetExceeded, match="selectors: 2 > 1"):
+        enforce(expression, Budget(max_selectors=1))
+
+
+def test_unbounded():
+    cost = analyze(dialect.parse("SELECT <p> FROM LOAD('https://a.org/{page}') LIMIT 1")[0])
+    assert cost.pages is None and cost.fanout is None
+    assert cost.violations(Budget()) == ["pages: unbounded > 1000"]
+    assert analyze(dialect.parse("SELECT <p> FROM LOAD('https://a.org')")[0]).pages == 1
+
+
+def test_enforce():
+    expression = dialect.parse("SELECT <p>, <a>, <span> FROM LOAD('https://a.org/{page}', 50)")[0]
+    assert enforce(expression, Budget(max_pages=50, max_selectors=3)).pages == 50
+    with pytest.raises(BudgetExceeded, match="pages: 50 > 10, selectors: 3 > 2"):
+        enforce(expression, Budget(max_pages=10, max_selectors=2))
+
+    class FailingTransport(Transport):
+        async def request(self, url, headers=None):
+            raise AssertionError("Page is fetched")
+
+    with pytest.raises(BudgetExceeded):
+        Executor(FailingTransport(), budget=Budget(max_pages=10)).execute(expression)
@@ -0,0 +1,433 @@
+import asyncio
+import gzip
+import zlib
+import pytest
+from scraby.core.executor import (
+    CachedTransport, Checkpoint, Executor, HTTPTransport, Progress, ResponseCache, Snapshot, Source,
+)
+from scraby.core.parser import dialect
+from scraby.utils.trace import MemorySink, tracer
+
+
+@pytest.mark.parametrize("sql, sources", [
+    (
+        "SELECT * FROM LOAD('https://example.org')",
+        [Source("https://example.org", -1)],
+    ),
+    (
+        "SELECT LOAD('https://a.org/{page}', 2).a FROM LOAD('https://b.org', 1) as d",
+        [Source("https://a.org/{page}", 2), Source("https://b.org", 1)],
+    ),
+])
+def test_collect(sql, sources):
+    assert Executor.collect(dialect.parse(sql)[0]) == sources
+
+
+def test_fetch_limits(pages_transport):
+    pages = {f"https://{host}.org/{i}": b"" for host in "abc" for i in range(1, 11)}
+    transport = pages_transport(pages, delay=0.01)
+    executor = Executor(transport, max_connections=6, max_host_connections=2)
+    result = asyncio.run(executor.fetch(dialect.parse(
+        "SELECT * FROM LOAD('https://a.org/{page}', 10) as a, LOAD('https://b.org/{page}', 10) as b"
+        " JOIN LOAD('https://c.org/{page}', 10) as c"
+    )[0]))
+
+    assert sorted(x.response.url for x in result) == sorted(pages)
+    assert transport.peak == 6
+    assert transport.host_peak == 2
+
+
+def test_fetch_shared(pages_transport):
+    transport = pages_transport({"https://example.org/": b""}, delay=0.01)
+    result = asyncio.run(Executor(transport).fetch(dialect.parse(
+        "SELECT d.a, LOAD('https://example.org', 1).tag_1.tag_2 as b, e.c"
+        " FROM LOAD('https://example.org') as d, LOAD('https://example.org', 1) as e"
+    )[0]))
+    assert len(result) == 1
+    assert transport.requested == ["https://example.org/"]
+
+
+def test_fetch_all_pages(pages_transport):
+    pages = {f"https://a.org/{i}": b"" for i in range(1, 8)}
+    transport = pages_transport(pages, delay=0.01)
+    result = asyncio.run(Executor(transport, max_host_connections=3).fetch(
+        dialect.parse("SELECT * FROM LOAD('https://a.org/{page}')")[0]
+    ))
+    assert [x.index for x in result] == list(range(1, 8))
+
+
+def test_execute(pages_transport):
+    pages = {
+        f"https://a.org/{i}": f"""<ul>
+            <li class="item"><a href="/{i}/1">{i}.1</a></li>
+            <li class="item"><a href="/{i}/2">{i}.2</a><li class="other">x
+        </ul>""".encode()
+        for i in range(1, 3)
+    }
+    rows = Executor(pages_transport(pages, delay=0.01)).execute(dialect.parse(
+        "SELECT <li class=\"item\"> as item, <li class=r\"item|other\">.a.href, ul.li"
+        " FROM LOAD('https://a.org/{page}', 2)"
+    )[0])
+    assert [x["item"] for x in rows] == ["1.1", "1.2", None, "2.1", "2.2", None]
+    assert [x["ul.li"] for x in rows] == ["1.1", "1.2", "x", "2.1", "2.2", "x"]
+    assert [x["<li class=r\"item|other\">.a.href"] for x in rows] == ["/1/1", "/1/2", None, "/2/1", "/2/2", None]
+
+
+def test_rows_backpressure(pages_transport):
+    pages = {f"https://a.org/{i}": b"<p>p</p>" for i in range(1, 101)}
+    transport = pages_transport(pages)
+    rows = Executor(transport, window=4).rows(dialect.parse("SELECT p FROM LOAD('https://a.org/{page}')")[0])
+
+    assert next(rows) == {"p": "p"}
+    assert len(transport.requested) <= 5
+    assert len([next(rows) for _ in range(10)]) == 10
+    assert len(transport.requested) <= 15
+    rows.close()
+    assert len(list(Executor(pages_transport(pages)).rows(
+        dialect.parse("SELECT p FROM LOAD('https://a.org/{page}')")[0]
+    ))) == 100
+
+
+def test_rows_pushdown(pages_transport):
+    pages = {
+        f"https://a.org/{i}": (
+            f"<div><a href=\"/{i}\">{i}</a><span class=\"price\">{i}</span></div>" if i % 2 else "<p>empty</p>"
+        ).encode()
+        for i in range(1, 101)
+    }
+    transport = pages_transport(pages)
+    rows = Executor(transport, window=2).execute(dialect.parse(
+        "SELECT <a>.href FROM LOAD('https://a.org/{page}', 100)"
+        " WHERE <span class=\"price\"> > 4 LIMIT 3 OFFSET 1"
+    )[0])
+    assert rows == [{"<a>.href": "/7"}, {"<a>.href": "/9"}, {"<a>.href": "/11"}]
+    assert len(transport.requested) <= 14
+
+
+def test_batches(pages_transport):
+    pages = {
+        f"https://a.org/{i}": f"""<div class="item"><a href="/{i}">{i}</a></div>
+            <div class="item"><a href="/{i}">{i}</a></div><div class="other"></div>""".encode()
+        for i in range(1, 4)
+    }
+    expression = dialect.parse(
+        "SELECT <div class=r\"item|other\">.class as class, <a>.href FROM LOAD('https://a.org/{page}', 3) LIMIT 8"
+    )[0]
+    batches = list(Executor(pages_transport(pages)).batches(expression, size=3))
+
+    assert [len(x) for x in batches] == [3, 3, 2]
+    assert batches[0].names == ["class", "<a>.href"]
+    assert batches[0].columns[0].dictionary == ["item", "other"]
+    assert [
+        dict(zip(x.names, y)) for x in batches for y in zip(*x.to_pydict().values())
+    ] == Executor(pages_transport(pages)).execute(expression)
+
+
+def test_analyze(pages_transport):
+    pages = {
+        f"https://a.org/{i}": f"<div><a href=\"/{i}\">{i}</a><span class=\"price\">{i}</span></div>".encode()
+        for i in range(1, 4)
+    }
+    lines = Executor(pages_transport(pages)).analyze(
+        "SELECT <a>.href FROM LOAD('https://a.org/{page}', 3) WHERE <span class=\"price\"> > 1"
+    ).splitlines()
+
+    assert [x.split(" (")[0] for x in lines[1:5]] == ["  Tokenize", "  Fold", "  Parse", "  Plan"]
+    assert lines[5].startswith("  Fetch https://a.org/{page} pages=3 (actual time=")
+    assert lines[5].endswith("calls=3, size=171)")
+    assert lines[-2].endswith("calls=3, rows=3, passed=2)")
+    assert lines[-1].startswith("Rows: 2, total time: ")
+
+
+def test_rows_workers(pages_transport):
+    pages = {f"https://a.org/{i}": f"<div><a href=\"/{i}\">1</a></div>".encode() for i in range(1, 13)}
+    pages["https://a.org/3"] = b""
+    expression = dialect.parse(
+        "SELECT <a>.href, <a> FROM LOAD('https://a.org/{page}', 12) WHERE <a> = 1 LIMIT 9 OFFSET 1"
+    )[0]
+    rows = Executor(pages_transport(pages), workers=2).execute(expression)
+    assert rows == Executor(pages_transport(pages)).execute(expression)
+    assert [x["<a>.href"] for x in rows] == ["/2", *(f"/{i}" for i in range(4, 12))]
+
+
+def test_workers_pool(pages_transport):
+    """ Test queries run by the same executor share its process pool till close """
+    pages = {f"https://a.org/{i}": f"<p>{i}</p><b>b{i}</b>".encode() for i in range(1, 5)}
+    executor = Executor(pages_transport(pages), workers=2)
+
+    async def run():
+        rows, pools = [], []
+        for sql in ("SELECT <p> FROM LOAD('https://a.org/{page}', 4)", "SELECT <b> FROM LOAD('https://a.org/{page}', 2)"):
+            rows.append([x async for x in executor.stream(dialect.parse(sql)[0])])
+            pools.append(executor.pool)
+        await executor.close()
+        return rows, pools
+
+    rows, pools = asyncio.run(run())
+    assert rows == [[{"<p>": str(i)} for i in range(1, 5)], [{"<b>": f"b{i}"} for i in range(1, 3)]]
+    assert pools[0] is pools[1]
+    with pytest.raises(RuntimeError):
+        pools[0].submit(int)
+
+
+def test_workers_pool_sync(pages_transport):
+    """ Test queries run in their own event loops share the pool till close """
+    pages = {f"https://a.org/{i}": f"<p>{i}</p>".encode() for i in range(1, 5)}
+    executor = Executor(pages_transport(pages), workers=1)
+    expression = dialect.parse("SELECT <p> FROM LOAD('https://a.org/{page}', 4)")[0]
+    assert executor.execute(expression) == [{"<p>": str(i)} for i in range(1, 5)]
+    pool = executor.pool
+    assert executor.execute(expression) == [{"<p>": str(i)} for i in range(1, 5)]
+    assert executor.pool is pool
+    asyncio.run(executor.close())
+    with pytest.raises(RuntimeError):
+        pool.submit(int)
+
+
+def test_http_transport():
+    """ Test keep-alive reuse, chunked & gzip bodies against local server """
+    connections = []
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        while (line := await reader.readline()):
+            path = line.split()[1].decode()
+            while await reader.readline() not in (b"\r\n", b""):
+                pass
+            if path == "/chunked":
+                writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n")
+            elif path == "/redirect":
+                writer.write(b"HTTP/1.1 302 Found\r\nLocation: /gzip\r\nContent-Length: 0\r\n\r\n")
+            elif path == "/empty":
+                writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
+            elif path == "/continue":
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            else:
+                body = gzip.compress(path.encode())
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+            await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        transport = HTTPTransport(timeout=1)
+        try:
+            responses = [
+                await transport.request(f"http://127.0.0.1:{port}{path}")
+                for path in ("/chunked", "/redirect", "/empty", "/continue", "/page")
+            ]
+        finally:
+            await transport.close()
+            server.close()
+        return responses
+
+    responses = asyncio.run(run())
+    assert [(x.status, x.body) for x in responses] == [
+        (200, b"hello"), (200, b"/gzip"), (204, b""), (200, b"ok"), (200, b"/page"),
+    ]
+    assert len(connections) == 1
+
+
+def test_streamed_extraction():
+    """ Test download of gzip chunked pages is aborted once the rows within LIMIT are read """
+    written = []
+
+    async def handle(reader, writer):
+        line = await reader.readline()
+        index = line.split()[1].decode().strip("/")
+        while await reader.readline() not in (b"\r\n", b""):
+            pass
+        writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\nContent-Encoding: gzip\r\n\r\n")
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        parts = [
+            f"<html><head><title>Page {index}</title></head><body><svg><title>Icon</title></svg>".encode(),
+            *[b"<p>text</p>" * 1000] * 20,
+        ]
+        written.append(0)
+        try:
+            for part in parts:
+                chunk = compressor.compress(part) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                await writer.drain()
+                written[-1] += 1
+                await asyncio.sleep(0.01)
+            writer.write(b"0\r\n\r\n")
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def run(sql):
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        executor = Executor(HTTPTransport())
+        try:
+            return [x async for x in executor.stream(dialect.parse(sql.format(port=port))[0])]
+        finally:
+            await executor.close()
+            server.close()
+
+    sink = MemorySink()
+    with tracer.tracing(sink):
+        rows = asyncio.run(run("SELECT <title> FROM LOAD('http://127.0.0.1:{port}/1') LIMIT 1"))
+    assert rows == [{"<title>": "Page 1"}]
+    assert [x.attrs["truncated"] for x in sink.spans if x.name == "fetch.body"] == [True]
+    assert written[-1] < 5
+
+    #  INFO: without LIMIT titles of the whole page are extracted, e.g. of SVG icons
+    rows = asyncio.run(run("SELECT <title> FROM LOAD('http://127.0.0.1:{port}/1')"))
+    assert rows == [{"<title>": "Page 1"}, {"<title>": "Icon"}]
+    assert written[-1] == 21
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT <title> FROM LOAD('https://a.org/{page}', 3) LIMIT 1",
+    "SELECT <title> FROM LOAD('https://a.org/{page}', 3) LIMIT 3 OFFSET 2",
+    "SELECT <title>, <div id=\"x\">.class FROM LOAD('https://a.org/{page}', 3) LIMIT 4",
+    "SELECT <title>, <div id=\"x\">.class FROM LOAD('https://a.org/{page}', 3)",
+])
+def test_streamed_extraction_rows(pages_transport, sql):
+    """ Test streamed pages produce the same rows as parsed whole ones """
+    pages = {
+        f"https://a.org/{i}": (
+            f"<title>Page {i}</title><div id=x class=c{i}><svg><title>Icon {i}</title></svg></div>"
+            f"<svg><title>Logo</title></svg><div id=x class=d{i}></div>"
+        ).encode()
+        for i in range(1, 4)
+    }
+    expression = dialect.parse(sql)[0]
+    transport = pages_transport(pages, chunk=16)
+    streamed = Executor(transport).execute(expression)
+    assert streamed == Executor(pages_transport(pages), workers=1).execute(expression)
+    #  INFO: only pages of queries with LIMIT are streamed, the first page has the only needed row of LIMIT 1
+    assert bool(transport.fed) is ("LIMIT" in sql)
+    if "LIMIT 1" in sql:
+        assert transport.fed["https://a.org/1"] < len(pages["https://a.org/1"])
+
+
+def test_cached_transport(tmp_path):
+    """ Test cache hits & conditional revalidation against local server """
+    version, requests = ["1"], []
+
+    async def handle(reader, writer):
+        while await reader.readline():
+            headers = {}
+            while (header := await reader.readline()) not in (b"\r\n", b""):
+                name, value = header.decode().split(":", 1)
+                headers[name.lower()] = value.strip()
+            requests.append(headers.get("if-none-match"))
+            if headers.get("if-none-match") == f"\"v{version[0]}\"":
+                #  INFO: 304 has no body even without Content-Length on keep-alive connection
+                writer.write(f"HTTP/1.1 304 Not Modified\r\nETag: \"v{version[0]}\"\r\n\r\n".encode())
+            else:
+                body = f"<p>{version[0]}</p>".encode()
+                writer.write(
+                    f"HTTP/1.1 200 OK\r\nETag: \"v{version[0]}\"\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                    + body
+                )
+            await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+        cache = ResponseCache(str(tmp_path / "cache.db"))
+        transport = CachedTransport(HTTPTransport(timeout=1), cache, ttl=None)
+        bodies = []
+        try:
+            bodies.append((await transport.request(url)).body)
+            bodies.append((await transport.request(url)).body)
+            transport.ttl = 0
+            bodies.append((await transport.request(url)).body)
+            version[0] = "2"
+            bodies.append((await transport.request(url)).body)
+        finally:
+            await transport.close()
+            server.close()
+        return cache, bodies
+
+    cache, bodies = asyncio.run(run())
+    assert bodies == [b"<p>1</p>", b"<p>1</p>", b"<p>1</p>", b"<p>2</p>"]
+    assert requests == [None, "\"v1\"", "\"v1\""]
+    assert (cache.hits, cache.misses, cache.revalidations) == (1, 2, 1)
+    cache.close()
+
+
+def test_set_cache_ttl(tmp_path, pages_transport):
+    executor = Executor(pages_transport({}), cache=ResponseCache(str(tmp_path / "cache.db")))
+    for ttl, sql in ((60, "SET cache_ttl = 60"), (None, "SET cache_ttl = NULL")):
+        assert executor.execute(dialect.parse(sql)[0]) == []
+        assert executor.transport.ttl == ttl
+    with pytest.raises(ValueError):
+        executor.execute(dialect.parse("SET timeout = 1")[0])
+
+
+def test_checkpoint_resume(tmp_path, pages_transport):
+    pages = {f"https://a.org/{i}": f"<p>{i}.1</p><p>{i}.2</p>".encode() for i in range(1, 21)}
+    expression = dialect.parse("SELECT p FROM LOAD('https://a.org/{page}', 20) OFFSET 1")[0]
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.db"), interval=4)
+    transport = pages_transport(pages)
+    rows = Executor(transport, window=2, checkpoint=checkpoint).rows(expression)
+
+    assert [next(rows)["p"] for _ in range(8)] == ["1.2", *(f"{i}.{j}" for i in range(2, 5) for j in (1, 2)), "5.1"]
+    rows.close()
+    assert checkpoint.commits == 2
+
+    transport = pages_transport(pages)
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.db"), interval=4)
+    rows = list(Executor(transport, window=2, checkpoint=checkpoint).rows(expression))
+    assert rows[0] == {"p": "5.1"}
+    assert len(rows) == 32
+    assert transport.requested[0] == "https://a.org/5"
+    assert checkpoint.commits == 4
+
+    #  INFO: completed run clears its checkpoint, so the next one starts over
+    assert checkpoint.load(dialect.generate(expression)) == Progress()
+    assert len(Executor(pages_transport(pages), checkpoint=checkpoint).execute(expression)) == 39
+    limited = dialect.parse("SELECT p FROM LOAD('https://a.org/{page}', 20) LIMIT 3")[0]
+    for _ in range(2):
+        assert len(Executor(pages_transport(pages), checkpoint=checkpoint).execute(limited)) == 3
+
+
+@pytest.mark.parametrize("workers", [0, 1])
+def test_checkpoint_error_pages(tmp_path, pages_transport, workers):
+    """ Test error pages produce no rows & are fetched again by the next run """
+    pages = {f"https://a.org/{i}": f"<p>{i}</p>".encode() for i in range(1, 5)}
+    expression = dialect.parse("SELECT p FROM LOAD('https://a.org/{page}', 4)")[0]
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.db"))
+    transport = pages_transport(pages, statuses={"https://a.org/3": 500})
+    rows = Executor(transport, checkpoint=checkpoint, workers=workers).execute(expression)
+    assert rows == [{"p": "1"}, {"p": "2"}, {"p": "4"}]
+    progress = checkpoint.load(dialect.generate(expression))
+    assert [progress.done(x) for x in range(1, 5)] == [True, True, False, True]
+
+    transport = pages_transport(pages)
+    rows = Executor(transport, checkpoint=checkpoint, workers=workers).execute(expression)
+    assert rows == [{"p": "3"}]
+    assert transport.requested == ["https://a.org/3"]
+    assert checkpoint.load(dialect.generate(expression)) == Progress()
+
+
+def test_snapshot_changes(tmp_path, pages_transport):
+    pages = {f"https://a.org/{i}": f"<p>{i}.1</p><p>{i}.2</p>".encode() for i in range(1, 5)}
+    expression = dialect.parse("SELECT p FROM LOAD('https://a.org/{page}')")[0]
+    snapshot = Snapshot(str(tmp_path / "snapshot.db"))
+
+    def run(workers=0):
+        return list(Executor(pages_transport(pages), snapshot=snapshot, workers=workers).changes(expression))
+
+    assert run() == [("+", {"p": f"{i}.{j}"}) for i in range(1, 5) for j in (1, 2)]
+    assert (snapshot.hits, snapshot.misses) == (0, 4)
+    assert run() == []
+    assert snapshot.hits == 4
+
+    pages["https://a.org/2"] = b"<p>2.1</p><p>2.3</p>"
+    del pages["https://a.org/4"]
+    assert run(workers=1) == [
+        ("+", {"p": "2.3"}), ("-", {"p": "2.2"}), ("-", {"p": "4.1"}), ("-", {"p": "4.2"}),
+    ]
+    assert snapshot.urls(dialect.generate(expression)) == [f"https://a.org/{i}" for i in range(1, 4)]
+    assert len(Executor(pages_transport(pages), snapshot=snapshot).execute(expression)) == 6
@@ -0,0 +1,116 @@
+import pytest
+from scraby.core.extractor import column, columns, Extraction, Extractor, Matcher, Selector
+from scraby.core.parser import dialect, Tag
+
+
+HTML = """
+<div id="a" class="x"><span class="x1">1</span><a href="/a">A</a></div>
+<div id="b" class="y"><span class="x2">2</span><span class="z">3</span></div>
+<span class="x10">4</span>
+"""
+DIVS = [{"id": "a", "class": "x"}, {"id": "b", "class": "y"}]
+""" Attributes of the document's `<div>` elements """
+
+
+def tags(sql):
+    return [x.find(Tag) for x in dialect.parse(f"SELECT {sql}")[0].expressions]
+
+
+@pytest.mark.parametrize("sql, selected", [
+    ("<div id=\"a\">", ["a"]),
+    ("<div id=\"a\" class=\"y\">", []),
+    ("<div id=r\"[ab]\">", ["a", "b"]),
+    ("<div id=r\"a|b\" class=r\"y\">", ["b"]),
+    ("<div name=r\".*\">", []),
+])
+def test_matcher(sql, selected):
+    tag, = tags(sql)
+    matcher = Matcher(tag)
+    assert [x["id"] for x in DIVS if matcher(x)] == selected
+
+
+def test_selector():
+    extractor = Extractor(columns(dialect.parse(
+        "SELECT <span class=r\"x\\d\"> as a, <div id=\"a\"> as b, <span class=r\"x\\d\"> as c,"
+        " <span class=r\"x\\d+\"> as d, <div> as e"
+    )[0]))
+    selector = extractor.selector
+    assert len(selector.matchers) == 4
+    assert {x.pattern for _, m in selector.index["span"] for _, x in m.patterns} == {"x\\d", "x\\d+"}
+    rows = extractor.extract(HTML)
+    assert [[x[name] for x in rows if x[name] is not None] for name in "abcde"] == [
+        ["1", "2"], ["1A"], ["1", "2"], ["1", "2", "4"], ["1A", "23"],
+    ]
+
+
+def test_shared_matchers():
+    first, second = Selector(tags("<div id=\"a\" class=\"x\">, <span>")), Selector(tags("<div class=\"x\" id=\"a\">"))
+    assert second.matchers[0] is first.matchers[0]
+    assert second.tags[0] is first.tags[0]
+
+
+@pytest.mark.parametrize("sql, sources, tag, path, source", [
+    ("d.<div class=\"x\">.a.href", (), "div", ("a", "href"), "d"),
+    ("d.div.a", (), "div", ("a",), "d"),
+    ("b.span", (), "b", ("span",), None),
+    ("b.span", ("b",), "span", (), "b"),
+    ("<div>.a", (), "div", ("a",), None),
+])
+def test_column_source(sql, sources, tag, path, source):
+    found = column(dialect.parse(f"SELECT {sql}")[0].expressions[0], sources)
+    assert (found.tag.this.value, found.path, found.source) == (tag, path, source)
+
+
+def test_extraction_complete():
+    extractor = Extractor(columns(dialect.parse("SELECT <title>, <div id=\"b\">.class")[0]))
+    extraction = Extraction(extractor, limit=1)
+    for chunk, complete in [("<title>T", False), ("</title><div id=a", False), (" class=x><div id=b class=y>", True)]:
+        extraction.feed(chunk)
+        assert extraction.complete is complete
+    assert extraction.rows() == [{"<title>": "T", "<div id=\"b\">.class": "y"}]
+
+    #  INFO: repeated titles, e.g. of SVG icons, are extracted without limit
+    html = "<title>T</title><div id=b class=y></div><svg><title>Icon</title></svg>"
+    extraction = Extraction(extractor)
+    extraction.feed(html)
+    assert not extraction.complete
+    extraction.close()
+    assert extraction.rows() == extractor.extract(html) == [
+        {"<title>": "T", "<div id=\"b\">.class": "y"}, {"<title>": "Icon", "<div id=\"b\">.class": None},
+    ]
+
+
+def test_extractor():
+    extractor = Extractor(columns(dialect.parse(
+        "SELECT <div>.span as span, <div>.a.href as href, div.a FROM LOAD('https://example.org')"
+    )[0]))
+    assert extractor.extract(HTML) == [
+        {"span": "1", "href": "/a", "div.a": "A"},
+        {"span": "2", "href": None, "div.a": None},
+        {"span": "3", "href": None, "div.a": None},
+    ]
+
+
+@pytest.mark.parametrize("sql, html, rows", [
+    (
+        # Test nested matches of both tag & child path are emitted once
+        "<div>.div.span as a, <div> as b",
+        "<div>x<div><div><span>1</span></div><span>2</span></div></div>",
+        [{"a": "1", "b": "x12"}, {"a": "2", "b": "12"}, {"a": None, "b": "1"}],
+    ),
+    (
+        # Test void & implicitly closed tags
+        "<li>.img.src as src, <li> as li, div.li",
+        "<div><li><img src=\"1\">a<li>b<img src=\"2\"/></div><li>c",
+        [{"src": "1", "li": "a", "div.li": "a"}, {"src": "2", "li": "b", "div.li": "b"}, {"src": None, "li": "c", "div.li": None}],
+    ),
+    (
+        # Test last part named as tag selects attribute of elements having it, descendants of others
+        "<a>.title as a, <div>.span as s, <div>.label.form as f",
+        "<a title=\"T\">x</a><a><title>y</title></a><div span=\"2\"><span>1</span><label form=\"f\"></label></div>",
+        [{"a": "T", "s": "2", "f": "f"}, {"a": "y", "s": None, "f": None}],
+    ),
+])
+def test_extractor_paths(sql, html, rows):
+    extractor = Extractor(columns(dialect.parse(f"SELECT {sql} FROM LOAD('https://example.org')")[0]))
+    assert extractor.extract(html) == rows
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import pytest
+from scraby.core.executor import Executor
+from scraby.core.join import HashTable
+from scraby.core.parser import dialect
+
+
+#  INFO: 3 pages of products & 1 page of prices, products of page 3 have no prices
+PAGES = {
+    **{
+        f"https://shop.org/{i}": "".join(
+            f"<div class=\"item\"><a href=\"/p/{i}{j}\">{i}{j}</a></div>" for j in range(1, 3)
+        ).encode()
+        for i in range(1, 4)
+    },
+    "https://prices.org/": "".join(
+        f"<tr><td class=\"sku\">{i}{j}</td><td class=\"price\">{i * 10 + j}</td></tr>"
+        for i in range(1, 3) for j in range(1, 3)
+    ).encode(),
+}
+
+
+def query(sql):
+    return dialect.parse(sql)[0]
+
+
+def test_hash_table_spill():
+    table = HashTable(0, memory=HashTable.ROW_SIZE * 10, partitions=4, track=True)
+    for i in range(100):
+        table.insert((str(i % 50), f"b{i}"))
+    table.insert((None, "null"))
+    assert 0 < table.spilled <= 4
+    assert table.size <= table.memory
+    directory = table.directory
+    assert directory is not None and os.listdir(directory)
+
+    joined = []
+    for key in map(str, range(0, 60, 2)):
+        entries = table.probe(("p", key), key)
+        for entry in entries or ():
+            entry[1] = True
+            joined.append((key, entry[0][1]))
+    for row, entries in table.deferred():
+        for entry in entries:
+            entry[1] = True
+            joined.append((row[1], entry[0][1]))
+    assert sorted(joined) == sorted((str(i % 50), f"b{i}") for i in range(100) if i % 2 == 0)
+    assert sorted(x[1] for x in table.unmatched()) == sorted(["null", *(f"b{i}" for i in range(100) if i % 2)])
+    table.close()
+    assert not os.path.exists(directory)
+
+
+@pytest.mark.parametrize("memory", [64 * 2**20, 100])
+def test_join(memory, pages_transport):
+    rows = Executor(pages_transport(PAGES), join_memory=memory).execute(query(
+        "SELECT s.<div class=\"item\">.a as sku, p.<td class=\"price\"> as price"
+        " FROM LOAD('https://shop.org/{page}', 3) as s JOIN LOAD('https://prices.org') as p"
+        " ON sku = p.<td class=\"sku\"> WHERE price > 11"
+    ))
+    assert sorted(rows, key=lambda x: x["sku"]) == [
+        {"sku": "12", "price": "12"}, {"sku": "21", "price": "21"}, {"sku": "22", "price": "22"},
+    ]
+
+
+@pytest.mark.parametrize("memory", [64 * 2**20, 100])
+def test_left_join(memory, pages_transport):
+    #  INFO: build side is the preserved one, unmatched rows are produced at the end
+    rows = Executor(pages_transport(PAGES), join_memory=memory).execute(query(
+        "SELECT p.<td class=\"sku\"> as sku, s.<div class=\"item\">.a.href as href"
+        " FROM LOAD('https://prices.org') as p LEFT JOIN LOAD('https://shop.org/{page}') as s"
+        " ON p.<td class=\"sku\"> = s.<div class=\"item\">.a AND s.<div class=\"item\">.a.href LIKE '%1'"
+    ))
+    assert sorted(rows, key=lambda x: x["sku"]) == [
+        {"sku": "11", "href": "/p/11"}, {"sku": "12", "href": None},
+        {"sku": "21", "href": "/p/21"}, {"sku": "22", "href": None},
+    ]
+    rows = Executor(pages_transport(PAGES), join_memory=memory).execute(query(
+        "SELECT s.<div class=\"item\">.a as sku, p.<td class=\"price\"> as price"
+        " FROM LOAD('https://shop.org/{page}', 3) as s LEFT JOIN LOAD('https://prices.org') as p"
+        " ON sku = p.<td class=\"sku\">"
+    ))
+    #  INFO: rows of spilled partitions are joined at the end
+    assert sorted(rows, key=lambda x: x["sku"]) == [
+        {"sku": "11", "price": "11"}, {"sku": "12", "price": "12"}, {"sku": "21", "price": "21"},
+        {"sku": "22", "price": "22"}, {"sku": "31", "price": None}, {"sku": "32", "price": None},
+    ]
+
+
+def test_join_pipelined(pages_transport):
+    transport = pages_transport(PAGES, delays={"prices.org": 0.2})
+    executor = Executor(transport)
+
+    async def _first():
+        rows = executor.records(query(
+            "SELECT s.<div class=\"item\">.a as sku FROM LOAD('https://shop.org/{page}', 3) as s"
+            " JOIN LOAD('https://prices.org') as p ON sku = p.<td class=\"sku\">"
+        ))
+        row = await rows.__anext__()
+        await rows.aclose()
+        return row
+
+    assert asyncio.run(_first()) == ("11",)
+    #  INFO: probe side pages were fetched while the build side was waited for
+    assert transport.responded[-1] == "https://prices.org/"
+    assert set(transport.responded) == set(PAGES)
+
+
+def test_self_join(pages_transport):
+    #  INFO: both sides read the same fetch operator, so every page is fetched once
+    transport = pages_transport(PAGES)
+    rows = Executor(transport).execute(query(
+        "SELECT a.<td class=\"sku\"> as sku, b.<td class=\"price\"> as price"
+        " FROM LOAD('https://prices.org') as a JOIN LOAD('https://prices.org/') as b ON sku = b.<td class=\"sku\">"
+    ))
+    assert sorted(rows, key=lambda x: x["sku"]) == [{"sku": x, "price": x} for x in ("11", "12", "21", "22")]
+    assert transport.requested == ["https://prices.org/"]
+
+    transport = pages_transport(PAGES)
+    rows = Executor(transport, window=1).execute(query(
+        "SELECT a.<div class=\"item\">.a as sku FROM LOAD('https://shop.org/{page}', 3) as a"
+        " JOIN LOAD('https://shop.org/{page}', 2) as b ON sku = b.<div class=\"item\">.a"
+    ))
+    assert sorted(x["sku"] for x in rows) == ["11", "12", "21", "22"]
+    assert sorted(transport.requested) == ["https://shop.org/1", "https://shop.org/2", "https://shop.org/3"]
@@ -0,0 +1,83 @@
+import pytest
+from scraby.core.optimizer import optimize, Predicate, Prefilter
+from scraby.core.extractor import column
+from scraby.core.parser import dialect, UnsupportedQuery
+
+
+def where(sql):
+    return dialect.parse(f"SELECT a FROM LOAD('https://example.org') WHERE {sql}")[0].args["where"].this
+
+
+@pytest.mark.parametrize("sql, row, result", [
+    ("<span> > 1", {"<span>": "2"}, True),
+    ("<span> > 1", {"<span>": "1"}, False),
+    ("<span> > 1", {"<span>": "x"}, False),
+    ("<span> > 1", {"<span>": None}, False),
+    ("<span> = 'x' OR <b> IS NULL", {"<span>": None, "<b>": None}, True),
+    ("NOT <span> = 'x' AND <b> IS NOT NULL", {"<span>": None, "<b>": "b"}, False),
+    ("NOT (<span> = 'x' AND <b> = 'y')", {"<span>": "x", "<b>": "z"}, True),
+    ("<a>.href LIKE '/items/_%'", {"<a>.href": "/items/1"}, True),
+    ("<a>.href LIKE '/items/_%'", {"<a>.href": "/items/"}, False),
+    ("<span> IN (1, 'x', -2)", {"<span>": "-2"}, True),
+    ("<span> IN (1, 'x')", {"<span>": "y"}, False),
+])
+def test_predicate(sql, row, result):
+    assert Predicate(where(sql), column)(row) is result
+
+
+def test_predicate_required():
+    predicate = Predicate(where("<span class=\"p\"> > 1 AND (<b> = 1 OR <i> = 1) AND <a>.href IS NULL AND 2 < div.p"), column)
+    assert [x.name for x in predicate.required()] == ["<span class=\"p\">", "div.p"]
+
+
+@pytest.mark.parametrize("sql, html, result", [
+    ("<span class=\"price\"> > 1", "<SPAN class=price>2</SPAN>", True),
+    ("<span class=\"price\"> > 1", "<span class=cost>2</span>", False),
+    ("<span class=\"p&q\"> > 1", "<span class=\"p&amp;q\">2</span>", True),
+    ("<span class=r\"p\"> > 1", "<span class=q>2</span>", True),
+    ("<div id=\"a\">.a.href = 'x'", "<div id=a><b href=x></b></div>", False),
+    ("<span> > 1 OR <b> > 1", "<i>2</i>", True),
+    ("<a>.title = 'x'", "<a title=x></a>", True),
+])
+def test_prefilter(sql, html, result):
+    assert Prefilter(Predicate(where(sql), column).required())(html) is result
+
+
+def test_optimize():
+    scan = optimize(dialect.parse(
+        "SELECT <a>.href as link, <span> FROM LOAD('https://example.org/{page}', 10)"
+        " WHERE <span> > 1 AND link LIKE '/%' AND <b class=\"x\"> IS NULL LIMIT 5 OFFSET 2"
+    )[0])
+    assert scan.source.url == "https://example.org/{page}"
+    assert scan.output == ["link", "<span>"]
+    assert [x.name for x in scan.columns] == ["link", "<span>", "<b class=\"x\">"]
+    assert (scan.limit, scan.offset) == (5, 2)
+    assert len(scan.prefilter.patterns) == 2
+
+
+def test_optimize_join():
+    plan = optimize(dialect.parse(
+        "SELECT l.<h2> as title, r.<span class=\"price\"> as price"
+        " FROM LOAD('https://a.org/{page}', 10) as l LEFT JOIN LOAD('https://b.org') as r"
+        " ON l.<h2>.a.href = r.<a class=\"self\">.href AND price > 1 AND l.<h2> LIKE 'x%'"
+        " WHERE title IS NOT NULL AND price IS NULL LIMIT 5"
+    )[0])
+    assert [x.source.url for x in plan.scans] == ["https://a.org/{page}", "https://b.org/"]
+    assert plan.keys == ["l.<h2>.a.href", "r.<a class=\"self\">.href"]
+    assert [x.output for x in plan.scans] == [
+        ["title", "l.<h2>.a.href", "l.<h2>"], ["price", "r.<a class=\"self\">.href"],
+    ]
+    assert [dialect.generate(x.predicate.expression) for x in plan.scans] == ["NOT title IS NULL", "price > 1"]
+    assert dialect.generate(plan.condition.expression) == "l.<h2> LIKE 'x%'"
+    assert dialect.generate(plan.predicate.expression) == "price IS NULL"
+    assert (plan.outer, plan.build, plan.limit) == (True, 1, 5)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT l.<h2> FROM LOAD('https://a.org') as l JOIN LOAD('https://b.org') as r ON l.<h2> > r.<h2>",
+    "SELECT <h2> FROM LOAD('https://a.org') as l JOIN LOAD('https://b.org') as r ON l.<h2> = r.<h2>",
+    "SELECT l.<h2> FROM LOAD('https://a.org') as l, LOAD('https://b.org') as r, LOAD('https://c.org') as c",
+])
+def test_optimize_join_unsupported(sql):
+    with pytest.raises(UnsupportedQuery):
+        optimize(dialect.parse(sql)[0])
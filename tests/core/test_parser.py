@@ -1,8 +1,9 @@
 from json import dumps
-from dataclasses import dataclass, field
+from dataclasses import dataclass
+import pickle
 import typing as t
 import pytest
-from scraby.core.parser import dialect, exp, LoadPage, ParseError, TokenError
+from scraby.core.parser import CompactTag, dialect, exp, parse, ParseCache, ParseError, Tag
 
 
 @dataclass
@@ -90,6 +91,145 @@ def test_parse(case):
         assert dumps([x.dump() for x in dialect.parse(case.sql)], default=vars) == case.exp_dump
 
 
+@dataclass
+class FoldTest:
+    """ Dataclass for tag folding tests
+
+    Compare texts of tokens folded into tags to predefined list of tags
+
+    """
+    id: str
+    sql: str
+    tags: list[str]
+
+
+@pytest.mark.parametrize("case", [
+    FoldTest(
+        # Test tags folding
+        "tags",
+        "SELECT <div id=\"id_1\" class=\"class_1\"> FROM b",
+        ["<div id=\"id_1\" class=\"class_1\">"],
+    ),
+    FoldTest(
+        # Test tags folding in confusing situations
+        "tags_confuse",
+        "SELECT <div id=\"id_1\" class=\"class_1\">, mod<div id, mod>div, c FROM b as d WHERE <span>>1",
+        ["<div id=\"id_1\" class=\"class_1\">", "<span>"],
+    ),
+    FoldTest(
+        # Test tags folding with child & alias
+        "tags_with_child_&_alias",
+        "SELECT <div id=r\"id_1\" class=\"class_1\">.tag_1 as a FROM b",
+        ["<div id=r\"id_1\" class=\"class_1\">"],
+    ),
+    FoldTest(
+        # Test tags folding with regular defined
+        "tags_with_regular",
+        "SELECT <div id=r\"tag\\_[a-z]+\\_\\_.+\" class=\"class_1\"> FROM b",
+        ["<div id=r\"tag\\_[a-z]+\\_\\_.+\" class=\"class_1\">"],
+    ),
+    FoldTest(
+        # Test broken tags are not folded
+        "tags_broken",
+        "SELECT c <div <span <b, d <p FROM b",
+        [],
+    ),
+    FoldTest(
+        # Test tag left unterminated is folded with the rest tokens
+        "tags_unterminated",
+        "SELECT a FROM b WHERE c <div <span <b",
+        ["<div <span <b"],
+    ),
+    FoldTest(
+        # Test many tags folding
+        "tags_many",
+        "SELECT " + ", ".join(f"<div id=\"id_{i}\">" for i in range(100)) + " FROM b",
+        [f"<div id=\"id_{i}\">" for i in range(100)],
+    ),
+], ids=lambda x: x.id)
+def test_fold_tags(case):
+    tokens = dialect.fold_tags(case.sql, dialect.tokenize(case.sql))
+    assert [x.text for x in tokens if Tag.__name__ in x.comments] == case.tags
+
+
+def test_parse_tags():
+    select, *_ = dialect.parse("SELECT <div id=r\"id_1\" class=\"class_1\">.tag_1 as a FROM b")
+    tag = select.find(Tag)
+    assert tag.this.value == "div"
+    assert [(x.this, x.expression, x.args.get("is_regular")) for x in tag.expressions] == [
+        ("id", "id_1", True),
+        ("class", "class_1", False),
+    ]
+
+
+def test_compact_tag():
+    first, second, third = (CompactTag.from_tag(x) for x in dialect.parse(
+        "SELECT <div class=\"a\" id=r\"b.*\">, <div id=r\"b.*\" class=\"a\">, <div class=\"b.*\"> FROM b"
+    )[0].find_all(Tag))
+    assert first is second
+    assert first != third and hash(first) == hash(second)
+    assert first.name == "div"
+    assert first.attrs == (("class", "a", False), ("id", "b.*", True))
+    assert first.sql() == "<div class=\"a\" id=r\"b.*\">"
+    assert pickle.loads(pickle.dumps(first)) is first
+
+
+def test_parse_cache():
+    cache = ParseCache(maxsize=2)
+    sql = "SELECT <div id=\"Id_1\">, a FROM LOAD('https://example.org', 1)"
+    cache.put(cache.key(dialect.fold(sql)), dialect.parse(sql))
+
+    # whitespaces & keywords' case are normalized, strings are not
+    trees = cache.get(cache.key(dialect.fold("select  <div id=\"Id_1\">,\n a from LOAD('https://example.org', 1) ")))
+    assert trees == dialect.parse(sql)
+    assert cache.get(cache.key(dialect.fold(sql.replace("Id_1", "id_1")))) is None
+    assert cache.get(cache.key(dialect.fold(sql), error_level=None)) is None
+
+    # cached trees can't be corrupted by callers
+    trees[0].find(exp.Column).replace(exp.column("b"))
+    assert cache.get(cache.key(dialect.fold(sql))) == dialect.parse(sql)
+
+    cache.put(cache.key(dialect.fold("SELECT b")), dialect.parse("SELECT b"))
+    cache.put(cache.key(dialect.fold("SELECT c")), dialect.parse("SELECT c"))
+    assert cache.get(cache.key(dialect.fold(sql))) is None
+    assert tuple(cache.info()) == (2, 3, 1, 2, 2)
+
+
+@pytest.mark.parametrize("sql,other", [
+    ("SELECT from1 FROM LOAD('https://a.org')", "SELECT FROM1 FROM LOAD('https://a.org')"),
+    ("SELECT t1from FROM LOAD('https://a.org')", "SELECT t1FROM FROM LOAD('https://a.org')"),
+    ("SELECT select_ FROM LOAD('https://a.org')", "SELECT SELECT_ FROM LOAD('https://a.org')"),
+])
+def test_parse_cache_identifiers(sql, other):
+    # keywords within identifiers are not normalized, identifiers keep their case
+    cache = ParseCache()
+    assert cache.key(dialect.fold(sql)) != cache.key(dialect.fold(other))
+    cache.put(cache.key(dialect.fold(sql)), dialect.parse(sql))
+    assert cache.get(cache.key(dialect.fold(other))) is None
+    assert cache.get(cache.key(dialect.fold(sql.replace("SELECT", "select", 1)))) == dialect.parse(sql)
+
+
+def test_parse_cache_exact():
+    # tags & comments are kept as is, so cached & uncached parsing agree
+    sql = "SELECT <div id=\"a\"> FROM LOAD('https://a.org')"
+    assert parse(sql) == dialect.parse(sql)
+    with pytest.raises(ValueError):
+        parse(sql.replace("<div id", "<div\tid"))
+    parse("SELECT a /* FROM x */ FROM b")
+    assert parse("SELECT a /* from   x */ FROM b")[0].sql() == "SELECT a /* from   x */ FROM b"
+
+
+def test_parse_cache_persistence(tmp_path):
+    cache = ParseCache()
+    sql = "SELECT <span class=r\"x.*\"> FROM LOAD('https://example.org')"
+    cache.put(cache.key(dialect.fold(sql)), dialect.parse(sql))
+    cache.save(tmp_path / "cache.pickle")
+
+    warm = ParseCache()
+    warm.load(tmp_path / "cache.pickle")
+    assert warm.get(warm.key(dialect.fold(sql))) == dialect.parse(sql)
+
+
 #  TODO: completely rewrite print tests
 # @dataclass
 # class PrintTest:
@@ -0,0 +1,79 @@
+import asyncio
+import time
+import pytest
+from scraby.core.executor import Executor, HTTPTransport
+from scraby.core.parser import dialect
+from scraby.core.scheduler import retry_after, Scheduler, Throttled
+
+
+def test_retry_after():
+    assert retry_after("3") == 3.0
+    assert retry_after(None) is None
+    assert retry_after("soon") is None
+    assert 0 <= retry_after(time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 5))) <= 5
+
+
+def test_fair_sources(pages_transport):
+    """ Small source on the same host isn't starved by a long crawl """
+    transport = pages_transport({
+        **{f"https://a.org/big/{i}": b"<p>p</p>" for i in range(1, 31)},
+        **{f"https://a.org/small/{i}": b"<p>p</p>" for i in range(1, 4)},
+    })
+    executor = Executor(transport, scheduler=Scheduler(rate=200, burst=1))
+    asyncio.run(executor.fetch(dialect.parse(
+        "SELECT * FROM LOAD('https://a.org/big/{page}', 30) as a JOIN LOAD('https://a.org/small/{page}', 3) as b"
+    )[0]))
+
+    assert len(transport.requested) == 33
+    small = [i for i, x in enumerate(transport.requested) if "/small/" in x]
+    assert max(small) < 8
+
+
+def test_throttling_server():
+    """ Rate adapts to local server throttling requests over its capacity """
+    served = []
+
+    async def handle(reader, writer):
+        while (line := await reader.readline()):
+            path = line.split()[1].decode()
+            while await reader.readline() not in (b"\r\n", b""):
+                pass
+            now = time.monotonic()
+            if len([x for x in served if now - x < 0.1]) >= 3:
+                writer.write(b"HTTP/1.1 429 Too Many Requests\r\nRetry-After: 0\r\nContent-Length: 0\r\n\r\n")
+            else:
+                served.append(now)
+                body = f"<p>{path}</p>".encode()
+                writer.write(f"HTTP/1.1 200 OK\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        writer.close()
+
+    scheduler = Scheduler(rate=200, burst=5, retries=20)
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        executor = Executor(HTTPTransport(), scheduler=scheduler)
+        try:
+            return [x async for x in executor.stream(dialect.parse(
+                f"SELECT p FROM LOAD('http://127.0.0.1:{port}/{{page}}', 12)"
+            )[0])], port
+        finally:
+            await executor.close()
+            server.close()
+
+    rows, port = asyncio.run(run())
+    assert [x["p"] for x in rows] == [f"/{i}" for i in range(1, 13)]
+    metrics = scheduler.metrics()[f"127.0.0.1:{port}"]
+    assert metrics.throttled > 0
+    assert metrics.rate < 200
+    assert metrics.queued == 0
+
+
+def test_throttled_retries(pages_transport):
+    """ Request still throttled after all retries fails instead of producing the page """
+    transport = pages_transport({"https://a.org/1": b"<p>p</p>"}, statuses={"https://a.org/1": 429})
+    executor = Executor(transport, scheduler=Scheduler(rate=1000, retries=2))
+    with pytest.raises(Throttled):
+        executor.execute(dialect.parse("SELECT p FROM LOAD('https://a.org/{page}', 1)")[0])
+    assert transport.requested == ["https://a.org/1"] * 3
@@ -0,0 +1,41 @@
+from scraby.core.response import Response
+from scraby.core.store import Progress, ResponseCache
+
+
+def test_response_cache_eviction(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_size=100)
+    for i in range(3):
+        cache.put(f"https://a.org/{i}", Response(f"https://a.org/{i}", 200, body=bytes(range(40))))
+    assert cache.evictions == 1
+    assert cache.get("https://a.org/0") is None
+    assert cache.get("https://a.org/2")[0].body == bytes(range(40))
+
+
+def test_response_cache_lru(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_size=100)
+    for i in range(2):
+        cache.put(f"https://a.org/{i}", Response(f"https://a.org/{i}", 200, body=bytes(range(40))))
+    #  INFO: access time of the hit isn't written yet, but it's considered by eviction
+    assert cache.get("https://a.org/0") is not None
+    size = cache.size
+    cache.put("https://a.org/1", Response("https://a.org/1", 200, body=bytes(range(40))))
+    assert cache.size == size
+    assert cache.get("https://a.org/0") is not None
+    cache.put("https://a.org/2", Response("https://a.org/2", 200, body=bytes(range(40))))
+    assert cache.evictions == 1
+    assert cache.get("https://a.org/1") is None
+    assert cache.get("https://a.org/0") is not None
+    cache.close()
+
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_size=100)
+    assert 0 < cache.size <= 100
+    cache.close()
+
+
+def test_progress():
+    progress = Progress()
+    for index in (1, 2, 3, 10):
+        progress.mark(index)
+    assert [x for x in range(1, 12) if progress.done(x)] == [1, 2, 3, 10]
+    assert progress.cursor == 4
+    assert len(progress.pages) == 2
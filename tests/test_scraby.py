@@ -0,0 +1,18 @@
+import subprocess
+import sys
+import scraby
+
+
+def test_lazy_import():
+    """ Test importing scraby doesn't import SQLGlot until it's used """
+    code = "import sys, scraby; print('sqlglot' in sys.modules); scraby.parse; print('sqlglot' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.split() == ["False", "True"]
+
+
+def test_lazy_attributes():
+    from scraby.core.executor import Executor
+    from scraby.core.parser import dialect
+    assert scraby.Executor is Executor
+    assert scraby.dialect is dialect
+    assert {"Executor", "dialect", "explain", "parse"} <= set(dir(scraby))
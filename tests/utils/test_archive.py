@@ -0,0 +1,67 @@
+import gzip
+from scraby.core.executor import Executor
+from scraby.core.parser import dialect
+from scraby.utils.archive import Archive, ArchiveFile
+
+
+def record(kind, url, block):
+    head = f"WARC/1.0\r\nWARC-Type: {kind}\r\nWARC-Target-URI: {url}\r\nContent-Length: {len(block)}\r\n\r\n"
+    return head.encode() + block + b"\r\n\r\n"
+
+
+def response(body, headers=""):
+    return f"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n{headers}\r\n".encode() + body
+
+
+def write_archive(path):
+    body = gzip.compress(b"<title>gzip</title>")
+    path.joinpath("a.warc").write_bytes(b"".join([
+        record("warcinfo", "", b"software: test"),
+        record("request", "https://a.org/1", b"GET /1 HTTP/1.1\r\n\r\n"),
+        record("response", "https://a.org/1", response(b"<title>one</title>")),
+        record("response", "https://a.org/2", response(
+            b"a\r\n<title>chu\r\n9\r\nnked</tit\r\n3\r\nle>\r\n0\r\n\r\n", "Transfer-Encoding: chunked\r\n"
+        )),
+        record("response", "https://a.org/3", response(body, "Content-Encoding: gzip\r\n")),
+    ]))
+    pages = [b"<title>four</title>", b"<title>five</title><p>x</p>"]
+    path.joinpath("b.html").write_bytes(b"".join(pages))
+    path.joinpath("b.html.idx").write_text(f"0 {len(pages[0])} https://b.org/4\n{len(pages[0])} {len(pages[1])}\n")
+    path.joinpath("c.html").write_bytes(b"<title>six</title>")
+
+
+def test_archive_file(tmp_path):
+    write_archive(tmp_path)
+    file = ArchiveFile(str(tmp_path / "a.warc"))
+    assert len(file) == 3
+    first = file[0]
+    assert (first.url, first.status, first.headers["content-type"]) == ("https://a.org/1", 200, "text/html")
+    #  INFO: plain payloads are views of the mapped file
+    assert isinstance(first.body, memoryview) and first.body == b"<title>one</title>"
+    assert [bytes(file[i].body) for i in (1, 2)] == [b"<title>chunked</title>", b"<title>gzip</title>"]
+    del first
+    file.close()
+
+
+def test_archive(tmp_path):
+    write_archive(tmp_path)
+    archive = Archive(str(tmp_path / "*"))
+    pages = [archive.page(i) for i in range(1, 8)]
+    assert [bytes(x.body) for x in pages[3:6]] == [
+        b"<title>four</title>", b"<title>five</title><p>x</p>", b"<title>six</title>",
+    ]
+    assert [x.url for x in pages[3:6]] == ["https://b.org/4", None, None]
+    assert pages[6] is None
+    del pages
+    archive.close()
+
+
+def test_archive_query(tmp_path):
+    write_archive(tmp_path)
+    sql = f"SELECT <title> FROM LOAD('file://{tmp_path}/*')"
+    rows = Executor().execute(dialect.parse(sql)[0])
+    assert [x["<title>"] for x in rows] == ["one", "chunked", "gzip", "four", "five", "six"]
+    rows = Executor(window=2).execute(dialect.parse(f"SELECT <title> FROM LOAD('file://{tmp_path}/*.warc', 2)")[0])
+    assert [x["<title>"] for x in rows] == ["one", "chunked"]
+    rows = Executor().execute(dialect.parse(f"SELECT <title> FROM LOAD('file://{tmp_path}/?.warc')")[0])
+    assert [x["<title>"] for x in rows] == ["one", "chunked", "gzip"]
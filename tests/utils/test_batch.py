@@ -0,0 +1,51 @@
+import pytest
+from scraby.utils.batch import Batch, DictionaryColumn, write_ipc, write_parquet
+
+
+def make_batches():
+    first, second = Batch(["a", "b"]), Batch(["a", "b"])
+    for i in range(10):
+        first.append((f"a{i % 3}", None if i % 4 else "b"))
+    second.append(("x", None))
+    return [first, second]
+
+
+def test_dictionary_column():
+    column = DictionaryColumn("a")
+    for value in ["x", None, "y", "x", None, "x", "y", "z", "x"]:
+        column.append(value)
+
+    assert column.dictionary == ["x", "y", "z"]
+    assert list(column.indices) == [0, 0, 1, 0, 0, 0, 1, 2, 0]
+    assert column.null_count == 2
+    assert column.to_pylist() == ["x", None, "y", "x", None, "x", "y", "z", "x"]
+
+
+def test_to_arrow():
+    pa = pytest.importorskip("pyarrow")
+    batch = make_batches()[0]
+    record_batch = batch.to_arrow()
+
+    assert record_batch.schema.field("a").type == pa.dictionary(pa.int32(), pa.string())
+    assert record_batch.to_pydict() == batch.to_pydict()
+    assert record_batch.column(1).null_count == 7
+
+
+def test_write_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    batches = make_batches()
+    assert write_parquet(batches, str(tmp_path / "rows.parquet")) == 11
+    table = pq.read_table(tmp_path / "rows.parquet")
+    assert table.column("a").to_pylist() == batches[0].to_pydict()["a"] + ["x"]
+
+
+def test_write_ipc(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+
+    batches = make_batches()
+    assert write_ipc(batches, str(tmp_path / "rows.arrows")) == 11
+    with pa.ipc.open_stream(str(tmp_path / "rows.arrows")) as reader:
+        table = reader.read_all()
+    assert table.column("b").to_pylist() == batches[0].to_pydict()["b"] + [None]
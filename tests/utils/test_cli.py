@@ -0,0 +1,82 @@
+import csv
+import json
+import pytest
+from scraby.utils.cli import main
+
+
+PAGES = {
+    f"https://a.org/{i}": f"<div><a href=\"/{i}\">{i}</a><span>s{i}</span></div>".encode()
+    for i in range(1, 6)
+}
+
+
+def test_ndjson(tmp_path, capsys, pages_transport):
+    queries = tmp_path / "queries.sql"
+    queries.write_text(
+        "SELECT <a>.href FROM LOAD('https://a.org/{page}', 3);\n"
+        "SELECT <span> as s FROM LOAD('https://a.org/{page}') WHERE <a> > 3;\n"
+        "SELECT <a> FROM LOAD('https://A.org:443/{page}', 2) LIMIT 1;\n"
+    )
+    transport = pages_transport(PAGES)
+
+    assert main(["-f", str(queries)], transport) == 0
+    rows = [json.loads(x) for x in capsys.readouterr().out.splitlines()]
+    assert len(transport.requested) == len(set(transport.requested))
+    assert set(PAGES) <= set(transport.requested)
+    assert [x for x in rows if x["_query"] == 1] == [{"_query": 1, "<a>.href": f"/{i}"} for i in range(1, 4)]
+    assert [x["s"] for x in rows if x["_query"] == 2] == ["s4", "s5"]
+    assert [x["<a>"] for x in rows if x["_query"] == 3] == ["1"]
+
+
+def test_csv_per_query(tmp_path, pages_transport):
+    output = tmp_path / "rows" / "{query}.csv"
+    assert main([
+        "SELECT <a>.href as href, <span> FROM LOAD('https://a.org/{page}', 2)",
+        "SELECT <a> FROM LOAD('https://a.org/{page}', 1)",
+        "--format", "csv", "--output", str(output),
+    ], pages_transport(PAGES)) == 0
+
+    with open(tmp_path / "rows" / "1.csv", newline="", encoding="utf-8") as file:
+        assert list(csv.reader(file)) == [["href", "<span>"], ["/1", "s1"], ["/2", "s2"]]
+    with open(tmp_path / "rows" / "2.csv", newline="", encoding="utf-8") as file:
+        assert list(csv.reader(file)) == [["<a>"], ["1"]]
+
+
+def test_errors(tmp_path, capsys, pages_transport):
+    assert main([
+        "SELECT <a> FROM LOAD('https://a.org/{page}', 1)", "SELECT 1", "SELECT 1 FROM LOAD('https://a.org')",
+    ], pages_transport(PAGES)) == 1
+    err = capsys.readouterr().err
+    assert "query 2: Query has no LOAD source" in err and "query 3: Unsupported column: 1" in err
+    assert main([
+        "SELECT a.<a> FROM LOAD('https://a.org/{page}', 1) as a JOIN LOAD('https://a.org/{page}', 1) as b ON a.<a> = b.<a>",
+        "--snapshot", str(tmp_path / "snapshot.db"), "--delta",
+    ], pages_transport(PAGES)) == 1
+    assert capsys.readouterr().err == "scraby: query 1: Changes of joins are not supported\n"
+    assert main(["SELECT 1 FROM", "--format", "csv"], pages_transport(PAGES)) == 2
+
+
+def test_parquet(tmp_path, pages_transport):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    output = tmp_path / "rows.parquet"
+    assert main([
+        "SELECT <a>.href as href FROM LOAD('https://a.org/{page}', 4)", "--format", "parquet", "-o", str(output),
+    ], pages_transport(PAGES)) == 0
+    assert pq.read_table(output).column("href").to_pylist() == [f"/{i}" for i in range(1, 5)]
+
+
+def test_ndjson_shared_file(tmp_path, pages_transport):
+    """ Test rows of concurrent queries written to the same file are all kept """
+    output = tmp_path / "rows" / "rows.ndjson"
+    assert main([
+        "SELECT <a>.href FROM LOAD('https://a.org/{page}', 3)",
+        "SELECT <span> as s FROM LOAD('https://a.org/{page}', 2)",
+        "--output", str(output),
+    ], pages_transport(PAGES, delay=0.01)) == 0
+
+    with open(output, encoding="utf-8") as file:
+        rows = [json.loads(x) for x in file]
+    assert [x for x in rows if x["_query"] == 1] == [{"_query": 1, "<a>.href": f"/{i}"} for i in range(1, 4)]
+    assert [x for x in rows if x["_query"] == 2] == [{"_query": 2, "s": f"s{i}"} for i in range(1, 3)]
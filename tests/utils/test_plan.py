@@ -0,0 +1,63 @@
+import pytest
+from scraby.core.parser import dialect
+from scraby.utils.plan import explain, Plan, Source
+
+
+@pytest.mark.parametrize("source, canonical", [
+    (Source("HTTPS://Example.org:443"), Source("https://example.org/", 1)),
+    (Source("http://example.org:8080/a?b=1#c"), Source("http://example.org:8080/a?b=1", 1)),
+    (Source("https://example.org/{page}", 5), Source("https://example.org/{page}", 5)),
+    (Source("FILE:///data/*.warc"), Source("file:///data/*.warc", -1)),
+])
+def test_canonical(source, canonical):
+    assert source.canonical == canonical
+
+
+@pytest.mark.parametrize("pages, merged", [
+    ((1, 3), 3),
+    ((3, 1), 3),
+    ((3, -1), -1),
+    ((-1, 3), -1),
+])
+def test_merge(pages, merged):
+    a, b = (Source("https://example.org/{page}", x) for x in pages)
+    assert a.merge(b).pages == merged
+
+
+def test_single_page_source():
+    assert Source("https://example.org", 1).canonical.pages == 1
+    assert Source("file:///data/*.warc", 5).paged
+    with pytest.raises(ValueError, match="placeholder"):
+        Source("https://example.org", 5)
+    with pytest.raises(ValueError, match="placeholder"):
+        Plan.build(dialect.parse("SELECT a FROM LOAD('https://example.org', 5)")[0])
+
+
+def test_page_url():
+    assert Source("https://example.org/{page}").page_url(2) == "https://example.org/2"
+    assert Source("file:///data/*.warc").page_url(2) == "file:///data/*.warc#2"
+    assert Source("file:///data/{page}.html").page_url(2) == "file:///data/2.html"
+
+
+def test_plan():
+    plan = Plan.build(dialect.parse(
+        "SELECT d.a, LOAD('https://example.org', 1).tag_1.tag_2 as b, e.c"
+        " FROM LOAD('https://example.org') as d, LOAD('https://example.org/{page}', 2) as e"
+        " JOIN LOAD('https://example.org/{page}', 5) as f"
+    )[0])
+    assert [(x.source, len(x.consumers)) for x in plan.fetches] == [
+        (Source("https://example.org/", 1), 2),
+        (Source("https://example.org/{page}", 5), 2),
+    ]
+    assert all(plan.fetch_of(x) is y for y in plan.fetches for x in y.consumers)
+
+
+def test_explain():
+    assert explain(dialect.parse(
+        "SELECT LOAD('https://example.org', 1).a FROM LOAD('https://example.org') as d"
+    )[0]) == "\n".join([
+        "Plan: 1 fetch(es) for 2 LOAD function(s)",
+        "  Fetch https://example.org/ pages=1, 1 collapsed",
+        "    <- LOAD('https://example.org', 1) in SELECT",
+        "    <- LOAD('https://example.org') in FROM AS d",
+    ])
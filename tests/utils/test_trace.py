@@ -0,0 +1,41 @@
+import io
+import json
+from scraby.core.parser import dialect
+from scraby.utils.trace import JSONLinesSink, MemorySink, Tracer, tracer
+
+
+def test_disabled():
+    disabled = Tracer()
+    with disabled.span("stage", a=1) as span:
+        span.attrs["b"] = 2
+        span.attrs.update(c=3)
+    disabled.count("counter")
+    assert disabled.span("stage") is disabled.span("other")
+    #  INFO: shared span keeps no attributes of the previous stages
+    assert disabled.span("other").attrs == {}
+    assert disabled.counters == {}
+
+
+def test_sinks():
+    local, memory, file = Tracer(), MemorySink(), io.StringIO()
+    local.enable(memory, JSONLinesSink(file))
+    with local.span("stage", a=1) as span:
+        span.attrs["b"] = 2
+    local.count("counter", 2)
+    local.count("counter")
+    local.disable()
+
+    assert [(x.name, x.attrs) for x in memory.spans] == [("stage", {"a": 1, "b": 2})]
+    assert memory.spans[0].duration >= 0
+    assert json.loads(file.getvalue())["attrs"] == {"a": 1, "b": 2}
+    assert local.counters == {"counter": 3}
+    assert not local.enabled and not local.sinks
+
+
+def test_parse_stages():
+    sink = MemorySink()
+    with tracer.tracing(sink):
+        dialect.parse("SELECT <div class=\"a\">.a.href FROM LOAD('https://example.org')")
+    assert [x.name for x in sink.spans] == ["tokenize", "fold", "parse"]
+    assert sink.spans[0].attrs["tokens"] > sink.spans[1].attrs["tokens"]
+    assert not tracer.enabled